@@ -0,0 +1,663 @@
+"""
+离线回测引擎：在本地K线归档上逐K线复现 execute_trade 的交易规则
+
+- 节流：TRADE_THROTTLE 波动分档、信号持久性、冷却期、日交易上限、最小ATR变动
+- 仓位：calculate_intelligent_position + calculate_dynamic_leverage
+- 止盈止损：calculate_dynamic_stop_loss_take_profit（交易所挂单按K线高低点盘中触发）
+- 持仓管理：update_trailing_stop、check_pyramid_add、execute_partial_take_profit
+
+指标与按K线可确定的量先向量化预计算，逐K线循环只处理标量状态。
+用法：python backtest.py [--days 365] [--signals signals.csv | --replay data/llm_replay.jsonl.gz]
+     python backtest.py sweep [--search grid|random] [--samples 200] [--workers N]
+"""
+
+import argparse
+import copy
+import itertools
+import json
+import math
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+import pandas as pd
+
+import main
+from main import TRADE_CONFIG, TRADE_THROTTLE
+
+# 信号与信心的整数编码（回测循环内用整数比较代替字符串）
+SIGNAL_CODES = {'BUY': 1, 'SELL': -1, 'HOLD': 0}
+CONFIDENCE_CODES = {'LOW': 0, 'MEDIUM': 1, 'HIGH': 2}
+CONFIDENCE_NAMES = ['LOW', 'MEDIUM', 'HIGH']
+
+# 回测需要的指标列
+BACKTEST_INDICATOR_COLUMNS = ['sma_20', 'sma_50', 'macd', 'macd_signal', 'rsi',
+                              'bb_upper', 'bb_lower', 'atr_20', 'atr_ratio']
+
+
+def load_backtest_bars(symbol, timeframe, days):
+    """从本地K线归档读取最近days天的K线（列字典，值为numpy数组）"""
+    archive = main.get_candle_archive(symbol, timeframe)
+    bars_per_day = 86400 // main.exchange.parse_timeframe(timeframe)
+    columns = archive.read(tail=int(days * bars_per_day))
+    return {name: np.array(values) for name, values in columns.items()}
+
+
+def prepare_backtest_features(bars):
+    """预计算与交易参数无关的逐K线特征：指标、趋势、布林带宽占比"""
+    high = np.asarray(bars['high'], dtype=np.float64)
+    low = np.asarray(bars['low'], dtype=np.float64)
+    close = np.asarray(bars['close'], dtype=np.float64)
+    volume = np.asarray(bars['volume'], dtype=np.float64)
+    indicators = main.evaluate_indicators(
+        BACKTEST_INDICATOR_COLUMNS, {'high': high, 'low': low, 'close': close, 'volume': volume})
+
+    # 趋势（规则同market_trend_from_row）：1 强势上涨，-1 强势下跌，0 震荡整理
+    short_up = close > indicators['sma_20']
+    medium_up = close > indicators['sma_50']
+    trend = np.where(short_up & medium_up, 1, np.where(~short_up & ~medium_up, -1, 0)).astype(np.int8)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        bb_width = np.where(close > 0, (indicators['bb_upper'] - indicators['bb_lower']) / close, 0.0)
+
+    features = {
+        'timestamp': np.asarray(bars['timestamp'], dtype=np.int64),
+        'open': np.asarray(bars['open'], dtype=np.float64),
+        'high': high,
+        'low': low,
+        'close': close,
+        'trend': trend,
+        'macd_bullish': indicators['macd'] > indicators['macd_signal'],
+        'bb_width': bb_width,
+    }
+    for column in ('rsi', 'bb_upper', 'bb_lower', 'atr_20', 'atr_ratio'):
+        features[column] = indicators[column]
+    return features
+
+
+def trend_following_signals(features):
+    """默认信号源（替代LLM信号）：强势上涨做多、强势下跌做空，MACD同向时为HIGH信心"""
+    trend = features['trend']
+    signals = trend.astype(np.int8)
+    agrees = np.where(trend > 0, features['macd_bullish'], ~features['macd_bullish'])
+    confidences = np.where((trend != 0) & agrees, CONFIDENCE_CODES['HIGH'], CONFIDENCE_CODES['MEDIUM']).astype(np.int8)
+    return signals, confidences
+
+
+def load_signal_file(path, timestamps):
+    """读取信号CSV（timestamp,signal,confidence），按K线时间对齐；缺失的K线视为HOLD"""
+    frame = pd.read_csv(path)
+    frame = frame.drop_duplicates('timestamp', keep='last').set_index('timestamp')
+    aligned = frame.reindex(timestamps)
+    signals = aligned['signal'].map(SIGNAL_CODES).fillna(0).to_numpy(dtype=np.int8)
+    confidences = aligned['confidence'].map(CONFIDENCE_CODES).fillna(CONFIDENCE_CODES['MEDIUM']).to_numpy(dtype=np.int8)
+    return signals, confidences
+
+
+def load_replay_signals(path, timestamps):
+    """从DeepSeek决策录制文件（LLMReplayStore）按K线时间对齐信号，内存中完成，不访问网络。
+    没有录制决策的K线会被统计并报告（按HOLD处理），返回 (signals, confidences, 缺失K线时间列表)"""
+    decisions = {}
+    for record in main.LLMReplayStore(path, mode='replay').records():
+        signal = record.get('signal') or {}
+        if record.get('bar') is not None and not signal.get('is_fallback', False):
+            decisions[record['bar']] = signal
+
+    timestamps = np.asarray(timestamps).tolist()
+    signals = np.zeros(len(timestamps), dtype=np.int8)
+    confidences = np.full(len(timestamps), CONFIDENCE_CODES['MEDIUM'], dtype=np.int8)
+    missing = []
+    for i, timestamp in enumerate(timestamps):
+        signal = decisions.get(timestamp)
+        if signal is None:
+            missing.append(timestamp)
+            continue
+        signals[i] = SIGNAL_CODES.get(signal.get('signal'), 0)
+        confidences[i] = CONFIDENCE_CODES.get(signal.get('confidence'), CONFIDENCE_CODES['MEDIUM'])
+
+    if missing:
+        print(f"⚠️ 决策回放缺失 {len(missing)}/{len(timestamps)} 根K线（按HOLD处理），"
+              f"首个缺失: {pd.to_datetime(missing[0], unit='ms')}")
+    return signals, confidences, missing
+
+
+def _precompute_rule_arrays(features, trade_config, throttle):
+    """把只依赖K线与配置（不依赖持仓状态）的规则量向量化预计算，返回逐K线的Python列表"""
+    close = features['close']
+    rsi = features['rsi']
+    bb_width = features['bb_width']
+    atr = features['atr_20']
+    atr_ratio = features['atr_ratio']
+    trend = features['trend']
+
+    # 波动分档（优先ATR，其次BB宽度）：0 low，1 mid，2 high
+    by_atr = np.where(atr_ratio < throttle['low_atr_ratio'], 0, np.where(atr_ratio > throttle['high_atr_ratio'], 2, 1))
+    by_bb = np.where(bb_width < throttle['low_bb_width'], 0, np.where(bb_width > throttle['high_bb_width'], 2, 1))
+    regime = np.where(atr_ratio > 0, by_atr, by_bb)
+
+    # 动态杠杆（calculate_dynamic_leverage），按信心分别计算
+    leverage_config = trade_config['dynamic_leverage']
+    if leverage_config.get('enable_dynamic_leverage', True):
+        volatility = leverage_config['volatility_adjustment']
+        rsi_adjustment = leverage_config['rsi_adjustment']
+        volatility_multiplier = np.where(bb_width < 0.02, volatility['low_volatility'],
+                                         np.where(bb_width > 0.05, volatility['high_volatility'], 1.0))
+        rsi_multiplier = np.where(rsi < 30, rsi_adjustment['oversold'],
+                                  np.where(rsi > 70, rsi_adjustment['overbought'], 1.0))
+        leverage = []
+        for name in CONFIDENCE_NAMES:
+            low_leverage, high_leverage = leverage_config['leverage_ranges'].get(name, [4, 6])
+            raw = (low_leverage + high_leverage) / 2 * volatility_multiplier * rsi_multiplier
+            leverage.append(np.round(np.clip(raw, leverage_config['min_leverage'], leverage_config['max_leverage']), 1))
+    else:
+        leverage = [np.full(close.shape, 5.0)] * 3
+
+    # 智能仓位的趋势/RSI倍数（calculate_intelligent_position）
+    position_config = trade_config['position_management']
+    size_multiplier = (np.where(trend != 0, position_config['trend_strength_multiplier'], 1.0)
+                       * np.where((rsi > 75) | (rsi < 25), 0.7, 1.0))
+
+    # 止损基础比例与波动倍数（calculate_dynamic_stop_loss_take_profit）
+    with np.errstate(invalid='ignore', divide='ignore'):
+        atr_stop = np.where((atr > 0) & (close > 0), np.clip(atr * 2.5 / close, 0.005, 0.03), 0.015)
+    bands_valid = (features['bb_upper'] > 0) & (features['bb_lower'] > 0)
+    stop_volatility = np.where(bands_valid & (bb_width > 0.05), 1.3, np.where(bands_valid & (bb_width < 0.02), 0.8, 1.0))
+
+    # 动态风险收益比（calculate_dynamic_risk_reward_ratio）
+    rr_config = trade_config.get('risk_reward', {})
+    if rr_config.get('enable_dynamic_rr', True):
+        risk_reward = np.where(trend > 0, rr_config.get('trend_bullish', 5),
+                               np.where(trend < 0, rr_config.get('trend_bearish', 5),
+                                        rr_config.get('trend_consolidation', 1.5)))
+    else:
+        risk_reward = np.full(close.shape, 3.0)
+
+    return {
+        'regime': regime.tolist(),
+        'leverage': [array.tolist() for array in leverage],
+        'size_multiplier': size_multiplier.tolist(),
+        'atr_stop': atr_stop.tolist(),
+        'stop_volatility': stop_volatility.tolist(),
+        'risk_reward': np.asarray(risk_reward, dtype=np.float64).tolist(),
+    }
+
+
+def run_backtest(features, signals, confidences, trade_config=None, throttle=None, start=None):
+    """逐K线回放交易规则。signals/confidences为整数编码数组（见SIGNAL_CODES/CONFIDENCE_CODES），
+    在每根K线收盘时决策并按收盘价成交；持仓的止盈止损挂单在下一根K线内按最高/最低价触发。
+    返回 {'equity': 逐K线权益, 'trades': 成交明细DataFrame, 'metrics': 汇总指标}"""
+    trade_config = TRADE_CONFIG if trade_config is None else trade_config
+    throttle = TRADE_THROTTLE if throttle is None else throttle
+    backtest_config = trade_config.get('backtest', {})
+    position_config = trade_config['position_management']
+    trailing_config = trade_config.get('trailing_stop', {})
+    partial_config = trade_config.get('partial_take_profit', {})
+
+    rules = _precompute_rule_arrays(features, trade_config, throttle)
+    regime_params = [throttle[name] for name in ('low', 'mid', 'high')]
+    persist_need = [params['persist'] for params in regime_params]
+    cooldown_need = [params['cooldown'] for params in regime_params]
+    min_move_atr = [params['min_move_atr'] for params in regime_params]
+    max_trades_day = [params['max_trades_day'] for params in regime_params]
+
+    timestamps = features['timestamp'].tolist()
+    opens = features['open'].tolist()
+    highs = features['high'].tolist()
+    lows = features['low'].tolist()
+    closes = features['close'].tolist()
+    trends = features['trend'].tolist()
+    atrs = features['atr_20'].tolist()
+    signal_list = np.asarray(signals).tolist()
+    confidence_list = np.asarray(confidences).tolist()
+    regimes = rules['regime']
+    leverage_by_confidence = rules['leverage']
+    size_multipliers = rules['size_multiplier']
+    atr_stops = rules['atr_stop']
+    stop_volatility = rules['stop_volatility']
+    risk_rewards = rules['risk_reward']
+
+    contract_size = trade_config.get('contract_size', backtest_config.get('contract_size', 0.01))
+    min_amount = trade_config.get('min_amount', 0.01)
+    fee_rate = backtest_config.get('fee_rate', 0.0005)
+    intelligent_position = position_config.get('enable_intelligent_position', True)
+    base_usdt = position_config['base_usdt_amount']
+    confidence_size = [position_config['low_confidence_multiplier'],
+                       position_config['medium_confidence_multiplier'],
+                       position_config['high_confidence_multiplier']]
+    max_position_ratio = position_config['max_position_ratio']
+    enable_pyramid = position_config.get('enable_pyramid', True)
+    max_pyramid_times = position_config.get('max_pyramid_times', 2)
+    pyramid_threshold = position_config.get('pyramid_threshold', 0.05)
+    pyramid_usdt = base_usdt * position_config.get('pyramid_amount_ratio', 0.3)
+    stop_confidence = [1.2, 1.0, 0.8]
+
+    enable_trailing = trailing_config.get('enable_trailing_stop', True)
+    breakeven_threshold = trailing_config.get('breakeven_threshold', 0.05)
+    lock_1_threshold = trailing_config.get('lock_profit_1_threshold', 0.10)
+    lock_1_level = trailing_config.get('lock_profit_1_level', 0.03)
+    lock_2_threshold = trailing_config.get('lock_profit_2_threshold', 0.20)
+    lock_2_level = trailing_config.get('lock_profit_2_level', 0.10)
+
+    enable_partial = partial_config.get('enable_partial_tp', True)
+    tp1_rr = partial_config.get('tp1_rr_multiplier', 1.5)
+    tp1_ratio = partial_config.get('tp1_ratio', 0.3)
+    tp2_rr = partial_config.get('tp2_rr_multiplier', 2.5)
+    tp2_fraction = (1 - tp1_ratio) * (partial_config.get('tp2_ratio', 0.3) / (1 - tp1_ratio))
+
+    n = len(closes)
+    start = min(n, trade_config.get('data_points', 96) - 1 if start is None else start)
+    equity = [float(backtest_config.get('initial_balance', 100.0))] * n
+    balance = equity[0]
+    trades = []
+
+    # 持仓状态（side: 1多 -1空 0空仓）
+    side = 0
+    size = entry = margin = leverage = 0.0
+    stop = initial_stop = take_profit = 0.0
+    pyramid_count = 0
+    tp1_done = tp2_done = False
+    opened_at = 0
+
+    # 节流状态（last_trade_info）
+    last_trade_bar = None
+    last_trade_price = None
+    trade_day = None
+    count_today = 0
+    run_length = 0
+    opens_count = 0
+
+    def close_position(t, price, fraction, reason):
+        """按price平掉fraction比例的持仓，返回已实现盈亏"""
+        nonlocal balance, size, margin, side
+        closed = size * fraction
+        pnl = side * closed * contract_size * (price - entry) - closed * contract_size * price * fee_rate
+        balance += pnl
+        trades.append((timestamps[opened_at], timestamps[t], side, entry, price, closed, pnl, reason))
+        if fraction >= 1.0:
+            side = 0
+            size = margin = 0.0
+        else:
+            size -= closed
+            margin *= 1 - fraction
+        return pnl
+
+    for t in range(start, n):
+        price = closes[t]
+
+        # 1. 交易所止盈止损挂单：本根K线内触发（同一根K线内都触发时按先止损处理）
+        if side:
+            if side > 0 and lows[t] <= stop:
+                close_position(t, min(opens[t], stop), 1.0, 'stop_loss')
+            elif side < 0 and highs[t] >= stop:
+                close_position(t, max(opens[t], stop), 1.0, 'stop_loss')
+            elif side > 0 and highs[t] >= take_profit:
+                close_position(t, max(opens[t], take_profit), 1.0, 'take_profit')
+            elif side < 0 and lows[t] <= take_profit:
+                close_position(t, min(opens[t], take_profit), 1.0, 'take_profit')
+
+        # 2. trading_bot的持仓管理：移动止损、分批止盈（收盘价）
+        if side:
+            pnl_pct = side * (price - entry) / entry
+            if enable_trailing:
+                new_stop = None
+                if pnl_pct >= lock_2_threshold:
+                    new_stop = entry * (1 + side * lock_2_level)
+                elif pnl_pct >= lock_1_threshold:
+                    new_stop = entry * (1 + side * lock_1_level)
+                elif pnl_pct >= breakeven_threshold:
+                    new_stop = entry
+                if new_stop and (new_stop - stop) * side > 0:
+                    stop = new_stop
+            if enable_partial and initial_stop:
+                initial_risk = side * (entry - initial_stop)
+                if initial_risk > 0:
+                    # 同一次检查内两批止盈都按检查前的持仓数量计算（与实盘使用同一份持仓快照一致）
+                    size_before = size
+                    move = side * (price - entry)
+                    if not tp1_done and move >= initial_risk * tp1_rr:
+                        close_position(t, price, tp1_ratio, 'partial_tp1')
+                        tp1_done = True
+                    if tp1_done and not tp2_done and move >= initial_risk * tp2_rr:
+                        close_position(t, price, min(1.0, tp2_fraction * size_before / size), 'partial_tp2')
+                        tp2_done = True
+
+        # 3. 信号（signal_history包含本根K线的信号）
+        signal = signal_list[t]
+        confidence = confidence_list[t]
+        run_length = run_length + 1 if t > start and signal == signal_list[t - 1] else 1
+
+        # 4. execute_trade
+        regime = regimes[t]
+        if side and signal and signal == side:
+            # 同向持仓：金字塔加仓检查
+            if (enable_pyramid and pyramid_count < max_pyramid_times and confidence > 0
+                    and side * (price - entry) / entry >= pyramid_threshold and trends[t] == side):
+                add_leverage = leverage_by_confidence[confidence][t]
+                added = round(pyramid_usdt * add_leverage / (price * contract_size), 2)
+                if added > 0:
+                    balance -= added * contract_size * price * fee_rate
+                    entry = (entry * size + price * added) / (size + added)
+                    size += added
+                    margin += added * contract_size * price / add_leverage
+                    pyramid_count += 1
+        elif signal:
+            # 信号持久性、冷却期、日上限、最小ATR变动
+            if run_length < persist_need[regime]:
+                pass
+            elif last_trade_bar is not None and t - last_trade_bar < cooldown_need[regime]:
+                pass
+            else:
+                day = timestamps[t] // 86400000
+                if trade_day != day:
+                    trade_day = day
+                    count_today = 0
+                atr = atrs[t]
+                clear_trend = trends[t] != 0
+                if count_today >= max_trades_day[regime]:
+                    pass
+                elif last_trade_price and atr > 0 and abs(price - last_trade_price) < min_move_atr[regime] * atr:
+                    pass
+                # 反转：低信心不反转，中信心需趋势明确，信号频繁切换时需高信心
+                elif side and (confidence == 0 or (confidence == 1 and not clear_trend)
+                               or (t - start >= 2 and signal_list[t - 1] != signal and confidence != 2)):
+                    pass
+                # 低信心且趋势不明确时跳过
+                elif confidence == 0 and not clear_trend:
+                    pass
+                else:
+                    unrealized = side * size * contract_size * (price - entry) if side else 0.0
+                    free_balance = balance + unrealized - margin
+                    if intelligent_position:
+                        order_leverage = leverage_by_confidence[confidence][t]
+                        order_usdt = min(base_usdt * confidence_size[confidence] * size_multipliers[t],
+                                         free_balance * max_position_ratio)
+                        amount = max(round(order_usdt * order_leverage / (price * contract_size), 2), min_amount)
+                    else:
+                        order_leverage = 5
+                        amount = 0.01
+
+                    stop_ratio = (max(atr_stops[t], 0.02 / order_leverage)
+                                  * stop_confidence[confidence] * stop_volatility[t])
+                    new_stop = price * (1 - signal * stop_ratio)
+                    new_take_profit = price * (1 + signal * stop_ratio * risk_rewards[t])
+
+                    # 保证金检查（不超过80%可用余额）与止盈止损方向校验
+                    if (price * amount * contract_size / order_leverage <= free_balance * 0.8
+                            and (price - new_stop) * signal > 0 and (new_take_profit - price) * signal > 0):
+                        if side:
+                            close_position(t, price, 1.0, 'reverse')
+                        balance -= amount * contract_size * price * fee_rate
+                        side = signal
+                        size = amount
+                        entry = price
+                        leverage = order_leverage
+                        margin = amount * contract_size * price / order_leverage
+                        stop = initial_stop = new_stop
+                        take_profit = new_take_profit
+                        pyramid_count = 0
+                        tp1_done = tp2_done = False
+                        opened_at = t
+                        opens_count += 1
+                        last_trade_bar = t
+                        last_trade_price = price
+                        count_today += 1
+
+        equity[t] = balance + (side * size * contract_size * (price - entry) if side else 0.0)
+        if equity[t] <= 0:
+            equity[t:] = [0.0] * (n - t)
+            break
+
+    equity = np.array(equity)
+    trade_frame = pd.DataFrame(trades, columns=['entry_time', 'exit_time', 'side', 'entry_price',
+                                                'exit_price', 'size', 'pnl', 'reason'])
+    for column in ('entry_time', 'exit_time'):
+        trade_frame[column] = pd.to_datetime(trade_frame[column], unit='ms')
+    timeframe_seconds = (timestamps[1] - timestamps[0]) / 1000 if n > 1 else 900
+    return {
+        'equity': equity,
+        'trades': trade_frame,
+        'metrics': backtest_metrics(equity[start:], opens_count, trade_frame, timeframe_seconds),
+    }
+
+
+def backtest_metrics(equity, trade_count, trades, timeframe_seconds):
+    """汇总回测指标：收益率、年化夏普、最大回撤、开仓次数、平仓胜率"""
+    if len(equity) < 2 or equity[0] <= 0:
+        return {'total_return': 0.0, 'sharpe': 0.0, 'max_drawdown': 0.0, 'trade_count': trade_count, 'win_rate': 0.0}
+    with np.errstate(invalid='ignore', divide='ignore'):
+        returns = np.diff(equity) / equity[:-1]
+    returns = returns[np.isfinite(returns)]
+    bars_per_year = 365 * 86400 / timeframe_seconds
+    std = returns.std() if len(returns) else 0.0
+    drawdown = 1 - equity / np.maximum.accumulate(equity)
+    return {
+        'total_return': float(equity[-1] / equity[0] - 1),
+        'sharpe': float(returns.mean() / std * math.sqrt(bars_per_year)) if std > 0 else 0.0,
+        'max_drawdown': float(drawdown.max()),
+        'trade_count': trade_count,
+        'win_rate': float((trades['pnl'] > 0).mean()) if len(trades) else 0.0,
+    }
+
+
+def print_backtest_report(result):
+    metrics = result['metrics']
+    print("📊 回测结果:")
+    print(f"   - 总收益率: {metrics['total_return'] * 100:+.2f}%")
+    print(f"   - 年化夏普: {metrics['sharpe']:.2f}")
+    print(f"   - 最大回撤: {metrics['max_drawdown'] * 100:.2f}%")
+    print(f"   - 开仓次数: {metrics['trade_count']}")
+    print(f"   - 平仓胜率: {metrics['win_rate'] * 100:.1f}%")
+    if len(result['trades']):
+        print(result['trades'].groupby('reason')['pnl'].agg(['count', 'sum']).to_string())
+
+
+# 参数寻优的默认搜索空间：键为点分路径，'throttle.' 开头的作用于TRADE_THROTTLE，其余作用于TRADE_CONFIG
+SWEEP_SPACE = {
+    'throttle.low.persist': [2, 3, 4],
+    'throttle.mid.persist': [1, 2, 3],
+    'throttle.mid.cooldown': [2, 4, 6],
+    'throttle.high.min_move_atr': [0.8, 1.2, 1.6],
+    'risk_reward.trend_bullish': [3, 5],
+    'risk_reward.trend_bearish': [3, 5],
+    'risk_reward.trend_consolidation': [1.5, 2],
+    'trailing_stop.breakeven_threshold': [0.03, 0.05],
+    'trailing_stop.lock_profit_1_threshold': [0.08, 0.10],
+    'dynamic_leverage.leverage_ranges.HIGH': [[5, 7], [6, 8]],
+    'dynamic_leverage.max_leverage': [6, 8],
+}
+
+# 工作进程内的共享数据（由_init_sweep_worker初始化）
+_sweep_worker_state = {}
+
+
+def apply_config_overrides(overrides, trade_config=None, throttle=None):
+    """按点分路径覆盖配置，返回 (trade_config, throttle) 的深拷贝"""
+    trade_config = copy.deepcopy(TRADE_CONFIG if trade_config is None else trade_config)
+    throttle = copy.deepcopy(TRADE_THROTTLE if throttle is None else throttle)
+    for path, value in overrides.items():
+        keys = path.split('.')
+        target = trade_config
+        if keys[0] == 'throttle':
+            target = throttle
+            keys = keys[1:]
+        for key in keys[:-1]:
+            target = target[key]
+        if keys[-1] not in target:
+            raise KeyError(f"配置中不存在参数: {path}")
+        target[keys[-1]] = value
+    return trade_config, throttle
+
+
+def iter_sweep_candidates(space, search='grid', samples=200, seed=0):
+    """生成参数组合：grid为全部笛卡尔积，random为从中无放回随机抽取samples组"""
+    names = list(space)
+    grid_size = math.prod(len(space[name]) for name in names)
+    if search == 'grid' or samples >= grid_size:
+        for values in itertools.product(*(space[name] for name in names)):
+            yield dict(zip(names, values))
+        return
+
+    rng = np.random.default_rng(seed)
+    for flat_index in rng.choice(grid_size, size=samples, replace=False):
+        candidate = {}
+        for name in reversed(names):
+            flat_index, choice = divmod(int(flat_index), len(space[name]))
+            candidate[name] = space[name][choice]
+        yield {name: candidate[name] for name in names}
+
+
+def _share_arrays(arrays):
+    """把多个numpy数组放进同一块共享内存，返回 (SharedMemory, 布局)；布局只含名称/类型/形状/偏移，可廉价传给子进程"""
+    layout = []
+    offset = 0
+    for name, array in arrays.items():
+        array = np.ascontiguousarray(array)
+        offset = -(-offset // 8) * 8
+        layout.append((name, array.dtype.str, array.shape, offset))
+        offset += array.nbytes
+    block = shared_memory.SharedMemory(create=True, size=max(offset, 1))
+    for (name, dtype, shape, start), array in zip(layout, arrays.values()):
+        np.ndarray(shape, dtype=dtype, buffer=block.buf, offset=start)[...] = array
+    return block, layout
+
+
+def _attach_arrays(block, layout):
+    return {name: np.ndarray(shape, dtype=dtype, buffer=block.buf, offset=start)
+            for name, dtype, shape, start in layout}
+
+
+def _init_sweep_worker(block_name, layout, trade_config, throttle):
+    """工作进程初始化：挂载共享内存中的K线特征与信号（只读视图，不复制）"""
+    block = shared_memory.SharedMemory(name=block_name)
+    arrays = _attach_arrays(block, layout)
+    _sweep_worker_state.update({
+        'block': block,
+        'signals': arrays.pop('signals'),
+        'confidences': arrays.pop('confidences'),
+        'features': arrays,
+        'trade_config': trade_config,
+        'throttle': throttle,
+    })
+
+
+def _run_sweep_task(overrides):
+    state = _sweep_worker_state
+    trade_config, throttle = apply_config_overrides(overrides, state['trade_config'], state['throttle'])
+    try:
+        metrics = run_backtest(state['features'], state['signals'], state['confidences'],
+                               trade_config, throttle)['metrics']
+    except Exception as e:
+        print(f"⚠️ 参数组合回测失败 {overrides}: {e}")
+        metrics = {'total_return': np.nan, 'sharpe': np.nan, 'max_drawdown': np.nan,
+                   'trade_count': 0, 'win_rate': np.nan}
+    return {**overrides, **metrics}
+
+
+def run_parameter_sweep(features, signals, confidences, space=None, search='grid', samples=200,
+                        workers=None, seed=0):
+    """并行参数寻优：K线特征与信号放入共享内存，各工作进程只接收参数组合。
+    返回按夏普降序排列的结果表（含夏普、最大回撤、开仓次数等）"""
+    space = SWEEP_SPACE if space is None else space
+    candidates = list(iter_sweep_candidates(space, search, samples, seed))
+    workers = workers or os.cpu_count() or 1
+    print(f"🔍 参数寻优: {len(candidates)} 组参数, {workers} 个进程")
+
+    block, layout = _share_arrays({**features, 'signals': signals, 'confidences': confidences})
+    try:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_sweep_worker,
+                                 initargs=(block.name, layout, TRADE_CONFIG, TRADE_THROTTLE)) as pool:
+            chunksize = max(1, len(candidates) // (workers * 4))
+            rows = list(pool.map(_run_sweep_task, candidates, chunksize=chunksize))
+    finally:
+        block.close()
+        block.unlink()
+
+    results = pd.DataFrame(rows)
+    for name in space:
+        # 列表类参数（如杠杆区间）转成字符串便于展示与排序
+        if results[name].map(lambda value: isinstance(value, (list, tuple))).any():
+            results[name] = results[name].map(json.dumps)
+    return results.sort_values(['sharpe', 'max_drawdown'], ascending=[False, True],
+                               na_position='last').reset_index(drop=True)
+
+
+def _load_cli_signals(args, features):
+    """命令行信号来源：决策录制回放 > 信号CSV > 趋势跟随信号"""
+    if args.replay:
+        signals, confidences, _ = load_replay_signals(args.replay, features['timestamp'])
+        return signals, confidences
+    if args.signals:
+        return load_signal_file(args.signals, features['timestamp'])
+    return trend_following_signals(features)
+
+
+def main_cli(argv):
+    parser = argparse.ArgumentParser(prog='backtest.py', description='基于本地K线归档回测交易规则')
+    parser.add_argument('--symbol', default=TRADE_CONFIG['symbol'])
+    parser.add_argument('--timeframe', default=TRADE_CONFIG['timeframe'])
+    parser.add_argument('--days', type=float, default=TRADE_CONFIG.get('backtest', {}).get('days', 365))
+    parser.add_argument('--signals', help='信号CSV（timestamp,signal,confidence），默认使用趋势跟随信号')
+    parser.add_argument('--replay', help='DeepSeek决策录制文件（llm_replay），按K线时间回放LLM信号')
+    args = parser.parse_args(argv)
+
+    bars = load_backtest_bars(args.symbol, args.timeframe, args.days)
+    if len(bars['close']) < TRADE_CONFIG['data_points']:
+        print(f"❌ 本地归档K线不足（{len(bars['close'])} 根），请先运行 python main.py backfill")
+        sys.exit(1)
+
+    features = prepare_backtest_features(bars)
+    signals, confidences = _load_cli_signals(args, features)
+
+    started = time.perf_counter()
+    result = run_backtest(features, signals, confidences)
+    print(f"⏱️ 回放 {len(features['close'])} 根{args.timeframe}K线耗时 {(time.perf_counter() - started) * 1000:.0f}ms")
+    print_backtest_report(result)
+
+
+def run_sweep_cli(argv):
+    parser = argparse.ArgumentParser(prog='backtest.py sweep', description='并行参数寻优（网格/随机搜索）')
+    parser.add_argument('--symbol', default=TRADE_CONFIG['symbol'])
+    parser.add_argument('--timeframe', default=TRADE_CONFIG['timeframe'])
+    parser.add_argument('--days', type=float, default=TRADE_CONFIG.get('backtest', {}).get('days', 365))
+    parser.add_argument('--signals', help='信号CSV（timestamp,signal,confidence），默认使用趋势跟随信号')
+    parser.add_argument('--replay', help='DeepSeek决策录制文件（llm_replay），按K线时间回放LLM信号')
+    parser.add_argument('--space', help='搜索空间JSON文件（{"点分路径": [候选值...]}），默认SWEEP_SPACE')
+    parser.add_argument('--search', choices=['grid', 'random'], default='random')
+    parser.add_argument('--samples', type=int, default=200)
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--top', type=int, default=20)
+    parser.add_argument('--output', help='完整结果保存为CSV')
+    args = parser.parse_args(argv)
+
+    bars = load_backtest_bars(args.symbol, args.timeframe, args.days)
+    if len(bars['close']) < TRADE_CONFIG['data_points']:
+        print(f"❌ 本地归档K线不足（{len(bars['close'])} 根），请先运行 python main.py backfill")
+        sys.exit(1)
+
+    features = prepare_backtest_features(bars)
+    signals, confidences = _load_cli_signals(args, features)
+
+    space = SWEEP_SPACE
+    if args.space:
+        with open(args.space, encoding='utf-8') as f:
+            space = json.load(f)
+
+    started = time.perf_counter()
+    results = run_parameter_sweep(features, signals, confidences, space, args.search, args.samples,
+                                  args.workers, args.seed)
+    print(f"⏱️ 寻优完成，耗时 {time.perf_counter() - started:.1f}s")
+    print(results.head(args.top).to_string())
+    if args.output:
+        results.to_csv(args.output, index=False)
+        print(f"💾 结果已保存: {args.output}")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == 'sweep':
+        run_sweep_cli(sys.argv[2:])
+    else:
+        main_cli(sys.argv[1:])
@@ -1,31 +1,51 @@
 import os
+import sys
 import time
+import argparse
 import schedule
 from openai import OpenAI
 import ccxt
+import ccxt.async_support as ccxt_async
+import asyncio
+import numpy as np
 import pandas as pd
 from datetime import datetime
 import json
+import math
 import re
+import hashlib
+import hmac
+import base64
+import gzip
+import threading
+import queue
+import importlib.util
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from collections import deque, OrderedDict
 from dotenv import load_dotenv
 
-load_dotenv()
+try:
+    import httpx
+except ImportError:  # openai自带httpx，缺失时使用openai默认传输层
+    httpx = None
 
-# 初始化DeepSeek客户端
-deepseek_client = OpenAI(
-    api_key=os.getenv('DEEPSEEK_API_KEY'),
-    base_url="https://api.deepseek.com"
-)
+try:
+    from websockets.sync.client import connect as ws_connect
+except ImportError:  # 仅WebSocket行情需要
+    ws_connect = None
+
+load_dotenv()
 
 # 初始化OKX交易所
-exchange = ccxt.okx({
+OKX_CONFIG = {
     'apiKey': os.getenv('OKX_API_KEY'),
     'secret': os.getenv('OKX_SECRET'),
     'password': os.getenv('OKX_PASSWORD'),  # OKX需要交易密码
     'options': {
         'defaultType': 'swap',  # OKX使用swap表示永续合约
     },
-})
+}
+exchange = ccxt.okx(OKX_CONFIG)
 
 # 交易参数配置 - AI动态杠杆版本（适配100USDT本金）
 TRADE_CONFIG = {
@@ -33,6 +53,114 @@ TRADE_CONFIG = {
     'timeframe': '15m',  # 使用15分钟K线
     'test_mode': False,  # 测试模式
     'data_points': 96,  # 24小时数据（96根15分钟K线）
+    # K线增量缓存（进程内保存最近K线，每周期只拉取新K线）
+    'candle_cache': {
+        'enable_cache': True,  # 启用K线增量缓存
+        'max_bars': 1000,      # 缓存最多保留的K线数量（不小于data_points）
+        'fetch_limit': 300,    # 单次REST请求的K线上限（OKX candles接口最多300根）
+    },
+    # 技术指标计算引擎：'pandas' 每周期全量重算；'streaming' 每根K线O(1)增量更新；
+    # 'numpy' 纯NumPy向量化内核（适合长历史/回测）
+    'indicator_engine': 'pandas',
+    # 本地K线归档（按列定长二进制文件，只追加，内存映射读取）
+    'candle_archive': {
+        'enable_archive': True,        # 启动时从归档预热缓存，并把已收盘K线追加进归档
+        'dir': 'data/candles',         # 归档根目录
+        'backfill_days': 90,           # backfill命令默认回补天数
+        'backfill_timeframes': ['15m', '1m'],  # backfill命令默认回补的周期
+    },
+    # 离线回测（backtest.py）
+    'backtest': {
+        'initial_balance': 100,  # 初始资金（USDT）
+        'fee_rate': 0.0005,      # 吃单手续费率
+        'contract_size': 0.01,   # 未连接交易所时的合约面值（OKX BTC-USDT-SWAP为0.01 BTC）
+        'days': 365,             # 默认回测天数
+    },
+    # DeepSeek信号缓存（行情状态指纹不变时复用上次信号，跳过API调用）
+    'llm_cache': {
+        'enable_cache': False,          # 默认关闭：命中缓存会跳过实时推理，需显式开启
+        'ttl_seconds': 1800,            # 缓存有效期（秒）
+        'max_entries': 256,             # 内存LRU最多保留条数
+        'path': 'data/llm_cache.jsonl', # 磁盘持久化文件（只追加，重启后加载）
+        'fingerprint': {
+            'price_digits': 4,          # 价格类指标保留的有效数字
+            'rsi_step': 1.0,            # RSI取整步长
+            'ratio_decimals': 2,        # 比率类指标（布林位置、量比）保留小数位
+        },
+    },
+    # DeepSeek提示词：'full' 原始长文本提示词；'compact' 紧凑结构化提示词（减少输入token与首字延迟）
+    'llm_prompt': {
+        'mode': 'full',
+        'streaming': False,     # 流式接收回复：决策字段齐全即返回，reason在后台继续接收
+        'compact_bars': 10,     # 紧凑模式发送的最近K线根数（不超过kline_data的10根）
+        'report_tokens': True,  # 紧凑模式下打印与完整提示词的token估算对比
+    },
+    # DeepSeek HTTP传输层：连接池 + keep-alive（+ HTTP/2），显式超时；K线收盘前warmup_seconds秒预热连接
+    'llm_http': {
+        'max_connections': 8,          # 连接池上限（集成投票需要并发连接）
+        'keepalive_connections': 8,
+        'keepalive_expiry': 1200,      # 空闲连接保留秒数（超过15分钟周期，避免每周期重新握手）
+        'http2': True,                 # 安装h2时启用HTTP/2
+        'connect_timeout': 5.0,
+        'read_timeout': 30.0,
+        'write_timeout': 10.0,
+        'pool_timeout': 5.0,
+        'max_retries': 2,
+        'warmup_seconds': 15,          # 首次调用DeepSeek前多少秒预热连接（0为关闭）
+    },
+    # 集成投票：并发请求samples次，任一信号达到quorum票后最多再等grade_wait_seconds收集其余回复，
+    # 信心由一致率（同票数/已收到的有效回复数）决定
+    'llm_ensemble': {
+        'enable_ensemble': False,
+        'samples': 5,
+        'quorum': 3,
+        'temperature': 0.7,          # 采样温度（需要一定多样性，投票才有意义）
+        'high_agreement': 0.8,       # 一致率（同票数/已收到的有效回复数）达到该值为HIGH
+        'medium_agreement': 0.6,     # 一致率达到该值为MEDIUM，否则LOW
+        'grade_wait_seconds': 1.0,   # 达到quorum后继续收集其余回复的最长秒数（用于评定一致率）
+    },
+    # DeepSeek决策录制/回放：'off' 关闭；'record' 记录每次(提示词, 回复, 解析信号)；
+    # 'replay' 按提示词哈希回放记录，不访问网络（可用环境变量LLM_REPLAY_MODE覆盖）
+    'llm_replay': {
+        'mode': 'off',
+        'path': 'data/llm_replay.jsonl.gz',  # 只追加的gzip压缩JSONL
+    },
+    # 决策延迟预算：自K线收盘起超过budget_seconds仍未拿到DeepSeek信号时，改用确定性规则信号
+    'decision_budget': {
+        'enable_budget': False,    # 默认关闭：开启后超出预算的DeepSeek回复不再用于交易
+        'budget_seconds': 8.0,     # 从K线收盘到得出信号的最长时间
+        'min_llm_seconds': 1.0,    # 剩余预算不足该值时不再调用/重试DeepSeek
+    },
+    # 推测执行：K线收盘前lead_seconds秒先用未收盘K线完成整套分析，收盘后只拉取最新K线做轻量核对，
+    # 收盘价/高低点/成交量与持仓均在容差内时直接复用推测信号
+    'speculative': {
+        'enable_speculative': False,
+        'lead_seconds': 8,             # 提前多少秒开始推测分析
+        'price_tolerance_pct': 0.1,    # 收盘价、最高价、最低价允许的偏离（%）
+        'volume_tolerance_pct': 20,    # 成交量允许的偏离（%）
+    },
+    # WebSocket行情：订阅K线/ticker频道，K线确认收盘即触发分析（断线自动重连，断档用REST补齐）
+    'market_feed': {
+        'enable_ws': False,
+        'candle_url': 'wss://ws.okx.com:8443/ws/v5/business',   # OKX K线频道在business端点
+        'ticker_url': 'wss://ws.okx.com:8443/ws/v5/public',
+        'ping_interval': 20,      # 空闲多少秒发送ping（OKX 30秒无数据会断开）
+        'max_backoff': 30,        # 重连退避上限（秒）
+        'confirm_timeout': 10,    # 整点后等待K线确认推送的最长秒数，超时改用REST
+    },
+    # 订单事件：下单/撤单后等待交易所确认（私有WebSocket推送，未启用或断开时快速REST轮询），替代固定sleep
+    'order_events': {
+        'enable_ws': False,
+        'private_url': 'wss://ws.okx.com:8443/ws/v5/private',
+        'fill_timeout': 5.0,      # 等待市价单成交确认的最长秒数
+        'cancel_timeout': 3.0,    # 等待撤单确认的最长秒数
+        'poll_interval': 0.2,     # REST轮询间隔
+    },
+    # 多品种批量扫描（scan命令一次向量化计算全部品种的指标/趋势/支撑阻力）
+    'scan_symbols': [
+        'BTC/USDT:USDT', 'ETH/USDT:USDT', 'SOL/USDT:USDT', 'XRP/USDT:USDT',
+        'DOGE/USDT:USDT', 'BNB/USDT:USDT', 'ADA/USDT:USDT', 'LTC/USDT:USDT',
+    ],
     # 账户/交易模式
     'td_mode': 'cross',           # 订单交易模式：'cross' 或 'isolated'
     'hedge_mode': True,           # 是否启用双向持仓（多空同时）
@@ -101,6 +229,12 @@ TRADE_CONFIG = {
         'tp2_ratio': 0.3,  # 30%仓位在2.5倍风险收益比止盈
         'tp2_rr_multiplier': 2.5,
         'tp3_ratio': 0.4   # 40%仓位跟随趋势到反转信号
+    },
+    # 盘中风控：两次15分钟决策之间按实时价格检查移动止损与分批止盈（不调用DeepSeek）
+    'risk_monitor': {
+        'enable_monitor': False,
+        'poll_interval': 2.0,        # 检查间隔（秒）；有WebSocket行情时读取推送价格，否则轮询ticker
+        'position_refresh': 30.0,    # 私有订单推送在线时的持仓缓存秒数（委托成交即刷新）；无推送时每次检查都读取
     }
 }
 
@@ -120,6 +254,89 @@ TRADE_THROTTLE = {
     'leverage_tol': 0.5,  # 杠杆变化小于该值时不重新设置
 }
 
+
+def create_deepseek_client():
+    """按llm_http配置创建DeepSeek客户端：连接池与keep-alive复用TLS连接，显式连接/读取超时；
+    base_url可用环境变量DEEPSEEK_BASE_URL覆盖（如指向本地模拟服务器）"""
+    config = TRADE_CONFIG.get('llm_http', {})
+    base_url = os.getenv('DEEPSEEK_BASE_URL') or "https://api.deepseek.com"
+    options = {'max_retries': config.get('max_retries', 2)}
+
+    if httpx is None:
+        print("⚠️ 未安装httpx，DeepSeek客户端使用默认传输层")
+        return OpenAI(api_key=os.getenv('DEEPSEEK_API_KEY'), base_url=base_url, **options)
+
+    http2 = config.get('http2', True) and importlib.util.find_spec('h2') is not None
+    http_client = httpx.Client(
+        http2=http2,
+        limits=httpx.Limits(
+            max_connections=config.get('max_connections', 8),
+            max_keepalive_connections=config.get('keepalive_connections', 8),
+            keepalive_expiry=config.get('keepalive_expiry', 1200),
+        ),
+        timeout=httpx.Timeout(
+            connect=config.get('connect_timeout', 5.0),
+            read=config.get('read_timeout', 30.0),
+            write=config.get('write_timeout', 10.0),
+            pool=config.get('pool_timeout', 5.0),
+        ),
+    )
+    return OpenAI(api_key=os.getenv('DEEPSEEK_API_KEY'), base_url=base_url, http_client=http_client, **options)
+
+
+# 初始化DeepSeek客户端
+deepseek_client = create_deepseek_client()
+
+class AsyncExchange:
+    """基于ccxt.async_support的异步交易所适配器：客户端运行在独立线程的事件循环里，
+    同步代码用submit()发出请求并拿到Future，多个只读请求因此可以并发进行；call()是等待结果的同步薄包装"""
+
+    def __init__(self, config):
+        self._config = config
+        self._lock = threading.Lock()
+        self._loop = None
+        self._client = None
+
+    def _ensure_started(self):
+        with self._lock:
+            if self._loop is None:
+                loop = asyncio.new_event_loop()
+                threading.Thread(target=loop.run_forever, name='async-exchange', daemon=True).start()
+                # aiohttp会话需在事件循环内创建
+                self._client = asyncio.run_coroutine_threadsafe(self._create_client(), loop).result()
+                self._loop = loop
+            return self._loop
+
+    async def _create_client(self):
+        return ccxt_async.okx(dict(self._config))
+
+    async def _call(self, method, *args, **kwargs):
+        return await getattr(self._client, method)(*args, **kwargs)
+
+    def submit(self, method, *args, **kwargs):
+        """在事件循环中发起请求，立即返回concurrent.futures.Future"""
+        loop = self._ensure_started()
+        return asyncio.run_coroutine_threadsafe(self._call(method, *args, **kwargs), loop)
+
+    def call(self, method, *args, **kwargs):
+        return self.submit(method, *args, **kwargs).result()
+
+    def close(self):
+        with self._lock:
+            loop, client = self._loop, self._client
+            self._loop = self._client = None
+        if loop is None:
+            return
+        try:
+            asyncio.run_coroutine_threadsafe(client.close(), loop).result(timeout=5)
+        except Exception as e:
+            print(f"⚠️ 关闭异步交易所连接失败: {e}")
+        loop.call_soon_threadsafe(loop.stop)
+
+
+# 异步交易所适配器：周期内的余额/持仓/挂单等只读请求并发发出，下单仍使用同步的exchange
+async_exchange = AsyncExchange(OKX_CONFIG)
+
 # 最近交易信息（节流用）
 last_trade_info = {
     'timestamp': None,
@@ -130,6 +347,13 @@ last_trade_info = {
     'date': None,
 }
 
+# K线增量缓存：[timestamp, open, high, low, close, volume]，最后一根可能是未收盘K线
+candle_cache = {
+    'symbol': None,
+    'timeframe': None,
+    'bars': [],
+}
+
 # 全局变量存储历史数据
 price_history = []
 signal_history = []
@@ -148,36 +372,133 @@ position_management = {
     },
     'last_trailing_check': None  # 上次移动止损检查的时间
 }
-
-
-def cleanup_stop_loss_orders():
-    """清理所有止盈止损订单"""
-    try:
-        print("🔧 检查并清理现有止盈止损订单...")
-        open_orders = exchange.fetch_open_orders(TRADE_CONFIG['symbol'])
-        
-        cancelled_orders = []
-        for order in open_orders:
-            order_type = order.get('type', '')
-            order_id = order.get('id', '')
-            
-            # 检查是否是止盈止损相关订单
-            if order_type in ['stop_market', 'take_profit_market', 'conditional', 'trigger']:
+# 持仓管理锁：决策周期与盘中风控线程互斥读写position_management并下单
+position_lock = threading.RLock()
+
+
+class StopOrderManager:
+    """止损委托管理：记录当前生效的止损algo订单ID，移动止损时一次请求修改触发价（amend-algos）；
+    修改失败时先挂新止损再撤旧单（原子替换，期间持仓始终有止损保护）；需要清理时一次批量撤单"""
+
+    STOP_TYPES = 'conditional,oco'  # 单向止盈止损与开仓时附带的止盈止损（OCO）
+
+    def __init__(self):
+        self.algo_id = None
+        self.ord_type = None
+        self.tp_trigger = None  # OCO委托的止盈触发价，替换时保留
+
+    def _inst_id(self):
+        return exchange.market(TRADE_CONFIG['symbol'])['id']
+
+    def _pending(self, ord_type=None):
+        response = exchange.privateGetTradeOrdersAlgoPending({
+            'instId': self._inst_id(), 'ordType': ord_type or self.STOP_TYPES})
+        return response.get('data') or []
+
+    def forget(self):
+        """持仓变化（开仓/平仓）后调用，下次移动止损时重新查询生效的止损委托"""
+        self.algo_id = None
+        self.ord_type = None
+        self.tp_trigger = None
+
+    def refresh(self, side=None):
+        """查询当前生效的止损委托（取带止损触发价的一笔），返回algoId"""
+        self.forget()
+        for row in self._pending():
+            if not row.get('slTriggerPx'):
+                continue
+            if side and row.get('posSide') not in (side, 'net'):
+                continue
+            self.algo_id = row.get('algoId')
+            self.ord_type = row.get('ordType')
+            self.tp_trigger = row.get('tpTriggerPx') or None
+            break
+        return self.algo_id
+
+    def _amend(self, new_stop):
+        response = exchange.privatePostTradeAmendAlgos({
+            'instId': self._inst_id(),
+            'algoId': self.algo_id,
+            'newSlTriggerPx': exchange.price_to_precision(TRADE_CONFIG['symbol'], new_stop),
+            'newSlOrdPx': '-1',  # 触发后市价
+            'newSlTriggerPxType': 'last',
+        })
+        row = (response.get('data') or [{}])[0]
+        if str(row.get('sCode', '0')) != '0':
+            raise RuntimeError(f"修改止损失败: {row.get('sMsg')}")
+
+    def _place(self, new_stop, side):
+        """挂新的全仓止损（closeFraction=1，分批止盈后无需按剩余数量重算）；原委托带止盈时一并保留"""
+        request = {
+            'instId': self._inst_id(),
+            'tdMode': TRADE_CONFIG.get('td_mode', 'cross'),
+            'side': 'sell' if side == 'long' else 'buy',
+            'posSide': side,
+            'ordType': 'oco' if self.tp_trigger else 'conditional',
+            'closeFraction': '1',
+            'reduceOnly': True,
+            'slTriggerPx': exchange.price_to_precision(TRADE_CONFIG['symbol'], new_stop),
+            'slOrdPx': '-1',
+            'slTriggerPxType': 'last',
+        }
+        if self.tp_trigger:
+            request.update({'tpTriggerPx': self.tp_trigger, 'tpOrdPx': '-1', 'tpTriggerPxType': 'last'})
+        response = exchange.privatePostTradeOrderAlgo(request)
+        row = (response.get('data') or [{}])[0]
+        if str(row.get('sCode', '0')) != '0' or not row.get('algoId'):
+            raise RuntimeError(f"挂止损失败: {row.get('sMsg')}")
+        return row['algoId'], request['ordType']
+
+    def move_stop(self, new_stop, current_position):
+        """把交易所止损移动到new_stop：优先原地修改触发价，失败时先挂新单再撤旧单；返回是否成功"""
+        side = current_position.get('side')
+        try:
+            if self.algo_id is None:
+                self.refresh(side)
+            if self.algo_id is not None:
+                try:
+                    self._amend(new_stop)
+                    print(f"✅ 止损已修改到 {new_stop:.2f}（algoId {self.algo_id}）")
+                    return True
+                except Exception as amend_e:
+                    print(f"⚠️ 原地修改止损失败，改为替换: {amend_e}")
+
+            old_id = self.algo_id
+            new_id, ord_type = self._place(new_stop, side)
+            print(f"✅ 新止损已挂出 {new_stop:.2f}（algoId {new_id}）")
+            if old_id is not None:
                 try:
-                    exchange.cancel_order(order_id, TRADE_CONFIG['symbol'])
-                    cancelled_orders.append(order_id)
-                    print(f"✅ 已取消订单: {order_id} ({order_type})")
+                    exchange.cancel_orders([old_id], TRADE_CONFIG['symbol'], {'trigger': True})
                 except Exception as cancel_e:
-                    print(f"⚠️ 取消订单失败: {order_id} - {cancel_e}")
-        
-        if cancelled_orders:
-            print(f"📋 已清理 {len(cancelled_orders)} 个止盈止损订单")
-            time.sleep(2)  # 等待订单取消完成
+                    print(f"⚠️ 撤销旧止损失败: {old_id} - {cancel_e}")
+            self.algo_id, self.ord_type = new_id, ord_type
             return True
-        else:
+        except Exception as e:
+            print(f"❌ 移动止损失败: {e}")
+            self.forget()
+            return False
+
+    def cancel_all(self):
+        """批量撤销当前交易对的全部止盈止损委托（一次cancel_orders请求），并等待确认"""
+        self.forget()
+        order_ids = [row.get('algoId') for row in self._pending() if row.get('algoId')]
+        if not order_ids:
             print("📋 当前无止盈止损订单需要清理")
             return True
-            
+        exchange.cancel_orders(order_ids, TRADE_CONFIG['symbol'], {'trigger': True})
+        print(f"📋 已批量撤销 {len(order_ids)} 个止盈止损订单")
+        return order_events.wait_canceled(
+            order_ids, fetch_open_ids=lambda: [row.get('algoId') for row in self._pending()])
+
+
+stop_orders = StopOrderManager()
+
+
+def cleanup_stop_loss_orders():
+    """清理所有止盈止损订单（批量撤单）"""
+    try:
+        print("🔧 检查并清理现有止盈止损订单...")
+        return stop_orders.cancel_all()
     except Exception as cleanup_e:
         print(f"⚠️ 订单清理过程出错: {cleanup_e}")
         return False
@@ -356,7 +677,7 @@ def calculate_intelligent_position(signal_data, price_data, current_position):
         dynamic_leverage = calculate_dynamic_leverage(signal_data, price_data)
         
         # 获取账户余额
-        balance = exchange.fetch_balance()
+        balance = account_snapshot.get_balance()
         usdt_balance = balance['USDT']['free']
         
         # 基础USDT投入
@@ -482,73 +803,1648 @@ def calculate_technical_indicators(df):
         return df
 
 
+def _div(numerator, denominator):
+    """与pandas一致的除法：x/0 得 ±inf，0/0 得 NaN"""
+    if denominator == 0:
+        if numerator == 0 or math.isnan(numerator):
+            return math.nan
+        return math.copysign(math.inf, numerator) * math.copysign(1.0, denominator)
+    return numerator / denominator
+
+
+class _RollingWindow:
+    """定长滑动窗口：维护窗口内的和与平方和，每次更新O(1)"""
+
+    def __init__(self, window, min_periods=None):
+        self.window = window
+        self.min_periods = window if min_periods is None else min_periods
+        self.values = deque()
+        self.anchor = None  # 平移基准，降低平方和的舍入误差
+        self.total = 0.0
+        self.total_sq = 0.0
+        self.pushes = 0
+
+    def _stats(self, pending=None):
+        """返回(数量, 平移后的和, 平移后的平方和)；pending不为None时按压入该值后的窗口计算，不修改状态"""
+        count, total, total_sq = len(self.values), self.total, self.total_sq
+        if pending is not None:
+            anchor = pending if self.anchor is None else self.anchor
+            shifted = pending - anchor
+            count, total, total_sq = count + 1, total + shifted, total_sq + shifted * shifted
+            if count > self.window:
+                oldest = self.values[0] - anchor
+                count, total, total_sq = count - 1, total - oldest, total_sq - oldest * oldest
+        return count, total, total_sq
+
+    def push(self, x):
+        if self.anchor is None:
+            self.anchor = x
+        _, self.total, self.total_sq = self._stats(x)
+        self.values.append(x)
+        if len(self.values) > self.window:
+            self.values.popleft()
+
+        # 每window次按窗口精确重算一次，消除加减累计的舍入误差（摊还仍为O(1)）
+        self.pushes += 1
+        if self.pushes % self.window == 0:
+            self.anchor = self.values[-1]
+            self.total = sum(v - self.anchor for v in self.values)
+            self.total_sq = sum((v - self.anchor) ** 2 for v in self.values)
+
+    def mean(self, pending=None):
+        count, total, _ = self._stats(pending)
+        if count < self.min_periods or count == 0:
+            return math.nan
+        anchor = pending if self.anchor is None else self.anchor
+        return anchor + total / count
+
+    def std(self, pending=None):
+        """样本标准差（ddof=1，与pandas rolling.std一致）"""
+        count, total, total_sq = self._stats(pending)
+        if count < max(self.min_periods, 2):
+            return math.nan
+        variance = (total_sq - total * total / count) / (count - 1)
+        return math.sqrt(max(variance, 0.0))
+
+
+class _RollingExtreme:
+    """滑动窗口最大/最小值：单调双端队列，每次更新摊还O(1)"""
+
+    def __init__(self, window, is_max=True, min_periods=None):
+        self.window = window
+        self.min_periods = window if min_periods is None else min_periods
+        self.sign = 1.0 if is_max else -1.0
+        self.items = deque()  # (bar序号, sign*值)，值单调递减
+        self.index = 0
+
+    def value(self, pending=None):
+        count = min(self.index + (pending is not None), self.window)
+        if count < self.min_periods or count == 0:
+            return math.nan
+        if pending is None:
+            return self.sign * self.items[0][1]
+        # 压入新值后，窗口最左侧的一个元素会过期
+        best = self.sign * pending
+        for idx, val in list(self.items)[:2]:
+            if idx > self.index - self.window:
+                best = max(best, val)
+                break
+        return self.sign * best
+
+    def push(self, x):
+        signed = self.sign * x
+        while self.items and self.items[-1][1] <= signed:
+            self.items.pop()
+        self.items.append((self.index, signed))
+        while self.items[0][0] <= self.index - self.window:
+            self.items.popleft()
+        self.index += 1
+
+
+class _AdjustedEwm:
+    """adjust=True的指数加权均值（与pandas ewm(span).mean()一致），递推O(1)"""
+
+    def __init__(self, span):
+        self.decay = 1 - 2 / (span + 1)
+        self.numerator = 0.0
+        self.denominator = 0.0
+
+    def peek(self, x):
+        return (x + self.decay * self.numerator) / (1 + self.decay * self.denominator)
+
+    def push(self, x):
+        self.numerator = x + self.decay * self.numerator
+        self.denominator = 1 + self.decay * self.denominator
+        return self.numerator / self.denominator
+
+
+class StreamingIndicatorEngine:
+    """流式增量指标引擎：每根K线收盘时O(1)更新全部指标，结果与calculate_technical_indicators一致"""
+
+    def __init__(self):
+        self.close_5 = _RollingWindow(5, min_periods=1)
+        self.close_20 = _RollingWindow(20, min_periods=1)  # sma_20与布林带中轨共用
+        self.close_50 = _RollingWindow(50, min_periods=1)
+        self.ema_12 = _AdjustedEwm(12)
+        self.ema_26 = _AdjustedEwm(26)
+        self.macd_signal = _AdjustedEwm(9)
+        self.gain = _RollingWindow(14)
+        self.loss = _RollingWindow(14)
+        self.true_range = _RollingWindow(20, min_periods=1)
+        self.volume = _RollingWindow(20)
+        self.high_max = _RollingExtreme(20, is_max=True, min_periods=1)
+        self.low_min = _RollingExtreme(20, is_max=False, min_periods=1)
+        self.prev_close = None
+        self.last_timestamp = None
+        self.bars = 0
+        self.last_row = {}
+        self.last_valid = {}  # 等价于pandas的ffill：最后一个非NaN值
+
+    def update(self, bar):
+        """压入一根已收盘K线 [timestamp, open, high, low, close, volume]，返回该K线的指标"""
+        return self._step(bar, commit=True)
+
+    def snapshot(self, forming_bar=None):
+        """返回最新指标；传入未收盘K线时按其为最后一行计算（不修改引擎状态）"""
+        if forming_bar is None:
+            return dict(self.last_row)
+        return self._step(forming_bar, commit=False)
+
+    def _step(self, bar, commit):
+        timestamp, open_price, high, low, close, volume = bar[:6]
+        prev_close = self.prev_close
+
+        # RSI涨跌幅（首根K线无前收盘，与pandas一样按0处理）
+        delta = close - prev_close if prev_close is not None else math.nan
+        gain = delta if delta > 0 else 0.0
+        loss = -delta if delta < 0 else 0.0
+
+        # 真实波动范围
+        if prev_close is None:
+            true_range = high - low
+        else:
+            true_range = max(high - low, abs(high - prev_close), abs(low - prev_close))
+
+        if commit:
+            for window, x in ((self.close_5, close), (self.close_20, close), (self.close_50, close),
+                              (self.gain, gain), (self.loss, loss), (self.true_range, true_range),
+                              (self.volume, volume), (self.high_max, high), (self.low_min, low)):
+                window.push(x)
+            ema_12 = self.ema_12.push(close)
+            ema_26 = self.ema_26.push(close)
+            macd = ema_12 - ema_26
+            macd_signal = self.macd_signal.push(macd)
+        else:
+            ema_12 = self.ema_12.peek(close)
+            ema_26 = self.ema_26.peek(close)
+            macd = ema_12 - ema_26
+            macd_signal = self.macd_signal.peek(macd)
+
+        def _pending(x):
+            # 已提交时读取窗口当前状态，预览时按压入x后的窗口计算
+            return None if commit else x
+
+        count = self.bars + (0 if commit else 1)
+        bb_middle = self.close_20.mean(_pending(close)) if count >= 20 else math.nan
+        bb_std = self.close_20.std(_pending(close)) if count >= 20 else math.nan
+        bb_upper = bb_middle + bb_std * 2
+        bb_lower = bb_middle - bb_std * 2
+        rs = _div(self.gain.mean(_pending(gain)), self.loss.mean(_pending(loss)))
+        atr_20 = self.true_range.mean(_pending(true_range))
+        volume_ma = self.volume.mean(_pending(volume))
+        recent_high = self.high_max.value(_pending(high))
+        recent_low = self.low_min.value(_pending(low))
+
+        row = {
+            'sma_5': self.close_5.mean(_pending(close)),
+            'sma_20': self.close_20.mean(_pending(close)),
+            'sma_50': self.close_50.mean(_pending(close)),
+            'ema_12': ema_12,
+            'ema_26': ema_26,
+            'macd': macd,
+            'macd_signal': macd_signal,
+            'macd_histogram': macd - macd_signal,
+            'rsi': 100 - _div(100, 1 + rs),
+            'bb_middle': bb_middle,
+            'bb_upper': bb_upper,
+            'bb_lower': bb_lower,
+            'bb_position': _div(close - bb_lower, bb_upper - bb_lower),
+            'atr_20': atr_20,
+            'atr_ratio': _div(atr_20, close),
+            'volume_ma': volume_ma,
+            'volume_ratio': _div(volume, volume_ma),
+            'resistance': recent_high if count >= 20 else math.nan,
+            'support': recent_low if count >= 20 else math.nan,
+        }
+
+        # 与 bfill().ffill() 对最后一行的效果一致：NaN取最近一次有效值
+        for key, value in row.items():
+            if math.isnan(value):
+                row[key] = self.last_valid.get(key, math.nan)
+            elif commit:
+                self.last_valid[key] = value
+
+        # 近期高低点（不足20根时取已有K线，与tail(20)一致），供支撑阻力计算
+        row.update({
+            'timestamp': timestamp, 'open': open_price, 'high': high, 'low': low,
+            'close': close, 'volume': volume,
+            'recent_high': recent_high, 'recent_low': recent_low,
+        })
+
+        if commit:
+            self.prev_close = close
+            self.last_timestamp = timestamp
+            self.bars += 1
+            self.last_row = row
+        return row
+
+
+# 流式指标引擎实例（indicator_engine='streaming'时使用）
+streaming_engine = None
+
+
+def get_streaming_indicator_row(ohlcv):
+    """把已收盘K线增量喂给流式引擎，并以最后一根（未收盘）K线预览最新指标"""
+    global streaming_engine
+
+    forming_bar = ohlcv[-1]
+    timeframe_ms = exchange.parse_timeframe(TRADE_CONFIG['timeframe']) * 1000
+    history = candle_cache['bars'] or ohlcv
+    engine = streaming_engine
+
+    # 从缓存尾部向前找出引擎尚未处理的已收盘K线
+    new_bars = []
+    if engine is not None and engine.last_timestamp is not None:
+        for bar in reversed(history):
+            if bar[0] <= engine.last_timestamp:
+                break
+            if bar[0] < forming_bar[0]:
+                new_bars.append(bar)
+        new_bars.reverse()
+
+    # 引擎为空、时间回退或与缓存断档时，用缓存中的全部已收盘K线重建
+    if engine is None or engine.last_timestamp is None or engine.last_timestamp >= forming_bar[0] \
+            or (new_bars and new_bars[0][0] != engine.last_timestamp + timeframe_ms) \
+            or (not new_bars and engine.last_timestamp + timeframe_ms != forming_bar[0]):
+        engine = StreamingIndicatorEngine()
+        for bar in history:
+            if bar[0] < forming_bar[0]:
+                engine.update(bar)
+        streaming_engine = engine
+        print(f"🔁 流式指标引擎重建: {engine.bars} 根K线")
+    else:
+        for bar in new_bars:
+            engine.update(bar)
+        print(f"⚡ 流式指标增量更新: {len(new_bars)} 根K线")
+
+    return engine.snapshot(forming_bar)
+
+
+def check_streaming_indicator_parity(bars, rtol=1e-8, atol=1e-6):
+    """校验流式引擎与pandas实现的结果一致，返回各指标的最大绝对误差"""
+    df = pd.DataFrame(bars, columns=['timestamp', 'open', 'high', 'low', 'close', 'volume'])
+    expected = calculate_technical_indicators(df.copy())
+
+    engine = StreamingIndicatorEngine()
+    streamed = [engine.update(bar) for bar in bars[:-1]]
+    streamed.append(engine.snapshot(bars[-1]))
+
+    # pandas的bfill会用后续值回填前几行，只有最后一行的填充语义与流式一致，
+    # 因此逐行比较从所有指标都已预热的位置开始，最后一行额外单独比较
+    warmup = 50
+    worst = {}
+    failed = []
+    for column in ['sma_5', 'sma_20', 'sma_50', 'ema_12', 'ema_26', 'macd', 'macd_signal', 'macd_histogram',
+                   'rsi', 'bb_upper', 'bb_lower', 'bb_position', 'atr_20', 'atr_ratio', 'volume_ratio',
+                   'resistance', 'support']:
+        actual = np.array([row[column] for row in streamed[warmup:]], dtype=float)
+        reference = expected[column].to_numpy(dtype=float)[warmup:]
+        if not np.allclose(actual, reference, rtol=rtol, atol=atol, equal_nan=True):
+            failed.append(column)
+        errors = np.abs(actual - reference)
+        worst[column] = float(np.max(errors[~np.isnan(errors)], initial=0.0))
+
+    passed = not failed
+    print(f"{'✅' if passed else '❌'} 流式指标与pandas一致性校验（{len(bars)} 根K线, rtol={rtol}, atol={atol}）")
+    for column, error in worst.items():
+        print(f"   - {column}: 最大绝对误差 {error:.2e}{' ❌' if column in failed else ''}")
+    return passed, worst
+
+
+# NumPy指标内核输出块的列顺序（与calculate_technical_indicators新增的列一致）
+INDICATOR_COLUMNS = [
+    'sma_5', 'sma_20', 'sma_50', 'ema_12', 'ema_26', 'macd', 'macd_signal', 'macd_histogram',
+    'rsi', 'bb_middle', 'bb_upper', 'bb_lower', 'bb_position', 'atr_20', 'atr_ratio',
+    'volume_ma', 'volume_ratio', 'resistance', 'support',
+]
+
+
+def _shifted_cumsum(x):
+    """平移后的前缀和（沿最后一维，首位补0）：减去首个值以降低累计舍入误差，返回(前缀和, 平移量)"""
+    reference = x[..., :1]
+    csum = np.empty(x.shape[:-1] + (x.shape[-1] + 1,))
+    csum[..., 0] = 0.0
+    np.subtract(x, reference, out=csum[..., 1:])
+    np.cumsum(csum[..., 1:], axis=-1, out=csum[..., 1:])
+    return csum, reference
+
+
+def _rolling_mean(x, window, min_periods=None, cumsum=None, out=None):
+    """基于cumsum的滑动均值（沿最后一维），不足min_periods的位置为NaN；可传入_shifted_cumsum结果复用"""
+    min_periods = window if min_periods is None else min_periods
+    csum, reference = _shifted_cumsum(x) if cumsum is None else cumsum
+    n = x.shape[-1]
+    head = min(window, n)
+    if out is None:
+        out = np.empty(x.shape)
+    np.divide(csum[..., 1:head + 1], np.arange(1, head + 1), out=out[..., :head])
+    np.subtract(csum[..., head + 1:], csum[..., 1:n - head + 1], out=out[..., head:])
+    out[..., head:] /= window
+    out += reference
+    out[..., :min(min_periods - 1, n)] = np.nan
+    return out
+
+
+def _chunk_std(chunks, window, out=None):
+    """对形状 (..., 块数, 块长) 的重叠块计算块内全部完整窗口的样本标准差，写入形状 (..., 块数, 块长-window+1) 的out"""
+    length = chunks.shape[-1]
+    if out is None:
+        out = np.empty(chunks.shape[:-1] + (length - window + 1,))
+    # 前缀和数组首列补0，窗口和 = 前缀和[t+window] - 前缀和[t] 一次相减即可得到，无需复制
+    sums = np.empty(chunks.shape[:-1] + (length + 1,))
+    sums[..., 0] = 0.0
+    np.subtract(chunks, chunks[..., :1], out=sums[..., 1:])
+    squares = np.square(sums)
+    np.cumsum(sums[..., 1:], axis=-1, out=sums[..., 1:])
+    np.cumsum(squares[..., 1:], axis=-1, out=squares[..., 1:])
+
+    # 方差 = (w·Σx² - (Σx)²) / (w·(w-1))，原地计算减少临时数组
+    np.subtract(squares[..., window:], squares[..., :-window], out=out)
+    s1 = np.subtract(sums[..., window:], sums[..., :-window])
+    np.square(s1, out=s1)
+    out *= window
+    out -= s1
+    out /= window * (window - 1)
+    np.maximum(out, 0.0, out=out)
+    return np.sqrt(out, out=out)
+
+
+def _rolling_std(x, window, chunk=1024, out=None):
+    """滑动样本标准差（ddof=1）：stride-tricks把序列切成首尾重叠window-1的块（视图，不复制），
+    块内平移后做cumsum，避免整段前缀和的累计误差；不足一块的尾部单独计算"""
+    n = x.shape[-1]
+    if out is None:
+        out = np.empty(x.shape)
+    if n < window:
+        out[...] = np.nan
+        return out
+
+    # 结果直接写入out（out非连续时先在临时数组中计算）
+    work = out if out.flags.c_contiguous else np.empty(x.shape)
+    work[..., :window - 1] = np.nan
+    count = n - window + 1
+    full = count // chunk
+    if full:
+        chunks = np.lib.stride_tricks.sliding_window_view(x, chunk + window - 1, axis=-1)[..., ::chunk, :]
+        _chunk_std(chunks[..., :full, :], window,
+                   out=work[..., window - 1:window - 1 + full * chunk].reshape(x.shape[:-1] + (full, chunk)))
+    if count > full * chunk:
+        _chunk_std(x[..., None, full * chunk:], window, out=work[..., None, window - 1 + full * chunk:])
+    if work is not out:
+        out[...] = work
+    return out
+
+
+def _rolling_extreme(x, window, ufunc, out=None):
+    """滑动窗口最大/最小值（ufunc为np.maximum/np.minimum）：倍增稀疏表，O(n log window)向量化"""
+    n = x.shape[-1]
+    if out is None:
+        out = np.empty(x.shape)
+    out[..., :window - 1] = np.nan
+    if n < window:
+        return out
+
+    # acc[i] 为 [i, i+span-1] 内的极值，每次倍增长度缩短span，无需复制
+    acc = x
+    span = 1
+    while span * 2 <= window:
+        acc = ufunc(acc[..., :-span], acc[..., span:])
+        span *= 2
+
+    # 两段重叠区间覆盖整个窗口 [t-window+1, t]
+    ufunc(acc[..., :n - window + 1], acc[..., window - span:n - span + 1], out=out[..., window - 1:])
+    return out
+
+
+def _linear_recurrence(x, decay, block=1024, out=None, scale=1.0):
+    """计算 y[t] = scale * x[t] + decay * y[t-1]（沿最后一维），结果写入out。
+    块内用闭式解 y = decay^t * cumsum(scale * x * decay^-t) 向量化，块间进位递归处理；不足一块的尾部单独计算"""
+    n = x.shape[-1]
+    if out is None:
+        out = np.empty(x.shape)
+    full = n // block
+    size = full * block
+    powers = np.exp(np.arange(block) * np.log(decay))
+    weights = scale / powers
+
+    # 完整块直接在out上原地计算（out非连续时先在临时数组中计算）
+    work = out if out.flags.c_contiguous else np.empty(x.shape)
+    local = work[..., :size].reshape(x.shape[:-1] + (full, block))
+    np.multiply(x[..., :size].reshape(x.shape[:-1] + (full, block)), weights, out=local)
+    tail = work[..., size:]
+    np.multiply(x[..., size:], weights[:n - size], out=tail)
+
+    # 块间进位：各块末尾的真实值 ends_j = decay^(block-1) * Σlocal_j + decay^block * ends_{j-1}，本身也是同类递推；
+    # 进位 decay * ends_{j-1} 加到下一块首元素上，随块内cumsum一起传播，省去一次整段的广播加法
+    if full > 0 and n > block:
+        ends = local.sum(axis=-1) * powers[-1]
+        tail_decay = decay ** block
+        if full > 1 and tail_decay > np.finfo(float).eps:
+            # 块长度受限于 tail_decay^-block 不溢出
+            ends = _linear_recurrence(ends, tail_decay, max(1, min(block, int(600 / -np.log(tail_decay)))))
+        if full > 1:
+            local[..., 1:, 0] += ends[..., :-1] * decay
+        if n > size:
+            tail[..., 0] += ends[..., -1] * decay
+    np.cumsum(local, axis=-1, out=local)
+    local *= powers
+    np.cumsum(tail, axis=-1, out=tail)
+    tail *= powers[:n - size]
+    if work is not out:
+        out[...] = work
+    return out
+
+
+def _ewm_mean(x, span, out=None):
+    """adjust=True的指数加权均值（与pandas ewm(span).mean()一致，输入无NaN）"""
+    decay = 1 - 2 / (span + 1)
+    n = x.shape[-1]
+    # 递推时直接乘以 1-decay，权重和 (1-decay^t)/(1-decay) 在decay^t低于机器精度后恒为1/(1-decay)，只需修正开头部分
+    out = _linear_recurrence(x, decay, out=out, scale=1 - decay)
+    head = min(n, int(np.log(np.finfo(float).eps) / np.log(decay)) + 1)
+    out[..., :head] /= -np.expm1(np.arange(1, head + 1) * np.log(decay))
+    return out
+
+
+def _bfill_ffill(block, scan=None):
+    """沿最后一维先后向填充再前向填充NaN（等价于DataFrame.bfill().ffill()），原地修改并返回。
+    scan为首维的布尔掩码时，预热期之后只在这些行中查找残留NaN（其余行已知只有前导NaN）"""
+    n = block.shape[-1]
+    # 前导NaN只出现在指标预热期，先只在开头一段内找第一个有效值；该段内有整行NaN时再扩大到全长
+    probe = min(n, 256)
+    valid_head = ~np.isnan(block[..., :probe])
+    if probe < n and not valid_head.any(axis=-1).all():
+        probe = n
+        valid_head = ~np.isnan(block)
+
+    # 快速路径：指标预热期的前导NaN用第一个有效值回填（只处理前导区间）
+    first_valid = np.argmax(valid_head, axis=-1)
+    head = int(first_valid.max()) + 1
+    if head > 1:
+        first_value = np.take_along_axis(block, first_valid[..., None], axis=-1)
+        block[..., :head] = np.where(np.arange(head) < first_valid[..., None], first_value, block[..., :head])
+
+    # 少见情况：中间或尾部仍有NaN（如0/0），只对这些行做完整填充（min遇NaN即为NaN，无需布尔临时数组）
+    if scan is None:
+        remaining = np.isnan(block.min(axis=-1))
+    else:
+        remaining = np.zeros(block.shape[:-1], dtype=bool)
+        for i in np.flatnonzero(scan):
+            remaining[i] = np.isnan(block[i].min(axis=-1))
+    if not remaining.any():
+        return block
+    rows = block.reshape(-1, n)
+    for i in np.flatnonzero(remaining.reshape(-1)):
+        row = rows[i]
+        valid = ~np.isnan(row)
+        if not valid.any():
+            continue
+        positions = np.arange(n)
+        next_valid = np.minimum.accumulate(np.where(valid, positions, n)[::-1])[::-1]
+        prev_valid = np.maximum.accumulate(np.where(valid, positions, -1))
+        row[...] = row[np.where(next_valid < n, next_valid, prev_valid)]
+    return block
+
+
+# 指标注册表：指标名 -> {'inputs': 依赖的指标/原始序列名, 'func': 计算函数, 'intermediate': 是否仅作中间量}
+# 计算函数按inputs顺序接收依赖数组（均未填充NaN），给出out时必须把结果写入out（预分配的输出行）；
+# intermediate节点的结果不是单个数组（如前缀和元组），只能作为依赖，不能作为输出列；
+# may_nan节点在输入全为有限值时预热期之后仍可能出现NaN（如0/0），填充时只需扫描这些行
+INDICATOR_REGISTRY = {}
+
+# 可作为依赖的原始K线序列
+OHLCV_SERIES = ('open', 'high', 'low', 'close', 'volume')
+
+# 实盘只需要的指标列（technical_data、趋势判断与支撑阻力所读取的列）
+LIVE_INDICATOR_COLUMNS = [
+    'sma_5', 'sma_20', 'sma_50', 'macd', 'macd_signal', 'macd_histogram', 'rsi',
+    'bb_upper', 'bb_lower', 'bb_position', 'atr_20', 'atr_ratio', 'volume_ratio',
+]
+
+
+def register_indicator(name, inputs, intermediate=False, may_nan=False):
+    """注册指标计算节点，声明其依赖的指标/原始序列"""
+    def decorator(func):
+        INDICATOR_REGISTRY[name] = {'inputs': tuple(inputs), 'func': func, 'intermediate': intermediate,
+                                    'may_nan': may_nan}
+        return func
+    return decorator
+
+
+def _output(out, like):
+    return np.empty(like.shape) if out is None else out
+
+
+@register_indicator('close_cumsum', ['close'], intermediate=True)
+def _indicator_close_cumsum(close, out=None):
+    # 共享中间量：收盘价前缀和（各均线共用）
+    return _shifted_cumsum(close)
+
+
+@register_indicator('sma_5', ['close', 'close_cumsum'])
+def _indicator_sma_5(close, close_cumsum, out=None):
+    return _rolling_mean(close, 5, min_periods=1, cumsum=close_cumsum, out=out)
+
+
+@register_indicator('sma_20', ['close', 'close_cumsum'])
+def _indicator_sma_20(close, close_cumsum, out=None):
+    return _rolling_mean(close, 20, min_periods=1, cumsum=close_cumsum, out=out)
+
+
+@register_indicator('sma_50', ['close', 'close_cumsum'])
+def _indicator_sma_50(close, close_cumsum, out=None):
+    return _rolling_mean(close, 50, min_periods=1, cumsum=close_cumsum, out=out)
+
+
+@register_indicator('ema_12', ['close'])
+def _indicator_ema_12(close, out=None):
+    return _ewm_mean(close, 12, out=out)
+
+
+@register_indicator('ema_26', ['close'])
+def _indicator_ema_26(close, out=None):
+    return _ewm_mean(close, 26, out=out)
+
+
+@register_indicator('macd', ['ema_12', 'ema_26'])
+def _indicator_macd(ema_12, ema_26, out=None):
+    return np.subtract(ema_12, ema_26, out=_output(out, ema_12))
+
+
+@register_indicator('macd_signal', ['macd'])
+def _indicator_macd_signal(macd, out=None):
+    return _ewm_mean(macd, 9, out=out)
+
+
+@register_indicator('macd_histogram', ['macd', 'macd_signal'])
+def _indicator_macd_histogram(macd, macd_signal, out=None):
+    return np.subtract(macd, macd_signal, out=_output(out, macd))
+
+
+@register_indicator('price_delta', ['close'])
+def _indicator_price_delta(close, out=None):
+    # 首根K线涨跌按0处理，与pandas的where一致
+    delta = _output(out, close)
+    delta[..., :1] = 0.0
+    np.subtract(close[..., 1:], close[..., :-1], out=delta[..., 1:])
+    return delta
+
+
+@register_indicator('rsi', ['price_delta', 'close'], may_nan=True)
+def _indicator_rsi(delta, close, out=None, window=14):
+    # 窗口内涨幅和 - 跌幅和 = 窗口内涨跌之和 = 收盘价首尾差，跌幅和无需再做一次前缀和；
+    # 均值的1/window在比值中约掉：RSI = 100 - 100/(1+涨/跌) = 100 * 涨 / (涨 + 跌)
+    n = delta.shape[-1]
+    out = _output(out, delta)
+    out[..., :window - 1] = np.nan
+    if n < window:
+        return out
+    # 前缀和首列补0，窗口和一次相减直接写入out
+    gain_csum = np.empty(delta.shape[:-1] + (n + 1,))
+    gain_csum[..., 0] = 0.0
+    np.maximum(delta, 0.0, out=gain_csum[..., 1:])
+    np.cumsum(gain_csum[..., 1:], axis=-1, out=gain_csum[..., 1:])
+    gain = np.subtract(gain_csum[..., window:], gain_csum[..., :-window], out=out[..., window - 1:])
+
+    # 首根K线涨跌为0，第window-1根的窗口涨跌之和为close[window-1] - close[0]
+    total = np.empty(gain.shape)
+    np.subtract(close[..., window - 1], close[..., 0], out=total[..., 0])
+    np.subtract(close[..., window:], close[..., :n - window], out=total[..., 1:])
+    np.subtract(gain, total, out=total)
+    total += gain
+    gain /= total
+    gain *= 100
+    return out
+
+
+@register_indicator('bb_middle', ['sma_20'])
+def _indicator_bb_middle(sma_20, out=None):
+    # 与sma_20共用20周期均值，只是不足20根时为NaN
+    out = _output(out, sma_20)
+    out[...] = sma_20
+    out[..., :19] = np.nan
+    return out
+
+
+@register_indicator('bb_std', ['close'])
+def _indicator_bb_std(close, out=None):
+    return _rolling_std(close, 20, out=out)
+
+
+@register_indicator('bb_upper', ['bb_middle', 'bb_std'])
+def _indicator_bb_upper(bb_middle, bb_std, out=None):
+    out = np.multiply(bb_std, 2, out=_output(out, bb_std))
+    out += bb_middle
+    return out
+
+
+@register_indicator('bb_lower', ['bb_middle', 'bb_std'])
+def _indicator_bb_lower(bb_middle, bb_std, out=None):
+    out = np.multiply(bb_std, -2, out=_output(out, bb_std))
+    out += bb_middle
+    return out
+
+
+@register_indicator('bb_position', ['close', 'bb_upper', 'bb_lower'], may_nan=True)
+def _indicator_bb_position(close, bb_upper, bb_lower, out=None):
+    out = np.subtract(close, bb_lower, out=_output(out, close))
+    out /= bb_upper - bb_lower
+    return out
+
+
+@register_indicator('true_range', ['high', 'low', 'close'])
+def _indicator_true_range(high, low, close, out=None):
+    # 共享中间量：真实波动范围（首根K线为high-low）。
+    # max(high-low, |high-prev|, |low-prev|) = max(high, prev) - min(low, prev)，逐位相同且少两次遍历
+    true_range = _output(out, close)
+    prev_close = close[..., :-1]
+    np.subtract(high[..., :1], low[..., :1], out=true_range[..., :1])
+    np.maximum(high[..., 1:], prev_close, out=true_range[..., 1:])
+    true_range[..., 1:] -= np.minimum(low[..., 1:], prev_close)
+    return true_range
+
+
+@register_indicator('atr_20', ['true_range'])
+def _indicator_atr_20(true_range, out=None):
+    return _rolling_mean(true_range, 20, min_periods=1, out=out)
+
+
+@register_indicator('atr_ratio', ['atr_20', 'close'], may_nan=True)
+def _indicator_atr_ratio(atr_20, close, out=None):
+    return np.divide(atr_20, close, out=_output(out, close))
+
+
+@register_indicator('volume_ma', ['volume'])
+def _indicator_volume_ma(volume, out=None):
+    return _rolling_mean(volume, 20, out=out)
+
+
+@register_indicator('volume_ratio', ['volume', 'volume_ma'], may_nan=True)
+def _indicator_volume_ratio(volume, volume_ma, out=None):
+    return np.divide(volume, volume_ma, out=_output(out, volume))
+
+
+@register_indicator('resistance', ['high'])
+def _indicator_resistance(high, out=None):
+    return _rolling_extreme(high, 20, np.maximum, out=out)
+
+
+@register_indicator('support', ['low'])
+def _indicator_support(low, out=None):
+    return _rolling_extreme(low, 20, np.minimum, out=out)
+
+
+def resolve_indicator_plan(names):
+    """按依赖关系展开names，返回需要计算的节点（拓扑序，只含被用到的子图）"""
+    plan = []
+    visited = set()
+
+    def visit(name, path):
+        if name in visited or name in OHLCV_SERIES:
+            return
+        if name not in INDICATOR_REGISTRY:
+            raise KeyError(f"未注册的指标: {name}")
+        if name in path:
+            raise ValueError(f"指标依赖存在环: {' -> '.join(path + (name,))}")
+        for dependency in INDICATOR_REGISTRY[name]['inputs']:
+            visit(dependency, path + (name,))
+        visited.add(name)
+        plan.append(name)
+
+    for name in names:
+        visit(name, ())
+    return plan
+
+
+def evaluate_indicators(names, series, out=None):
+    """惰性求值：只计算names及其依赖，共享中间量（前缀和、真实波动范围等）只算一次。
+    series为原始序列字典（沿最后一维为时间轴）；返回 {指标名: 数组}，结果已按 bfill().ffill() 填充。
+    给出out（形状 (len(names),) + close.shape）时结果直接写入out的对应行"""
+    for name in names:
+        if INDICATOR_REGISTRY.get(name, {}).get('intermediate', False):
+            raise ValueError(f"{name} 是中间量，不能作为输出列")
+    values = {name: np.ascontiguousarray(array, dtype=np.float64) for name, array in series.items()}
+    targets = {name: out[i] for i, name in enumerate(names)} if out is not None else {}
+
+    for name in names:
+        if name in series and name in targets:
+            targets[name][...] = values[name]
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        for name in resolve_indicator_plan(names):
+            spec = INDICATOR_REGISTRY[name]
+            values[name] = spec['func'](*(values[dependency] for dependency in spec['inputs']),
+                                        out=targets.get(name))
+
+    # 依赖计算全部完成后再填充NaN（下游指标基于未填充的值计算，与pandas一致）；
+    # 输入全为有限值时只有may_nan行需要查找预热期之后的NaN（求和为inf/NaN时保守地扫描全部行）
+    if out is not None:
+        with np.errstate(invalid='ignore', over='ignore'):
+            finite = all(np.isfinite(np.add.reduce(values[name], axis=-1)).all() for name in series)
+        scan = np.array([INDICATOR_REGISTRY.get(name, {}).get('may_nan', False) for name in names]) if finite else None
+        _bfill_ffill(out, scan)
+        return dict(zip(names, out))
+    return {name: _bfill_ffill(values[name].copy() if name in series else values[name]) for name in names}
+
+
+def compute_indicator_block(high, low, close, volume, out=None, columns=None):
+    """纯NumPy指标内核：由连续的OHLCV数组计算指标，写入预分配的输出块。
+    输入沿最后一维为时间轴；columns默认为INDICATOR_COLUMNS，只计算所需的依赖子图；
+    返回形状 (len(columns),) + close.shape 的块，行顺序同columns"""
+    columns = INDICATOR_COLUMNS if columns is None else list(columns)
+    close = np.ascontiguousarray(close, dtype=np.float64)
+    if out is None:
+        out = np.empty((len(columns),) + close.shape)
+    evaluate_indicators(columns, {'high': high, 'low': low, 'close': close, 'volume': volume}, out=out)
+    return out
+
+
+def calculate_technical_indicators_numpy(df, columns=None):
+    """NumPy版计算技术指标：结果列与calculate_technical_indicators相同（columns可只计算部分列）"""
+    try:
+        columns = INDICATOR_COLUMNS if columns is None else list(columns)
+        block = compute_indicator_block(df['high'].to_numpy(), df['low'].to_numpy(),
+                                        df['close'].to_numpy(), df['volume'].to_numpy(), columns=columns)
+        indicators = pd.DataFrame(block.T, columns=columns, index=df.index)
+        return pd.concat([df, indicators], axis=1)
+    except Exception as e:
+        print(f"技术指标计算失败(numpy): {e}")
+        return calculate_technical_indicators(df)
+
+
+def check_numpy_indicator_parity(bars, rtol=1e-8, atol=1e-6, repeat=5, target_speedup=10.0):
+    """校验NumPy内核与pandas实现的结果一致，并对比耗时（各取repeat次中的最短耗时，NumPy内核写入预分配的输出块）。
+    加速比未达到target_speedup时如实报告为未达标（只报告，不影响一致性校验结果）"""
+    df = pd.DataFrame(bars, columns=['timestamp', 'open', 'high', 'low', 'close', 'volume'])
+
+    pandas_seconds = float('inf')
+    for _ in range(max(1, repeat)):
+        reference_df = df.copy()
+        start = time.perf_counter()
+        expected = calculate_technical_indicators(reference_df)
+        pandas_seconds = min(pandas_seconds, time.perf_counter() - start)
+
+    high, low, close, volume = (np.ascontiguousarray(df[key].to_numpy(dtype=np.float64))
+                                for key in ('high', 'low', 'close', 'volume'))
+    block = np.empty((len(INDICATOR_COLUMNS), len(df)))
+    numpy_seconds = float('inf')
+    for _ in range(max(1, repeat)):
+        start = time.perf_counter()
+        compute_indicator_block(high, low, close, volume, out=block)
+        numpy_seconds = min(numpy_seconds, time.perf_counter() - start)
+
+    worst = {}
+    failed = []
+    for i, column in enumerate(INDICATOR_COLUMNS):
+        reference = expected[column].to_numpy(dtype=float)
+        if not np.allclose(block[i], reference, rtol=rtol, atol=atol, equal_nan=True):
+            failed.append(column)
+        errors = np.abs(block[i] - reference)
+        worst[column] = float(np.max(errors[~np.isnan(errors)], initial=0.0))
+
+    # 只请求部分列（含共享中间量）时，写入输出块的结果须与单独求值一致
+    partial = ['true_range', 'bb_std', 'price_delta', 'rsi', 'bb_upper', 'atr_20']
+    series = {'high': df['high'].to_numpy(), 'low': df['low'].to_numpy(),
+              'close': df['close'].to_numpy(), 'volume': df['volume'].to_numpy()}
+    partial_block = compute_indicator_block(series['high'], series['low'], series['close'], series['volume'],
+                                            columns=partial)
+    separate = evaluate_indicators(partial, series)
+    for i, column in enumerate(partial):
+        if not np.allclose(partial_block[i], separate[column], rtol=rtol, atol=atol, equal_nan=True):
+            failed.append(f"columns={column}")
+
+    passed = not failed
+    print(f"{'✅' if passed else '❌'} NumPy指标内核与pandas一致性校验（{len(bars)} 根K线, rtol={rtol}, atol={atol}）")
+    speedup = pandas_seconds / max(numpy_seconds, 1e-9)
+    print(f"   - 耗时（{max(1, repeat)}次取最短）: pandas {pandas_seconds * 1000:.1f}ms, numpy {numpy_seconds * 1000:.1f}ms, "
+          f"加速 {speedup:.1f}x")
+    target_status = '✅ 达到' if speedup >= target_speedup else '⚠️ 未达到'
+    print(f"   - 加速目标 ≥{target_speedup:g}x: {target_status}")
+    for column, error in worst.items():
+        print(f"   - {column}: 最大绝对误差 {error:.2e}{' ❌' if column in failed else ''}")
+    partial_failed = [column for column in failed if column.startswith('columns=')]
+    print(f"   - 部分列输出（{', '.join(partial)}）: {'不一致 ' + ', '.join(partial_failed) + ' ❌' if partial_failed else '一致'}")
+    return passed, worst
+
+
+def compute_indicator_batch(ohlcv, columns=None):
+    """多品种批量计算技术指标：ohlcv为 (品种数, K线数, 6) 数组，列顺序同ccxt [timestamp, open, high, low, close, volume]。
+    所有品种在同一次向量化计算中完成，返回形状 (len(columns), 品种数, K线数) 的指标块（columns默认为INDICATOR_COLUMNS）"""
+    ohlcv = np.asarray(ohlcv, dtype=np.float64)
+    return compute_indicator_block(ohlcv[..., 2], ohlcv[..., 3], ohlcv[..., 4], ohlcv[..., 5], columns=columns)
+
+
+def analyze_indicator_batch(symbols, ohlcv, lookback=20):
+    """多品种批量趋势与支撑阻力分析，返回以品种为索引的DataFrame（每行对应最新K线）。
+    行内含最新指标与recent_high/recent_low，可直接传给market_trend_from_row / support_resistance_from_row；
+    trend_*与支撑阻力列为同样规则的向量化结果，便于按列筛选排序"""
+    ohlcv = np.asarray(ohlcv, dtype=np.float64)
+    block = compute_indicator_batch(ohlcv)
+
+    latest = ohlcv[:, -1, :]
+    frame = pd.DataFrame({
+        'timestamp': pd.to_datetime(latest[:, 0].astype(np.int64), unit='ms'),
+        'open': latest[:, 1],
+        'high': latest[:, 2],
+        'low': latest[:, 3],
+        'close': latest[:, 4],
+        'volume': latest[:, 5],
+    }, index=pd.Index(symbols, name='symbol'))
+    for i, column in enumerate(INDICATOR_COLUMNS):
+        frame[column] = block[i, :, -1]
+    frame['recent_high'] = ohlcv[:, -lookback:, 2].max(axis=1)
+    frame['recent_low'] = ohlcv[:, -lookback:, 3].min(axis=1)
+
+    # 趋势判断（规则同market_trend_from_row）
+    close = frame['close'].to_numpy()
+    short_up = close > frame['sma_20'].to_numpy()
+    medium_up = close > frame['sma_50'].to_numpy()
+    frame['trend_short'] = np.where(short_up, "上涨", "下跌")
+    frame['trend_medium'] = np.where(medium_up, "上涨", "下跌")
+    frame['trend_macd'] = np.where(frame['macd'].to_numpy() > frame['macd_signal'].to_numpy(), "bullish", "bearish")
+    frame['trend_overall'] = np.where(short_up & medium_up, "强势上涨",
+                                      np.where(~short_up & ~medium_up, "强势下跌", "震荡整理"))
+
+    # 支撑阻力位（规则同support_resistance_from_row）
+    frame['static_resistance'] = frame['recent_high']
+    frame['static_support'] = frame['recent_low']
+    frame['dynamic_resistance'] = frame['bb_upper']
+    frame['dynamic_support'] = frame['bb_lower']
+    frame['price_vs_resistance'] = (frame['recent_high'] - frame['close']) / frame['close'] * 100
+    frame['price_vs_support'] = (frame['close'] - frame['recent_low']) / frame['recent_low'] * 100
+    return frame
+
+
+def fetch_ohlcv_batch(symbols, timeframe, limit):
+    """拉取多个品种的K线并按最新K线时间对齐，返回 (成功的品种列表, (品种数, limit, 6) 数组)；
+    K线不足limit根或拉取失败的品种会被跳过"""
+    page_limit = TRADE_CONFIG.get('candle_cache', {}).get('fetch_limit', 300)
+    timeframe_ms = exchange.parse_timeframe(timeframe) * 1000
+    # 多拉一根，用于对齐各品种可能跨越K线边界的最新时间
+    fetch_limit = limit + 1
+
+    fetched = {}
+    for symbol in symbols:
+        try:
+            if fetch_limit <= page_limit:
+                bars = exchange.fetch_ohlcv(symbol, timeframe, limit=fetch_limit)
+            else:
+                since = exchange.milliseconds() - fetch_limit * timeframe_ms
+                bars = fetch_ohlcv_paged(symbol, timeframe, since, fetch_limit)
+        except Exception as e:
+            print(f"⚠️ {symbol} K线获取失败: {e}")
+            continue
+        if bars:
+            fetched[symbol] = bars
+
+    if not fetched:
+        return [], np.empty((0, limit, 6))
+
+    latest_timestamp = min(bars[-1][0] for bars in fetched.values())
+    aligned_symbols = []
+    aligned_bars = []
+    for symbol, bars in fetched.items():
+        bars = [bar for bar in bars if bar[0] <= latest_timestamp][-limit:]
+        if len(bars) < limit:
+            print(f"⚠️ {symbol} K线不足 {limit} 根（{len(bars)}），跳过")
+            continue
+        aligned_symbols.append(symbol)
+        aligned_bars.append(bars)
+    return aligned_symbols, np.array(aligned_bars, dtype=np.float64).reshape(-1, limit, 6)
+
+
 def get_support_resistance_levels(df, lookback=20):
     """计算支撑阻力位"""
     try:
         recent_high = df['high'].tail(lookback).max()
         recent_low = df['low'].tail(lookback).min()
-        current_price = df['close'].iloc[-1]
-
-        resistance_level = recent_high
-        support_level = recent_low
-
-        # 动态支撑阻力（基于布林带）
-        bb_upper = df['bb_upper'].iloc[-1]
-        bb_lower = df['bb_lower'].iloc[-1]
-
-        return {
-            'static_resistance': resistance_level,
-            'static_support': support_level,
-            'dynamic_resistance': bb_upper,
-            'dynamic_support': bb_lower,
-            'price_vs_resistance': ((resistance_level - current_price) / current_price) * 100,
-            'price_vs_support': ((current_price - support_level) / support_level) * 100
-        }
+        return support_resistance_from_row(df.iloc[-1], recent_high, recent_low)
     except Exception as e:
         print(f"支撑阻力计算失败: {e}")
         return {}
 
 
+def support_resistance_from_row(row, recent_high, recent_low):
+    """根据最新一行指标和近期高低点计算支撑阻力位"""
+    current_price = row['close']
+
+    resistance_level = recent_high
+    support_level = recent_low
+
+    # 动态支撑阻力（基于布林带）
+    bb_upper = row['bb_upper']
+    bb_lower = row['bb_lower']
+
+    return {
+        'static_resistance': resistance_level,
+        'static_support': support_level,
+        'dynamic_resistance': bb_upper,
+        'dynamic_support': bb_lower,
+        'price_vs_resistance': ((resistance_level - current_price) / current_price) * 100,
+        'price_vs_support': ((current_price - support_level) / support_level) * 100
+    }
+
+
 def get_market_trend(df):
     """判断市场趋势"""
     try:
-        current_price = df['close'].iloc[-1]
+        return market_trend_from_row(df.iloc[-1])
+    except Exception as e:
+        print(f"趋势分析失败: {e}")
+        return {}
 
-        # 多时间框架趋势分析
-        trend_short = "上涨" if current_price > df['sma_20'].iloc[-1] else "下跌"
-        trend_medium = "上涨" if current_price > df['sma_50'].iloc[-1] else "下跌"
 
-        # MACD趋势
-        macd_trend = "bullish" if df['macd'].iloc[-1] > df['macd_signal'].iloc[-1] else "bearish"
+def market_trend_from_row(row):
+    """根据最新一行指标判断市场趋势"""
+    current_price = row['close']
 
-        # 综合趋势判断
-        if trend_short == "上涨" and trend_medium == "上涨":
-            overall_trend = "强势上涨"
-        elif trend_short == "下跌" and trend_medium == "下跌":
-            overall_trend = "强势下跌"
-        else:
-            overall_trend = "震荡整理"
+    # 多时间框架趋势分析
+    trend_short = "上涨" if current_price > row['sma_20'] else "下跌"
+    trend_medium = "上涨" if current_price > row['sma_50'] else "下跌"
 
-        return {
-            'short_term': trend_short,
-            'medium_term': trend_medium,
-            'macd': macd_trend,
-            'overall': overall_trend,
-            'rsi_level': df['rsi'].iloc[-1]
+    # MACD趋势
+    macd_trend = "bullish" if row['macd'] > row['macd_signal'] else "bearish"
+
+    # 综合趋势判断
+    if trend_short == "上涨" and trend_medium == "上涨":
+        overall_trend = "强势上涨"
+    elif trend_short == "下跌" and trend_medium == "下跌":
+        overall_trend = "强势下跌"
+    else:
+        overall_trend = "震荡整理"
+
+    return {
+        'short_term': trend_short,
+        'medium_term': trend_medium,
+        'macd': macd_trend,
+        'overall': overall_trend,
+        'rsi_level': row['rsi']
+    }
+
+
+def fetch_ohlcv_paged(symbol, timeframe, since, limit):
+    """从since开始向后分页拉取K线，直到拉满limit根或追到最新K线"""
+    page_limit = TRADE_CONFIG.get('candle_cache', {}).get('fetch_limit', 300)
+    timeframe_ms = exchange.parse_timeframe(timeframe) * 1000
+    bars = []
+
+    while len(bars) < limit:
+        page = exchange.fetch_ohlcv(symbol, timeframe, since=since, limit=min(page_limit, limit - len(bars)))
+        if bars:
+            # 去掉与上一页重叠的K线
+            page = [bar for bar in (page or []) if bar[0] > bars[-1][0]]
+        if not page:
+            break
+
+        bars.extend(page)
+        since = page[-1][0] + timeframe_ms
+
+        # 已经拉到正在形成的K线，无需继续翻页
+        if since > exchange.milliseconds():
+            break
+
+    return bars[:limit]
+
+
+# K线归档的列定义：每列一个定长小端二进制文件
+CANDLE_ARCHIVE_COLUMNS = [
+    ('open', '<f8'),
+    ('high', '<f8'),
+    ('low', '<f8'),
+    ('close', '<f8'),
+    ('volume', '<f8'),
+    ('timestamp', '<i8'),  # 时间戳列最后写入，其长度即为已提交的K线数量
+]
+
+
+class CandleArchive:
+    """本地K线归档：按列存储、只追加，读取时内存映射（零拷贝）"""
+
+    def __init__(self, symbol, timeframe, root=None):
+        root = root or TRADE_CONFIG.get('candle_archive', {}).get('dir', 'data/candles')
+        self.symbol = symbol
+        self.timeframe = timeframe
+        self.path = os.path.join(root, symbol.replace('/', '-').replace(':', '-'), timeframe)
+        os.makedirs(self.path, exist_ok=True)
+        self._repair()
+
+    def _column_path(self, name):
+        return os.path.join(self.path, f"{name}.bin")
+
+    def _column_rows(self, name, dtype):
+        column_path = self._column_path(name)
+        if not os.path.exists(column_path):
+            return 0
+        return os.path.getsize(column_path) // np.dtype(dtype).itemsize
+
+    def _repair(self):
+        """追加中途中断时，各列长度可能不一致：统一截断到最短列"""
+        rows = min(self._column_rows(name, dtype) for name, dtype in CANDLE_ARCHIVE_COLUMNS)
+        for name, dtype in CANDLE_ARCHIVE_COLUMNS:
+            column_path = self._column_path(name)
+            size = rows * np.dtype(dtype).itemsize
+            if not os.path.exists(column_path) or os.path.getsize(column_path) != size:
+                with open(column_path, 'ab') as f:
+                    f.truncate(size)
+
+    def __len__(self):
+        return self._column_rows('timestamp', '<i8')
+
+    def last_timestamp(self):
+        """最后一根归档K线的时间戳（毫秒），归档为空时返回None"""
+        if len(self) == 0:
+            return None
+        with open(self._column_path('timestamp'), 'rb') as f:
+            f.seek(-8, os.SEEK_END)
+            return int(np.frombuffer(f.read(8), dtype='<i8')[0])
+
+    def append(self, bars):
+        """追加已收盘K线（只接受比归档更新的K线），返回实际追加数量"""
+        last_ts = self.last_timestamp()
+        bars = sorted((bar for bar in bars if last_ts is None or bar[0] > last_ts), key=lambda bar: bar[0])
+        if not bars:
+            return 0
+
+        block = np.asarray(bars, dtype='<f8')
+        columns = {
+            'timestamp': np.asarray([bar[0] for bar in bars], dtype='<i8'),
+            'open': block[:, 1],
+            'high': block[:, 2],
+            'low': block[:, 3],
+            'close': block[:, 4],
+            'volume': block[:, 5],
         }
+        for name, dtype in CANDLE_ARCHIVE_COLUMNS:
+            with open(self._column_path(name), 'ab') as f:
+                f.write(np.ascontiguousarray(columns[name], dtype=dtype).tobytes())
+        return len(bars)
+
+    def read(self, start=None, end=None, tail=None):
+        """内存映射读取各列，返回 {列名: ndarray}；start/end为毫秒时间戳（含start，不含end）"""
+        rows = len(self)
+        if rows == 0:
+            return {name: np.empty(0, dtype=dtype) for name, dtype in CANDLE_ARCHIVE_COLUMNS}
+
+        columns = {
+            name: np.memmap(self._column_path(name), dtype=dtype, mode='r', shape=(rows,))
+            for name, dtype in CANDLE_ARCHIVE_COLUMNS
+        }
+        lo = 0 if start is None else int(np.searchsorted(columns['timestamp'], start, side='left'))
+        hi = rows if end is None else int(np.searchsorted(columns['timestamp'], end, side='left'))
+        if tail is not None:
+            lo = max(lo, hi - tail)
+        return {name: column[lo:hi] for name, column in columns.items()}
+
+    def read_bars(self, tail):
+        """以fetch_ohlcv相同的列表格式读取最近tail根K线"""
+        columns = self.read(tail=tail)
+        return [
+            [int(ts), float(o), float(h), float(l), float(c), float(v)]
+            for ts, o, h, l, c, v in zip(columns['timestamp'], columns['open'], columns['high'],
+                                         columns['low'], columns['close'], columns['volume'])
+        ]
+
+    def to_dataframe(self, start=None, end=None, tail=None):
+        """读取为与get_btc_ohlcv_enhanced相同列结构的DataFrame"""
+        columns = self.read(start=start, end=end, tail=tail)
+        df = pd.DataFrame({name: columns[name] for name in ['timestamp', 'open', 'high', 'low', 'close', 'volume']})
+        df['timestamp'] = pd.to_datetime(df['timestamp'], unit='ms')
+        return df
+
+
+# 已打开的归档实例（按交易对+周期复用）
+candle_archives = {}
+
+
+def get_candle_archive(symbol, timeframe):
+    """获取（或创建）交易对+周期对应的K线归档"""
+    key = (symbol, timeframe)
+    if key not in candle_archives:
+        candle_archives[key] = CandleArchive(symbol, timeframe)
+    return candle_archives[key]
+
+
+def archive_closed_bars(symbol, timeframe, bars):
+    """把已收盘K线追加到本地归档（未收盘K线不落盘）"""
+    if not TRADE_CONFIG.get('candle_archive', {}).get('enable_archive', True):
+        return 0
+    try:
+        timeframe_ms = exchange.parse_timeframe(timeframe) * 1000
+        now_ms = exchange.milliseconds()
+        closed = [bar for bar in bars if bar[0] + timeframe_ms <= now_ms]
+        archive = get_candle_archive(symbol, timeframe)
+        last_ts = archive.last_timestamp()
+        new_bars = [bar for bar in closed if last_ts is None or bar[0] > last_ts]
+        # 只追加与归档连续的K线，断档需通过backfill命令补齐
+        if new_bars and last_ts is not None and new_bars[0][0] > last_ts + timeframe_ms:
+            print("⚠️ K线归档存在断档，跳过写入（请运行 python main.py backfill）")
+            return 0
+        return archive.append(new_bars)
     except Exception as e:
-        print(f"趋势分析失败: {e}")
-        return {}
+        print(f"⚠️ K线归档写入失败: {e}")
+        return 0
+
+
+def backfill_candle_archive(symbol, timeframe, days):
+    """分页拉取历史K线回补到本地归档（从归档末尾或days天前开始，直到最新已收盘K线）"""
+    archive = get_candle_archive(symbol, timeframe)
+    timeframe_ms = exchange.parse_timeframe(timeframe) * 1000
+    chunk = TRADE_CONFIG.get('candle_cache', {}).get('fetch_limit', 300) * 10
+
+    last_ts = archive.last_timestamp()
+    since = last_ts + timeframe_ms if last_ts is not None else exchange.milliseconds() - days * 86400 * 1000
+    print(f"📥 回补 {symbol} {timeframe} K线，起点: {datetime.fromtimestamp(since / 1000)}")
+
+    total = 0
+    while True:
+        bars = fetch_ohlcv_paged(symbol, timeframe, since, chunk)
+        closed = [bar for bar in bars if bar[0] + timeframe_ms <= exchange.milliseconds()]
+        if not closed:
+            break
+        total += archive.append(closed)
+        since = closed[-1][0] + timeframe_ms
+        print(f"   - 已写入 {total} 根, 最新: {datetime.fromtimestamp(closed[-1][0] / 1000)}")
+        if len(closed) < len(bars) or len(bars) < chunk:
+            break
+
+    print(f"✅ {symbol} {timeframe} 回补完成: 新增 {total} 根, 归档共 {len(archive)} 根")
+    return total
+
+
+def run_backfill_command(argv):
+    """命令行：python main.py backfill [--days N] [--timeframes 15m 1m] [--symbol SYMBOL]"""
+    config = TRADE_CONFIG.get('candle_archive', {})
+    parser = argparse.ArgumentParser(prog='main.py backfill', description='回补历史K线到本地归档')
+    parser.add_argument('--symbol', default=TRADE_CONFIG['symbol'])
+    parser.add_argument('--days', type=int, default=config.get('backfill_days', 90))
+    parser.add_argument('--timeframes', nargs='+', default=config.get('backfill_timeframes', ['15m']))
+    args = parser.parse_args(argv)
+
+    for timeframe in args.timeframes:
+        try:
+            backfill_candle_archive(args.symbol, timeframe, args.days)
+        except Exception as e:
+            print(f"❌ {timeframe} 回补失败: {e}")
+            import traceback
+            traceback.print_exc()
+
+
+def okx_inst_id(symbol):
+    """ccxt统一符号转OKX instId：BTC/USDT:USDT -> BTC-USDT-SWAP，BTC/USDT -> BTC-USDT"""
+    pair, _, settle = symbol.partition(':')
+    base, quote = pair.split('/')
+    return f"{base}-{quote}-SWAP" if settle else f"{base}-{quote}"
+
+
+def okx_candle_channel(timeframe):
+    """K线周期转OKX频道名：15m -> candle15m，1h -> candle1H，1d -> candle1D"""
+    unit = timeframe[-1]
+    return f"candle{timeframe[:-1]}{unit.upper() if unit in 'hdw' else unit}"
+
+
+class WebSocketTransport:
+    """默认WebSocket传输层（websockets同步客户端）。可替换为实现send/recv/close的任意对象，
+    例如测试用的本地替身；recv(timeout)超时返回None，连接断开时抛出异常"""
+
+    def __init__(self, url, open_timeout=10):
+        if ws_connect is None:
+            raise RuntimeError("未安装websockets，无法使用WebSocket行情")
+        self._connection = ws_connect(url, open_timeout=open_timeout)
+
+    def send(self, text):
+        self._connection.send(text)
+
+    def recv(self, timeout):
+        try:
+            return self._connection.recv(timeout=timeout)
+        except TimeoutError:
+            return None
+
+    def close(self):
+        self._connection.close()
+
+
+class ReconnectingWebSocket:
+    """自动重连的WebSocket订阅：连接后发送订阅请求，空闲时发送ping保活；断线后指数退避重连并重新订阅"""
+
+    def __init__(self, url, args, on_message, transport_factory=None, ping_interval=20, max_backoff=30,
+                 name='ws-feed', login=None):
+        self.url = url
+        self.args = args
+        self.login = login  # 私有频道：返回登录消息的函数，连接后先登录再订阅
+        self.on_message = on_message
+        self.transport_factory = transport_factory or WebSocketTransport
+        self.ping_interval = ping_interval
+        self.max_backoff = max_backoff
+        self.name = name
+        self.connected = False
+        self.reconnects = 0
+        self._stop = threading.Event()
+        self._transport = None
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        transport = self._transport
+        if transport is not None:
+            try:
+                transport.close()
+            except Exception:
+                pass
+
+    def _run(self):
+        backoff = 1
+        while not self._stop.is_set():
+            try:
+                self._transport = self.transport_factory(self.url)
+                if self.login is not None:
+                    self._transport.send(json.dumps(self.login()))
+                    reply = json.loads(self._transport.recv(10) or '{}')
+                    if reply.get('event') != 'login' or reply.get('code') != '0':
+                        raise RuntimeError(f"登录失败: {reply}")
+                self._transport.send(json.dumps({'op': 'subscribe', 'args': self.args}))
+                self.connected = True
+                backoff = 1
+                while not self._stop.is_set():
+                    message = self._transport.recv(self.ping_interval)
+                    if message is None:
+                        self._transport.send('ping')
+                        continue
+                    if message == 'pong':
+                        continue
+                    self.on_message(json.loads(message))
+            except Exception as e:
+                if not self._stop.is_set():
+                    print(f"⚠️ WebSocket连接中断（{self.name}）: {e}，{backoff}s后重连")
+            finally:
+                self.connected = False
+                if self._transport is not None:
+                    try:
+                        self._transport.close()
+                    except Exception:
+                        pass
+                    self._transport = None
+            if self._stop.wait(backoff):
+                break
+            self.reconnects += 1
+            backoff = min(backoff * 2, self.max_backoff)
+
+
+class MarketDataFeed:
+    """WebSocket行情：订阅OKX K线与ticker频道。后台线程只解析消息并把已确认（收盘）的K线放入队列；
+    主线程用wait_for_closed_bar()在K线确认的瞬间被唤醒，再由merge_into_cache()把新K线并入K线缓存，
+    发现断档（断线期间漏掉的K线）时用REST补齐"""
+
+    def __init__(self, symbol, timeframe, transport_factory=None, config=None):
+        config = config or TRADE_CONFIG.get('market_feed', {})
+        self.symbol = symbol
+        self.timeframe = timeframe
+        self.timeframe_ms = exchange.parse_timeframe(timeframe) * 1000
+        self.ticker = None
+        self.last_confirm_latency = None
+        self._closed = queue.Queue()
+        self._pending = []
+        inst_id = okx_inst_id(symbol)
+        options = {'transport_factory': transport_factory, 'ping_interval': config.get('ping_interval', 20),
+                   'max_backoff': config.get('max_backoff', 30)}
+        self.candle_ws = ReconnectingWebSocket(
+            config.get('candle_url', 'wss://ws.okx.com:8443/ws/v5/business'),
+            [{'channel': okx_candle_channel(timeframe), 'instId': inst_id}],
+            self._on_candle_message, name='ws-candles', **options)
+        self.ticker_ws = ReconnectingWebSocket(
+            config.get('ticker_url', 'wss://ws.okx.com:8443/ws/v5/public'),
+            [{'channel': 'tickers', 'instId': inst_id}],
+            self._on_ticker_message, name='ws-ticker', **options)
+
+    def start(self):
+        self.candle_ws.start()
+        self.ticker_ws.start()
+        print(f"📡 WebSocket行情已启动: {self.symbol} {self.timeframe}")
+
+    def stop(self):
+        self.candle_ws.stop()
+        self.ticker_ws.stop()
+
+    def _on_candle_message(self, message):
+        if message.get('event') == 'error':
+            print(f"❌ K线频道订阅失败: {message.get('msg')}")
+            return
+        for row in message.get('data') or []:
+            # [ts, o, h, l, c, vol, volCcy, volCcyQuote, confirm]，confirm为"1"表示K线已收盘
+            if len(row) > 8 and row[8] == '1':
+                bar = [int(row[0])] + [float(value) for value in row[1:6]]
+                self._closed.put((time.time(), bar))
+
+    def _on_ticker_message(self, message):
+        for row in message.get('data') or []:
+            self.ticker = {'price': float(row['last']), 'timestamp': int(row['ts']), 'received': time.time()}
+
+    def latest_price(self, max_age=5):
+        """ticker推送的最新价（超过max_age秒未更新返回None）"""
+        ticker = self.ticker
+        if ticker is None or time.time() - ticker['received'] > max_age:
+            return None
+        return ticker['price']
+
+    def wait_for_closed_bar(self, bar_open_ms, timeout):
+        """阻塞到开盘时间为bar_open_ms的K线确认收盘（返回True），超时返回False"""
+        deadline = time.time() + timeout
+        while not (self._pending and self._pending[-1][0] >= bar_open_ms):
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return False
+            try:
+                received, bar = self._closed.get(timeout=remaining)
+            except queue.Empty:
+                return False
+            self._pending.append(bar)
+            self.last_confirm_latency = received - (bar[0] + self.timeframe_ms) / 1000
+        return True
+
+    def merge_into_cache(self):
+        """把已确认的K线并入candle_cache（主线程调用）；与缓存之间有断档时先用REST补齐。
+        本次确实并入了刚收盘K线的确认版本时返回True，否则返回False（由调用方走REST；
+        缓存末尾可能只是上个周期读到的未收盘快照）"""
+        while True:
+            try:
+                self._pending.append(self._closed.get_nowait()[1])
+            except queue.Empty:
+                break
+        bars = candle_cache['bars']
+        if not bars or candle_cache['symbol'] != self.symbol or candle_cache['timeframe'] != self.timeframe:
+            self._pending.clear()
+            return False
+
+        merged = []
+        for bar in sorted(self._pending, key=lambda item: item[0]):
+            if bar[0] <= bars[-1][0]:
+                # 替换缓存中同一根K线的未收盘版本，更早的重复推送忽略
+                for index in range(len(bars) - 1, max(len(bars) - 3, -1), -1):
+                    if bars[index][0] == bar[0]:
+                        bars[index] = bar
+                        merged.append(bar)
+                        break
+                continue
+            if bar[0] - bars[-1][0] > self.timeframe_ms:
+                missing = (bar[0] - bars[-1][0]) // self.timeframe_ms - 1
+                gap = [list(row) for row in fetch_ohlcv_paged(self.symbol, self.timeframe,
+                                                              bars[-1][0] + self.timeframe_ms, missing)
+                       if row[0] < bar[0]]
+                print(f"🩹 WebSocket行情断档 {missing} 根K线，已通过REST补齐 {len(gap)} 根")
+                bars.extend(gap)
+                merged.extend(gap)
+            bars.append(bar)
+            merged.append(bar)
+        self._pending.clear()
+
+        if merged:
+            max_bars = TRADE_CONFIG.get('candle_cache', {}).get('max_bars', 1000)
+            if len(bars) > max_bars:
+                del bars[:-max_bars]
+            archive_closed_bars(self.symbol, self.timeframe, merged)
+
+        current_open = exchange.milliseconds() // self.timeframe_ms * self.timeframe_ms
+        just_closed = current_open - self.timeframe_ms
+        return bars[-1][0] == just_closed and any(bar[0] == just_closed for bar in merged)
+
+
+def okx_ws_login_message():
+    """OKX私有WebSocket登录消息：sign = Base64(HMAC-SHA256(secret, timestamp + 'GET' + '/users/self/verify'))"""
+    timestamp = str(int(time.time()))
+    digest = hmac.new((OKX_CONFIG['secret'] or '').encode(), f"{timestamp}GET/users/self/verify".encode(),
+                      hashlib.sha256).digest()
+    return {'op': 'login', 'args': [{'apiKey': OKX_CONFIG['apiKey'], 'passphrase': OKX_CONFIG['password'],
+                                     'timestamp': timestamp, 'sign': base64.b64encode(digest).decode()}]}
+
+
+class OrderEventTracker:
+    """订单事件跟踪：私有WebSocket的orders/orders-algo频道按订单ID记录成交、撤单状态，
+    调用方等待确认或超时，而不是固定sleep；私有流未启用或断开时退化为快速REST轮询"""
+
+    FILLED = {'filled'}
+    CANCELED = {'canceled', 'mmp_canceled'}
+
+    def __init__(self, max_orders=500):
+        self.max_orders = max_orders
+        self.stream = None
+        self._states = OrderedDict()  # 订单ID（ordId/algoId） -> 状态
+        self._condition = threading.Condition()
+        self._listeners = []  # 推送回调 callback(频道, 订单行)
+
+    def start_stream(self, transport_factory=None):
+        config = TRADE_CONFIG.get('order_events', {})
+        inst_type = 'SWAP' if ':' in TRADE_CONFIG['symbol'] else 'SPOT'
+        self.stream = ReconnectingWebSocket(
+            config.get('private_url', 'wss://ws.okx.com:8443/ws/v5/private'),
+            [{'channel': 'orders', 'instType': inst_type}, {'channel': 'orders-algo', 'instType': inst_type}],
+            self._on_message, transport_factory=transport_factory, name='ws-orders', login=okx_ws_login_message)
+        self.stream.start()
+        print("📡 私有订单推送已启动")
+
+    def stop(self):
+        if self.stream is not None:
+            self.stream.stop()
+
+    def add_listener(self, callback):
+        """注册订单推送回调 callback(频道, 订单行)，在推送线程中调用"""
+        if callback not in self._listeners:
+            self._listeners.append(callback)
+
+    def _on_message(self, message):
+        if message.get('event') == 'error':
+            print(f"❌ 订单频道订阅失败: {message.get('msg')}")
+            return
+        rows = message.get('data') or []
+        with self._condition:
+            for row in rows:
+                order_id = row.get('ordId') or row.get('algoId')
+                if order_id:
+                    self._states[order_id] = row.get('state')
+                    self._states.move_to_end(order_id)
+            while len(self._states) > self.max_orders:
+                self._states.popitem(last=False)
+            self._condition.notify_all()
+
+        channel = (message.get('arg') or {}).get('channel')
+        for callback in list(self._listeners):
+            for row in rows:
+                try:
+                    callback(channel, row)
+                except Exception as e:
+                    print(f"⚠️ 订单推送回调失败: {e}")
+
+    def _stream_connected(self):
+        return self.stream is not None and self.stream.connected
+
+    def _wait_stream(self, order_ids, states, deadline):
+        """等待推送确认；全部确认返回True，超时或推送断开返回False"""
+        with self._condition:
+            while not all(self._states.get(order_id) in states for order_id in order_ids):
+                remaining = deadline - time.time()
+                if remaining <= 0 or not self._stream_connected():
+                    return False
+                self._condition.wait(min(remaining, 0.5))
+        return True
+
+    def _poll(self, check, deadline):
+        interval = TRADE_CONFIG.get('order_events', {}).get('poll_interval', 0.2)
+        while True:
+            try:
+                if check():
+                    return True
+            except Exception as e:
+                print(f"⚠️ 查询订单状态失败: {e}")
+            if time.time() + interval > deadline:
+                return False
+            time.sleep(interval)
+
+    def _wait(self, order_ids, states, check, timeout, action):
+        started = time.time()
+        deadline = started + timeout
+        confirmed = self._stream_connected() and self._wait_stream(order_ids, states, deadline)
+        source = 'WebSocket'
+        if not confirmed and time.time() < deadline:
+            confirmed, source = self._poll(check, deadline), 'REST'
+        if confirmed:
+            print(f"✅ {action}确认（{source}，{time.time() - started:.2f}s）")
+        else:
+            print(f"⚠️ {timeout:.1f}s内未确认{action}，继续执行")
+        return confirmed
+
+    def wait_filled(self, order_id, timeout=None):
+        """等待订单成交；返回是否确认"""
+        if not order_id:
+            return False
+        timeout = timeout if timeout is not None else TRADE_CONFIG.get('order_events', {}).get('fill_timeout', 5.0)
+
+        def check():
+            order = exchange.fetch_order(order_id, TRADE_CONFIG['symbol'])
+            return order.get('status') == 'closed'
+
+        return self._wait([order_id], self.FILLED, check, timeout, f"订单 {order_id} 成交")
+
+    def wait_canceled(self, order_ids, timeout=None, fetch_open_ids=None):
+        """等待一组订单撤销（不再出现在挂单列表中）；返回是否确认。
+        fetch_open_ids为REST轮询时获取挂单ID的函数，默认查询普通挂单（algo委托需传入对应查询）"""
+        order_ids = [order_id for order_id in order_ids if order_id]
+        if not order_ids:
+            return True
+        timeout = timeout if timeout is not None else TRADE_CONFIG.get('order_events', {}).get('cancel_timeout', 3.0)
+
+        def check():
+            if fetch_open_ids is not None:
+                open_ids = set(fetch_open_ids())
+            else:
+                open_ids = {order.get('id') for order in exchange.fetch_open_orders(TRADE_CONFIG['symbol'])}
+            return not open_ids.intersection(order_ids)
+
+        return self._wait(order_ids, self.CANCELED, check, timeout, f"{len(order_ids)} 个订单撤销")
+
+
+order_events = OrderEventTracker()
+
+
+def start_order_events(transport_factory=None):
+    """按配置启动私有订单推送（未启用时订单确认使用REST轮询）"""
+    if TRADE_CONFIG.get('order_events', {}).get('enable_ws', False) and order_events.stream is None:
+        order_events.start_stream(transport_factory)
+    return order_events
+
+
+# 全局WebSocket行情（enable_ws时由start_market_feed启动）
+market_feed = None
+
+
+def start_market_feed(transport_factory=None):
+    """按配置启动WebSocket行情；transport_factory用于替换传输层（如本地测试替身）"""
+    global market_feed
+    if not TRADE_CONFIG.get('market_feed', {}).get('enable_ws', False):
+        return None
+    if market_feed is None:
+        market_feed = MarketDataFeed(TRADE_CONFIG['symbol'], TRADE_CONFIG['timeframe'], transport_factory)
+        market_feed.start()
+    return market_feed
+
+
+def fetch_ohlcv_cached(symbol, timeframe, limit):
+    """增量获取K线：缓存已有K线，只拉取最后缓存时间戳之后的新K线（含替换未收盘K线）；
+    WebSocket行情已推送最新收盘K线时直接使用缓存，不发REST请求"""
+    feed = market_feed
+    if feed is not None and feed.symbol == symbol and feed.timeframe == timeframe and feed.merge_into_cache():
+        print("📡 使用WebSocket推送的收盘K线")
+        return candle_cache['bars'][-limit:]
+
+    config = TRADE_CONFIG.get('candle_cache', {})
+    max_bars = max(config.get('max_bars', 1000), limit)
+    page_limit = config.get('fetch_limit', 300)
+    timeframe_ms = exchange.parse_timeframe(timeframe) * 1000
+    bars = candle_cache['bars']
+
+    # 冷启动时优先从本地归档预热缓存，之后只需增量拉取
+    if (not bars or candle_cache['symbol'] != symbol or candle_cache['timeframe'] != timeframe) \
+            and TRADE_CONFIG.get('candle_archive', {}).get('enable_archive', True):
+        try:
+            bars = get_candle_archive(symbol, timeframe).read_bars(max_bars)
+            if bars:
+                candle_cache.update({'symbol': symbol, 'timeframe': timeframe, 'bars': bars})
+                print(f"💾 从本地归档预热K线缓存: {len(bars)} 根")
+        except Exception as e:
+            print(f"⚠️ 读取K线归档失败: {e}")
+
+    # 缓存缺失、交易对变化或断档过久时，全量重新加载
+    cache_valid = (
+        bars
+        and candle_cache['symbol'] == symbol
+        and candle_cache['timeframe'] == timeframe
+        and (exchange.milliseconds() - bars[-1][0]) // timeframe_ms < max_bars
+    )
+
+    if not cache_valid:
+        if limit <= page_limit:
+            fresh = exchange.fetch_ohlcv(symbol, timeframe, limit=limit)
+        else:
+            since = exchange.milliseconds() - limit * timeframe_ms
+            fresh = fetch_ohlcv_paged(symbol, timeframe, since, limit + 1)
+        candle_cache['symbol'] = symbol
+        candle_cache['timeframe'] = timeframe
+        candle_cache['bars'] = [list(bar) for bar in (fresh or [])]
+        print(f"📦 K线缓存全量加载: {len(candle_cache['bars'])} 根")
+    else:
+        # 从最后一根缓存K线（可能未收盘）开始拉取，用新数据覆盖它
+        last_ts = bars[-1][0]
+        fresh = fetch_ohlcv_paged(symbol, timeframe, last_ts, max_bars)
+        if fresh:
+            first_ts = fresh[0][0]
+            while bars and bars[-1][0] >= first_ts:
+                bars.pop()
+            bars.extend(list(bar) for bar in fresh)
+        new_count = len([bar for bar in (fresh or []) if bar[0] > last_ts])
+        print(f"📦 K线缓存增量更新: 新增 {new_count} 根, 刷新未收盘K线")
+
+    if len(candle_cache['bars']) > max_bars:
+        del candle_cache['bars'][:-max_bars]
+
+    archive_closed_bars(symbol, timeframe, fresh or [])
+
+    return candle_cache['bars'][-limit:]
 
 
 def get_btc_ohlcv_enhanced():
     """增强版：获取BTC K线数据并计算技术指标"""
     try:
         print(f"🔍 正在获取 {TRADE_CONFIG['symbol']} 的K线数据...")
-        # 获取K线数据
-        ohlcv = exchange.fetch_ohlcv(TRADE_CONFIG['symbol'], TRADE_CONFIG['timeframe'],
-                                     limit=TRADE_CONFIG['data_points'])
-        
+        # 获取K线数据（启用缓存时只增量拉取新K线）
+        if TRADE_CONFIG.get('candle_cache', {}).get('enable_cache', True):
+            ohlcv = fetch_ohlcv_cached(TRADE_CONFIG['symbol'], TRADE_CONFIG['timeframe'],
+                                       TRADE_CONFIG['data_points'])
+        else:
+            ohlcv = exchange.fetch_ohlcv(TRADE_CONFIG['symbol'], TRADE_CONFIG['timeframe'],
+                                         limit=TRADE_CONFIG['data_points'])
+
         if not ohlcv or len(ohlcv) == 0:
             print("❌ 获取K线数据为空")
             return None
@@ -562,20 +2458,35 @@ def get_btc_ohlcv_enhanced():
         print(f"📊 最新价格: {df['close'].iloc[-1]:.2f}")
 
         # 计算技术指标
-        print("🔧 正在计算技术指标...")
-        df = calculate_technical_indicators(df)
+        if TRADE_CONFIG.get('indicator_engine', 'pandas') == 'streaming':
+            print("🔧 正在增量更新技术指标（流式引擎）...")
+            current_data = get_streaming_indicator_row(ohlcv)
 
-        current_data = df.iloc[-1]
-        previous_data = df.iloc[-2]
+            print("📈 正在分析市场趋势...")
+            trend_analysis = market_trend_from_row(current_data)
+
+            print("🎯 正在计算支撑阻力位...")
+            levels_analysis = support_resistance_from_row(
+                current_data, current_data['recent_high'], current_data['recent_low'])
+        else:
+            print("🔧 正在计算技术指标...")
+            if TRADE_CONFIG.get('indicator_engine', 'pandas') == 'numpy':
+                # 只计算实盘用到的指标依赖子图
+                df = calculate_technical_indicators_numpy(df, LIVE_INDICATOR_COLUMNS)
+            else:
+                df = calculate_technical_indicators(df)
+            current_data = df.iloc[-1]
+
+            # 获取技术分析数据
+            print("📈 正在分析市场趋势...")
+            trend_analysis = get_market_trend(df)
+
+            print("🎯 正在计算支撑阻力位...")
+            levels_analysis = get_support_resistance_levels(df)
 
-        # 获取技术分析数据
-        print("📈 正在分析市场趋势...")
-        trend_analysis = get_market_trend(df)
+        previous_data = df.iloc[-2]
         if not trend_analysis:
             trend_analysis = {}
-            
-        print("🎯 正在计算支撑阻力位...")
-        levels_analysis = get_support_resistance_levels(df)
         if not levels_analysis:
             levels_analysis = {}
         
@@ -653,26 +2564,74 @@ def generate_technical_analysis_text(price_data):
     return analysis_text
 
 
+class AccountSnapshot:
+    """单周期账户快照：余额与持仓经异步交易所适配器并发各拉取一次，周期内所有读取复用同一份结果；
+    下单/平仓后必须调用invalidate()，下一次读取会重新拉取"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pending = None  # (余额Future, 持仓Future)
+
+    def _futures(self):
+        with self._lock:
+            if self._pending is None:
+                self._pending = (async_exchange.submit('fetch_balance'),
+                                 async_exchange.submit('fetch_positions', [TRADE_CONFIG['symbol']]))
+            return self._pending
+
+    def _result(self, index):
+        futures = self._futures()
+        try:
+            return futures[index].result()
+        except Exception:
+            # 拉取失败的结果不缓存，下次读取重新请求
+            with self._lock:
+                if self._pending is futures:
+                    self._pending = None
+            raise
+
+    def begin_cycle(self):
+        """周期开始：丢弃旧快照，并在后台提前拉取（与K线获取等步骤并行）"""
+        self.invalidate()
+        self._futures()
+
+    def invalidate(self):
+        with self._lock:
+            self._pending = None
+
+    def get_balance(self):
+        return self._result(0)
+
+    def get_positions(self):
+        return self._result(1)
+
+
+account_snapshot = AccountSnapshot()
+
+
+def position_from_list(positions):
+    """从fetch_positions结果中取出当前交易对的持仓（无持仓返回None）"""
+    for pos in positions:
+        if pos['symbol'] == TRADE_CONFIG['symbol']:
+            contracts = float(pos['contracts']) if pos['contracts'] else 0
+
+            if contracts > 0:
+                return {
+                    'side': pos['side'],  # 'long' or 'short'
+                    'size': contracts,
+                    'entry_price': float(pos['entryPrice']) if pos['entryPrice'] else 0,
+                    'unrealized_pnl': float(pos['unrealizedPnl']) if pos['unrealizedPnl'] else 0,
+                    'leverage': float(pos['leverage']) if pos['leverage'] else 5,  # 默认5倍杠杆
+                    'symbol': pos['symbol']
+                }
+
+    return None
+
+
 def get_current_position():
-    """获取当前持仓情况 - OKX版本"""
+    """获取当前持仓情况 - OKX版本（读取本周期账户快照）"""
     try:
-        positions = exchange.fetch_positions([TRADE_CONFIG['symbol']])
-
-        for pos in positions:
-            if pos['symbol'] == TRADE_CONFIG['symbol']:
-                contracts = float(pos['contracts']) if pos['contracts'] else 0
-
-                if contracts > 0:
-                    return {
-                        'side': pos['side'],  # 'long' or 'short'
-                        'size': contracts,
-                        'entry_price': float(pos['entryPrice']) if pos['entryPrice'] else 0,
-                        'unrealized_pnl': float(pos['unrealizedPnl']) if pos['unrealizedPnl'] else 0,
-                        'leverage': float(pos['leverage']) if pos['leverage'] else 5,  # 默认5倍杠杆
-                        'symbol': pos['symbol']
-                    }
-
-        return None
+        return position_from_list(account_snapshot.get_positions())
 
     except Exception as e:
         print(f"获取持仓失败: {e}")
@@ -681,22 +2640,131 @@ def get_current_position():
         return None
 
 
-def safe_json_parse(json_str):
-    """安全解析JSON，处理格式不规范的情况"""
+_JSON_SPACES = re.compile(r'\s*')
+_JSON_WHITESPACE = re.compile(r'[\s,]*')            # 空白与多余的逗号（含尾随逗号）一并跳过
+_JSON_DOUBLE_STRING = re.compile(r'"((?:[^"\\]|\\.)*)"', re.S)
+_JSON_SINGLE_STRING = re.compile(r"'((?:[^'\\]|\\.)*)'", re.S)
+_JSON_NUMBER = re.compile(r'-?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?')
+_JSON_BARE_WORD = re.compile(r'[^\s:,{}\[\]"\']+')
+_JSON_BARE_VALUE = re.compile(r'[^,}\]\n]+')
+_JSON_LITERALS = {'true': True, 'false': False, 'null': None, 'True': True, 'False': False, 'None': None}
+_JSON_STRING_DECODER = json.JSONDecoder(strict=False)
+
+
+class TolerantJSONScanner:
+    """单遍容错JSON扫描：从第一个'{'开始按语法逐个读取记号，直接构造对象，不改写原文。
+    容忍单引号字符串、无引号键、尾随逗号、字符串中的原始换行，以及无引号的取值（如 signal: BUY）；
+    字符串内容整体按正则截取，冒号/引号等字符不会被误处理"""
+
+    def __init__(self, text):
+        self.text = text
+        self.pos = 0
+
+    def _skip(self):
+        self.pos = _JSON_WHITESPACE.match(self.text, self.pos).end()
+
+    def _string(self):
+        quote = self.text[self.pos]
+        match = (_JSON_DOUBLE_STRING if quote == '"' else _JSON_SINGLE_STRING).match(self.text, self.pos)
+        if match is None:
+            raise ValueError(f"字符串未闭合（位置 {self.pos}）")
+        self.pos = match.end()
+        raw = match.group(1)
+        if '\\' not in raw and (quote == '"' or '"' not in raw):
+            return raw
+        if quote == "'":
+            raw = raw.replace("\\'", "'").replace('"', '\\"')
+        return _JSON_STRING_DECODER.decode(f'"{raw}"')
+
+    def _key(self):
+        if self.text[self.pos] in '"\'':
+            return self._string()
+        match = _JSON_BARE_WORD.match(self.text, self.pos)
+        if match is None:
+            raise ValueError(f"无法识别的键（位置 {self.pos}）")
+        self.pos = match.end()
+        return match.group()
+
+    def _object(self):
+        self.pos += 1
+        result = {}
+        while True:
+            self._skip()
+            if self.pos >= len(self.text):
+                raise ValueError("对象未闭合")
+            if self.text[self.pos] == '}':
+                self.pos += 1
+                return result
+            key = self._key()
+            self._skip()
+            if self.text[self.pos:self.pos + 1] != ':':
+                raise ValueError(f"键 {key} 后缺少冒号（位置 {self.pos}）")
+            self.pos += 1
+            result[key] = self.value()
+
+    def _array(self):
+        self.pos += 1
+        result = []
+        while True:
+            self._skip()
+            if self.pos >= len(self.text):
+                raise ValueError("数组未闭合")
+            if self.text[self.pos] == ']':
+                self.pos += 1
+                return result
+            result.append(self.value())
+
+    def value(self):
+        self.pos = _JSON_SPACES.match(self.text, self.pos).end()
+        if self.pos >= len(self.text):
+            raise ValueError("缺少取值")
+        ch = self.text[self.pos]
+        if ch == '{':
+            return self._object()
+        if ch == '[':
+            return self._array()
+        if ch in '"\'':
+            return self._string()
+        match = _JSON_NUMBER.match(self.text, self.pos)
+        if match is not None:
+            end = match.end()
+            if end >= len(self.text) or self.text[end] in ' \t\r\n,}]':
+                self.pos = end
+                number = match.group()
+                return float(number) if any(c in number for c in '.eE') else int(number)
+        match = _JSON_BARE_VALUE.match(self.text, self.pos)
+        if match is None:
+            raise ValueError(f"缺少取值（位置 {self.pos}）")
+        self.pos = match.end()
+        word = match.group().strip()
+        return _JSON_LITERALS.get(word, word)
+
+
+def extract_json_object(text):
+    """从LLM回复中找到最外层JSON对象并容错解析（代码块标记、前后说明文字都会被跳过），失败时返回None"""
+    start = text.find('{') if text else -1
+    if start == -1:
+        return None
+    scanner = TolerantJSONScanner(text)
+    scanner.pos = start
     try:
-        return json.loads(json_str)
-    except json.JSONDecodeError:
+        return scanner.value()
+    except (ValueError, IndexError) as e:
+        print(f"JSON解析失败，原始内容: {text}")
+        print(f"错误详情: {e}")
+        return None
+
+
+def safe_json_parse(json_str):
+    """安全解析JSON：标准JSON直接json.loads，否则单遍容错扫描（不做全局替换，不会破坏字符串中的冒号和引号）"""
+    start = json_str.find('{')
+    end = json_str.rfind('}') + 1
+    if start != -1 and end > start:
         try:
-            # 修复常见的JSON格式问题
-            json_str = json_str.replace("'", '"')
-            json_str = re.sub(r'(\w+):', r'"\1":', json_str)
-            json_str = re.sub(r',\s*}', '}', json_str)
-            json_str = re.sub(r',\s*]', ']', json_str)
-            return json.loads(json_str)
-        except json.JSONDecodeError as e:
-            print(f"JSON解析失败，原始内容: {json_str}")
-            print(f"错误详情: {e}")
-            return None
+            return json.loads(json_str[start:end])
+        except json.JSONDecodeError:
+            pass
+    return extract_json_object(json_str)
 
 
 def create_fallback_signal(price_data):
@@ -715,6 +2783,50 @@ def create_fallback_signal(price_data):
     }
 
 
+def create_rule_based_signal(price_data):
+    """规则信号（DeepSeek超时或不可用时的确定性备用）：与回测默认信号源一致，强势上涨做多、强势下跌做空，
+    MACD同向为HIGH、否则MEDIUM，追高/杀跌到RSI极端区降为LOW；止损取2.5倍ATR（限制在0.5%-3%），止盈按动态风险收益比"""
+    if not price_data or not isinstance(price_data, dict) or not price_data.get('price'):
+        return create_fallback_signal(price_data)
+
+    price = price_data['price']
+    technical = price_data.get('technical_data') or {}
+    trend = price_data.get('trend_analysis') or {}
+    overall = trend.get('overall', '震荡整理')
+    macd_bullish = trend.get('macd') == 'bullish'
+    rsi = technical.get('rsi', 50)
+
+    if overall == '强势上涨':
+        signal, agrees = 'BUY', macd_bullish
+    elif overall == '强势下跌':
+        signal, agrees = 'SELL', not macd_bullish
+    else:
+        signal, agrees = 'HOLD', False
+
+    if signal == 'HOLD' or (signal == 'BUY' and rsi > 75) or (signal == 'SELL' and rsi < 25):
+        confidence = 'LOW'
+    else:
+        confidence = 'HIGH' if agrees else 'MEDIUM'
+
+    atr = technical.get('atr_20', 0)
+    stop_ratio = max(0.005, min(0.03, atr * 2.5 / price)) if atr > 0 else 0.015
+    take_ratio = stop_ratio * calculate_dynamic_risk_reward_ratio(price_data)
+    if signal == 'SELL':
+        stop_loss, take_profit = price * (1 + stop_ratio), price * (1 - take_ratio)
+    else:
+        stop_loss, take_profit = price * (1 - stop_ratio), price * (1 + take_ratio)
+
+    return {
+        "signal": signal,
+        "reason": f"规则信号：趋势{overall}，MACD{'多头' if macd_bullish else '空头'}，RSI {rsi:.1f}",
+        "stop_loss": stop_loss,
+        "take_profit": take_profit,
+        "confidence": confidence,
+        "is_fallback": True,
+        "source": "rule"
+    }
+
+
 def safe_get_value(data, key, default=None):
     """安全获取字典值，防止NoneType错误"""
     try:
@@ -792,11 +2904,11 @@ def calculate_dynamic_risk_reward_ratio(price_data):
     trend = price_data.get('trend_analysis', {}).get('overall', '')
     
     if trend == '强势上涨':
-        return 5  # 1:5
+        return config.get('trend_bullish', 5)  # 1:5
     elif trend == '强势下跌':
-        return 5  # 1:5
+        return config.get('trend_bearish', 5)  # 1:5
     elif trend == '震荡整理':
-        return 1.5  # 1:1.5
+        return config.get('trend_consolidation', 1.5)  # 1:1.5
     else:
         return config.get('default', 3)  # 默认1:3
 
@@ -894,8 +3006,9 @@ def update_trailing_stop(current_position, price_data):
     current_sl = position_management.get('current_stop_loss')
     initial_sl = position_management.get('initial_stop_loss', current_sl)
     
-    # 计算新的止损价格
+    # 计算新的止损价格（仅在止损实际上移时输出日志，盘中风控高频检查时不重复刷屏）
     new_stop_loss = None
+    message = ''
     
     # 浮盈20%时，锁定10%利润
     if unrealized_pnl_pct >= config.get('lock_profit_2_threshold', 0.20):
@@ -904,7 +3017,7 @@ def update_trailing_stop(current_position, price_data):
             new_stop_loss = entry_price * (1 + lock_level)
         else:
             new_stop_loss = entry_price * (1 - lock_level)
-        print(f"📈 浮盈{unrealized_pnl_pct*100:.1f}%，移动止损到锁定{lock_level*100:.1f}%利润: {new_stop_loss:.2f}")
+        message = f"📈 浮盈{unrealized_pnl_pct*100:.1f}%，移动止损到锁定{lock_level*100:.1f}%利润: {new_stop_loss:.2f}"
     
     # 浮盈10%时，锁定3%利润
     elif unrealized_pnl_pct >= config.get('lock_profit_1_threshold', 0.10):
@@ -913,12 +3026,12 @@ def update_trailing_stop(current_position, price_data):
             new_stop_loss = entry_price * (1 + lock_level)
         else:
             new_stop_loss = entry_price * (1 - lock_level)
-        print(f"📈 浮盈{unrealized_pnl_pct*100:.1f}%，移动止损到锁定{lock_level*100:.1f}%利润: {new_stop_loss:.2f}")
+        message = f"📈 浮盈{unrealized_pnl_pct*100:.1f}%，移动止损到锁定{lock_level*100:.1f}%利润: {new_stop_loss:.2f}"
     
     # 浮盈5%时，止损移到成本价（保本）
     elif unrealized_pnl_pct >= config.get('breakeven_threshold', 0.05):
         new_stop_loss = entry_price
-        print(f"📈 浮盈{unrealized_pnl_pct*100:.1f}%，移动止损到成本价保本: {new_stop_loss:.2f}")
+        message = f"📈 浮盈{unrealized_pnl_pct*100:.1f}%，移动止损到成本价保本: {new_stop_loss:.2f}"
     
     # 如果计算出了新止损，且比当前止损更优，则更新
     if new_stop_loss:
@@ -926,10 +3039,12 @@ def update_trailing_stop(current_position, price_data):
         if side == 'long':
             if current_sl is None or new_stop_loss > current_sl:
                 position_management['current_stop_loss'] = new_stop_loss
+                print(message)
                 return new_stop_loss
         else:  # short
             if current_sl is None or new_stop_loss < current_sl:
                 position_management['current_stop_loss'] = new_stop_loss
+                print(message)
                 return new_stop_loss
     
     return None
@@ -1037,6 +3152,7 @@ def execute_partial_take_profit(current_position, price_data, initial_stop_loss)
                     }
                 )
                 position_management['partial_tp_executed']['tp1'] = True
+                account_snapshot.invalidate()
             except Exception as e:
                 print(f"⚠️ 分批止盈TP1执行失败: {e}")
         
@@ -1053,6 +3169,7 @@ def execute_partial_take_profit(current_position, price_data, initial_stop_loss)
                     }
                 )
                 position_management['partial_tp_executed']['tp1'] = True
+                account_snapshot.invalidate()
             except Exception as e:
                 print(f"⚠️ 分批止盈TP1执行失败: {e}")
     
@@ -1075,6 +3192,7 @@ def execute_partial_take_profit(current_position, price_data, initial_stop_loss)
                     }
                 )
                 position_management['partial_tp_executed']['tp2'] = True
+                account_snapshot.invalidate()
             except Exception as e:
                 print(f"⚠️ 分批止盈TP2执行失败: {e}")
         
@@ -1091,76 +3209,420 @@ def execute_partial_take_profit(current_position, price_data, initial_stop_loss)
                     }
                 )
                 position_management['partial_tp_executed']['tp2'] = True
+                account_snapshot.invalidate()
             except Exception as e:
                 print(f"⚠️ 分批止盈TP2执行失败: {e}")
 
 
-def analyze_with_deepseek(price_data):
-    """使用DeepSeek分析市场并生成交易信号（增强版）"""
+def apply_trailing_stop(current_position, price_data):
+    """计算移动止损并同步到交易所止损委托（原地修改触发价，失败时原子替换）；
+    交易所未更新成功时恢复原止损价，下次检查会重新尝试。返回生效的新止损价或None"""
+    previous_sl = position_management.get('current_stop_loss')
+    new_sl = update_trailing_stop(current_position, price_data)
+    if not new_sl:
+        return None
+    print(f"🔄 移动止损更新到: {new_sl:.2f}")
+    if not stop_orders.move_stop(new_sl, current_position):
+        position_management['current_stop_loss'] = previous_sl
+        print(f"⚠️ 交易所止损未更新，保持原止损 {previous_sl}，下次检查重试")
+        return None
+    return new_sl
 
-    # 🔴 修复：添加空值检查
-    if not price_data or not isinstance(price_data, dict):
-        print("❌ price_data 为空或无效，使用备用信号")
-        return create_fallback_signal({'price': 0})
 
-    print("🤖 开始调用DeepSeek API分析市场...")
-    
-    # 生成技术分析文本
-    technical_analysis = generate_technical_analysis_text(price_data)
+def manage_position_risk(current_position, price_data):
+    """持仓风控：移动止损与分批止盈（决策周期与盘中风控线程共用，持有position_lock执行）"""
+    with position_lock:
+        # 检查移动止损
+        apply_trailing_stop(current_position, price_data)
 
-    # 构建K线数据文本
-    kline_text = f"【最近5根{TRADE_CONFIG['timeframe']}K线数据】\n"
-    
-    # 🔴 修复：检查 kline_data 是否存在且不为空
-    if 'kline_data' in price_data and price_data['kline_data'] is not None:
-        kline_data = price_data['kline_data']
-        if isinstance(kline_data, list) and len(kline_data) > 0:
-            for i, kline in enumerate(kline_data[-5:]):
-                if isinstance(kline, dict) and 'close' in kline and 'open' in kline:
-                    trend = "阳线" if kline['close'] > kline['open'] else "阴线"
-                    change = ((kline['close'] - kline['open']) / kline['open']) * 100
-                    kline_text += f"K线{i + 1}: {trend} 开盘:{kline['open']:.2f} 收盘:{kline['close']:.2f} 涨跌:{change:+.2f}%\n"
-                else:
-                    kline_text += f"K线{i + 1}: 数据格式错误\n"
-        else:
-            kline_text += "K线数据为空\n"
+        # 检查分批止盈
+        initial_sl = position_management.get('initial_stop_loss')
+        if initial_sl:
+            executed = dict(position_management['partial_tp_executed'])
+            execute_partial_take_profit(current_position, price_data, initial_sl)
+            return executed != position_management['partial_tp_executed']
+        return False
+
+
+class RiskMonitor:
+    """盘中风控线程：两次决策周期之间每poll_interval秒按实时价格执行移动止损与分批止盈，
+    TP1或移动止损在K线中途触发时不必等到下一个15分钟周期。
+    只执行持仓管理规则；决策周期持有position_lock时本轮直接跳过，不与主流程争抢。
+    价格与持仓经异步交易所适配器读取，不占用主流程的同步exchange"""
+
+    # 交易所端止盈止损委托触发（algo委托生效）或订单成交后，持仓已变化
+    POSITION_EVENTS = {'orders-algo': {'effective', 'partially_effective', 'filled'}, 'orders': {'filled'}}
+
+    def __init__(self, config=None):
+        self.config = config if config is not None else TRADE_CONFIG.get('risk_monitor', {})
+        self._stop = threading.Event()
+        self._thread = None
+        self._position = None
+        self._position_time = 0.0
+        self.checks = 0
+
+    def start(self):
+        self._stop.clear()
+        order_events.add_listener(self._on_order_event)
+        self._thread = threading.Thread(target=self._run, name='risk-monitor', daemon=True)
+        self._thread.start()
+        print(f"🛡️ 盘中风控已启动，每 {self.config.get('poll_interval', 2.0)}s 检查一次")
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def refresh_position(self):
+        """下一轮检查重新拉取持仓"""
+        self._position_time = 0.0
+
+    def _on_order_event(self, channel, row):
+        if row.get('state') in self.POSITION_EVENTS.get(channel, ()):
+            self.refresh_position()
+
+    def _current_price(self):
+        if market_feed is not None:
+            price = market_feed.latest_price()
+            if price is not None:
+                return price
+        return async_exchange.submit('fetch_ticker', TRADE_CONFIG['symbol']).result()['last']
+
+    def _current_position(self):
+        # 没有私有订单推送时无法得知交易所端的止盈止损成交，每次检查都重新读取持仓
+        refresh = self.config.get('position_refresh', 30.0) if order_events._stream_connected() else 0.0
+        if time.time() - self._position_time >= refresh:
+            positions = async_exchange.submit('fetch_positions', [TRADE_CONFIG['symbol']]).result()
+            self._position = position_from_list(positions)
+            self._position_time = time.time()
+        return self._position
+
+    def check_once(self):
+        """执行一次检查；决策周期占用持仓锁时跳过，返回是否完成检查"""
+        if not position_lock.acquire(blocking=False):
+            return False
+        try:
+            current_position = self._current_position()
+            if not current_position:
+                return True
+            price = self._current_price()
+            if not price:
+                return True
+            if position_management.get('entry_price') is None:
+                position_management['entry_price'] = current_position.get('entry_price', price)
+            if manage_position_risk(current_position, {'price': price}):
+                self.refresh_position()  # 分批止盈后持仓数量已变化
+            self.checks += 1
+            return True
+        finally:
+            position_lock.release()
+
+    def _run(self):
+        while not self._stop.wait(self.config.get('poll_interval', 2.0)):
+            try:
+                self.check_once()
+            except Exception as e:
+                print(f"⚠️ 盘中风控检查失败: {e}")
+                self.refresh_position()
+
+
+risk_monitor = RiskMonitor()
+
+
+def start_risk_monitor():
+    """按配置启动盘中风控线程"""
+    if TRADE_CONFIG.get('risk_monitor', {}).get('enable_monitor', False) and risk_monitor._thread is None:
+        risk_monitor.start()
+    return risk_monitor
+
+
+def _round_significant(value, digits):
+    """按有效数字取整，用于生成稳定的行情指纹"""
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return None
+    if not math.isfinite(value) or value == 0:
+        return 0.0 if value == 0 else None
+    return round(value, digits - 1 - int(math.floor(math.log10(abs(value)))))
+
+
+def _round_step(value, step):
+    """按步长取整（非有限值返回None）"""
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return None
+    if not math.isfinite(value):
+        return None
+    return round(round(value / step) * step, 10) if step else value
+
+
+def market_state_fingerprint(price_data, current_pos):
+    """由提示词的关键输入（取整后的指标、趋势标签、持仓、上次信号）生成规范化行情指纹"""
+    config = TRADE_CONFIG.get('llm_cache', {}).get('fingerprint', {})
+    price_digits = config.get('price_digits', 4)
+    rsi_step = config.get('rsi_step', 1.0)
+    ratio_decimals = config.get('ratio_decimals', 2)
+
+    tech = price_data.get('technical_data') or {}
+    price_keys = ['sma_5', 'sma_20', 'sma_50', 'macd', 'macd_signal', 'macd_histogram',
+                  'bb_upper', 'bb_lower', 'atr_20']
+    state = {
+        'symbol': TRADE_CONFIG['symbol'],
+        'timeframe': TRADE_CONFIG['timeframe'],
+        'price': _round_significant(price_data.get('price'), price_digits),
+        'indicators': {key: _round_significant(tech.get(key), price_digits) for key in price_keys},
+        'rsi': _round_step(tech.get('rsi'), rsi_step),
+        'bb_position': _round_step(tech.get('bb_position'), 10 ** -ratio_decimals),
+        'volume_ratio': _round_step(tech.get('volume_ratio'), 10 ** -ratio_decimals),
+        'trend': {key: (price_data.get('trend_analysis') or {}).get(key)
+                  for key in ('short_term', 'medium_term', 'macd', 'overall')},
+        'position': [current_pos['side'], current_pos['size']] if current_pos else None,
+        'last_signal': ([signal_history[-1].get('signal'), signal_history[-1].get('confidence')]
+                        if signal_history and isinstance(signal_history[-1], dict) else None),
+    }
+    canonical = json.dumps(state, sort_keys=True, ensure_ascii=False, separators=(',', ':'), default=str)
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+class LLMResponseCache:
+    """DeepSeek信号缓存：内存LRU + TTL，写入时追加到磁盘JSONL，启动时加载未过期条目"""
+
+    def __init__(self, path=None, ttl_seconds=1800, max_entries=256):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.entries = OrderedDict()  # key -> (写入时间, 信号)
+        self.hits = 0
+        self.misses = 0
+        self._load()
+
+    def _load(self):
+        if not self.path or not os.path.exists(self.path):
+            return
+        lines = 0
+        with open(self.path, 'r', encoding='utf-8') as f:
+            for line in f:
+                lines += 1
+                try:
+                    record = json.loads(line)
+                    self._store(record['key'], record['created_at'], record['signal'])
+                except (ValueError, KeyError):
+                    continue  # 跳过写了一半的行
+        self._evict_expired()
+        # 文件中失效/被覆盖的记录过多时重写
+        if lines > 2 * max(len(self.entries), 1):
+            self._rewrite()
+
+    def _store(self, key, created_at, signal):
+        self.entries[key] = (created_at, signal)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def _evict_expired(self):
+        now = time.time()
+        for key in [key for key, (created_at, _) in self.entries.items() if now - created_at > self.ttl_seconds]:
+            del self.entries[key]
+
+    def _rewrite(self):
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            for key, (created_at, signal) in self.entries.items():
+                f.write(json.dumps({'key': key, 'created_at': created_at, 'signal': signal}, ensure_ascii=False) + '\n')
+        os.replace(tmp_path, self.path)
+
+    def get(self, key):
+        """命中且未过期时返回信号副本，否则返回None"""
+        entry = self.entries.get(key)
+        if entry is None or time.time() - entry[0] > self.ttl_seconds:
+            if entry is not None:
+                del self.entries[key]
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return dict(entry[1], cached=True)
+
+    def put(self, key, signal):
+        signal = {k: v for k, v in signal.items() if k not in ('timestamp', 'cached')}
+        created_at = time.time()
+        self._store(key, created_at, signal)
+        if self.path:
+            try:
+                os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+                with open(self.path, 'a', encoding='utf-8') as f:
+                    f.write(json.dumps({'key': key, 'created_at': created_at, 'signal': signal},
+                                       ensure_ascii=False, default=str) + '\n')
+            except OSError as e:
+                print(f"⚠️ 信号缓存写入磁盘失败: {e}")
+
+
+llm_cache = None
+
+
+def get_llm_cache():
+    """按配置返回全局信号缓存（未启用时返回None）"""
+    global llm_cache
+    config = TRADE_CONFIG.get('llm_cache', {})
+    if not config.get('enable_cache', False):
+        return None
+    if llm_cache is None:
+        llm_cache = LLMResponseCache(config.get('path'), config.get('ttl_seconds', 1800),
+                                     config.get('max_entries', 256))
+    return llm_cache
+
+
+class LLMReplayMiss(Exception):
+    """回放模式下找不到提示词对应的录制记录"""
+
+
+def replay_prompt_hash(price_data, current_pos):
+    """录制/回放用的提示词哈希：由规范化提示词计算——时间取最新K线时间而非当前时钟，持仓盈亏置0，
+    相同K线与持仓重新运行时得到相同哈希"""
+    kline_data = price_data.get('kline_data') or []
+    bar_time = kline_data[-1].get('timestamp') if kline_data and isinstance(kline_data[-1], dict) else None
+    canonical_data = dict(price_data, timestamp=str(bar_time))
+    canonical_pos = dict(current_pos, unrealized_pnl=0.0) if current_pos else None
+    if TRADE_CONFIG.get('llm_prompt', {}).get('mode', 'full') == 'compact':
+        messages = build_compact_deepseek_messages(canonical_data, canonical_pos)
     else:
-        kline_text += "K线数据不可用\n"
+        messages = build_deepseek_messages(canonical_data, canonical_pos)
+    return LLMReplayStore.prompt_hash(messages)
 
-    # 添加上次交易信号
-    signal_text = ""
-    if signal_history and len(signal_history) > 0:
-        last_signal = signal_history[-1]
-        if isinstance(last_signal, dict):
-            signal_text = f"\n【上次交易信号】\n信号: {last_signal.get('signal', 'N/A')}\n信心: {last_signal.get('confidence', 'N/A')}"
-        else:
-            signal_text = "\n【上次交易信号】\n数据格式错误"
 
-    # 添加当前持仓信息
-    current_pos = get_current_position()
-    position_text = "无持仓" if not current_pos else f"{current_pos['side']}仓, 数量: {current_pos['size']}, 盈亏: {current_pos['unrealized_pnl']:.2f}USDT"
+def last_closed_bar_ms(price_data, now_ms=None):
+    """price_data中最后一根已收盘K线的开盘时间（毫秒）；kline_data末尾可能是未收盘K线"""
+    kline_data = [bar for bar in price_data.get('kline_data') or [] if isinstance(bar, dict)]
+    if not kline_data:
+        return None
+    timeframe_ms = exchange.parse_timeframe(price_data.get('timeframe', TRADE_CONFIG['timeframe'])) * 1000
+    now_ms = int(time.time() * 1000) if now_ms is None else now_ms
+    opens = [int(pd.Timestamp(bar['timestamp']).value // 10 ** 6) for bar in kline_data]
+    closed = [bar_open for bar_open in opens if bar_open + timeframe_ms <= now_ms]
+    return closed[-1] if closed else None
+
+
+class LLMReplayStore:
+    """DeepSeek决策录制/回放存储：每条记录为 (提示词哈希, 已收盘K线时间, 提示词, 原始回复, 解析后的信号)，
+    以gzip成员逐条追加写入；回放时按提示词哈希（见replay_prompt_hash）在内存索引中查找"""
+
+    def __init__(self, path, mode='record'):
+        self.path = path
+        self.mode = mode
+        self.index = None  # 提示词哈希 -> 记录（回放时懒加载）
+        self.hits = 0
+        self.misses = []
+
+    @staticmethod
+    def prompt_hash(messages):
+        canonical = json.dumps(messages, sort_keys=True, ensure_ascii=False, separators=(',', ':'))
+        return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+    def records(self):
+        """按写入顺序遍历全部记录（末尾写了一半的记录会被忽略）"""
+        if not self.path or not os.path.exists(self.path):
+            return
+        with gzip.open(self.path, 'rt', encoding='utf-8') as f:
+            try:
+                for line in f:
+                    try:
+                        yield json.loads(line)
+                    except ValueError:
+                        continue
+            except (EOFError, gzip.BadGzipFile):
+                print(f"⚠️ 回放文件末尾不完整，已忽略: {self.path}")
+
+    def _load_index(self):
+        self.index = {}
+        for record in self.records():
+            self.index[record['hash']] = record
+
+    def record(self, messages, response, signal_data, price_data, key=None, bar=None):
+        """追加一条决策记录；bar为决策对应的已收盘K线（回测在该K线收盘处成交），默认取决策时最后一根已收盘K线"""
+        record = {
+            'hash': key or self.prompt_hash(messages),
+            'bar': last_closed_bar_ms(price_data) if bar is None else bar,
+            'recorded_at': time.time(),
+            'messages': messages,
+            'response': response,
+            'signal': {k: v for k, v in signal_data.items() if k not in ('timestamp', 'cached')},
+        }
+        try:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            with gzip.open(self.path, 'at', encoding='utf-8') as f:
+                f.write(json.dumps(record, ensure_ascii=False, separators=(',', ':'), default=str) + '\n')
+        except OSError as e:
+            print(f"⚠️ 决策录制写入失败: {e}")
+        if self.index is not None:
+            self.index[record['hash']] = record
+
+    def replay(self, messages, key=None):
+        """返回提示词对应的录制信号；找不到时记录并抛出LLMReplayMiss"""
+        if self.index is None:
+            self._load_index()
+        key = key or self.prompt_hash(messages)
+        record = self.index.get(key)
+        if record is None:
+            self.misses.append(key)
+            raise LLMReplayMiss(f"回放记录缺失: 提示词哈希 {key[:12]}（累计缺失 {len(self.misses)} 次）")
+        self.hits += 1
+        return dict(record['signal'], replayed=True)
+
+
+llm_replay_store = None
+
+
+def get_llm_replay_store():
+    """按配置返回全局录制/回放存储（关闭时返回None）"""
+    global llm_replay_store
+    config = TRADE_CONFIG.get('llm_replay', {})
+    mode = os.getenv('LLM_REPLAY_MODE') or config.get('mode', 'off')
+    if mode not in ('record', 'replay'):
+        return None
+    if llm_replay_store is None or llm_replay_store.mode != mode:
+        llm_replay_store = LLMReplayStore(config.get('path', 'data/llm_replay.jsonl.gz'), mode)
+    return llm_replay_store
 
-    prompt = f"""
-    你是一位拥有15年经验的顶级加密货币量化交易员，你拥有INTJ 人格特征，是天生的系统构建者和长期规划者。并专精于BTC/USDT合约交易,善于洞察市场潜在机会，更懂得提前预知黑天鹅事件，并有效控制风险，目的是让资产最大化。
 
-    【数据概览】
-    基于以下BTC/USDT {TRADE_CONFIG['timeframe']}周期数据进行分析：
+def llm_streaming_enabled():
+    return TRADE_CONFIG.get('llm_prompt', {}).get('streaming', False)
 
-    {kline_text}
 
-    {technical_analysis}
+# 固定的系统提示词与分析指令（不含任何行情/配置插值，作为可缓存的请求前缀）
+DEEPSEEK_SYSTEM_PROMPT = """您是一位拥有15年经验的顶级加密货币量化交易员，拥有INTJ人格特征，是天生的系统构建者和长期规划者。专注于K线周期趋势分析（周期见行情数据）。
+
+【核心能力】
+- 深度技术分析：能够从多个维度分析市场
+- 结构化思维：按照思维链逐步分析问题
+- 风险控制：始终将风险控制放在首位，但不过度保守而错失机会
+- 逻辑推理：基于数据做出理性决策
+- 机会捕捉：在风险可控的前提下，积极捕捉明确的趋势机会
+
+【分析要求】
+请严格按照思维链分析要求，逐步完成五个步骤的分析：
+1. 多空力量对比分析
+2. 关键指标状态评估  
+3. 市场结构分析
+4. 风险收益评估
+5. 综合决策
+
+【决策原则】
+- **趋势是王道**：明确的趋势信号优先于指标的细微偏差
+- **概率思维**：追求概率优势，而非绝对确定性
+- **风险可控**：每笔交易都有止损保护，不要因过度谨慎而错过明确的趋势机会
 
-    {signal_text}
+【输出标准】
+- reason字段必须包含完整的五步思维链分析
+- 每个步骤都要有具体的分析内容
+- 最终决策要有明确的逻辑依据
+- 严格遵循JSON格式要求
+- **重要**：当趋势明确时，即使个别指标有轻微偏差，也要给出明确的BUY/SELL信号，而不是HOLD"""
 
-    【当前行情】
-    - 当前价格: ${price_data['price']:,.2f}
-    - 时间: {price_data['timestamp']}
-    - 本K线最高: ${price_data['high']:,.2f}
-    - 本K线最低: ${price_data['low']:,.2f}
-    - 本K线成交量: {price_data['volume']:.2f} BTC
-    - 价格变化: {price_data['price_change']:+.2f}%
-    - 当前持仓: {position_text}
-    - 持仓盈亏: {(current_pos['unrealized_pnl'] if current_pos else 0):.2f} USDT
+DEEPSEEK_ANALYSIS_INSTRUCTIONS = """
+    你是一位拥有15年经验的顶级加密货币量化交易员，你拥有INTJ 人格特征，是天生的系统构建者和长期规划者。并专精于BTC/USDT合约交易,善于洞察市场潜在机会，更懂得提前预知黑天鹅事件，并有效控制风险，目的是让资产最大化。
 
     【思维链分析要求 - 请按以下步骤逐步分析】
 
@@ -1223,118 +3685,635 @@ def analyze_with_deepseek(price_data):
        - MEDIUM: 趋势明确 + 部分指标支持（即使某些指标有轻微偏差）
        - LOW: 趋势不明确或指标完全矛盾
 
-    【当前技术状况快速参考】
-    - 整体趋势: {price_data.get('trend_analysis', {}).get('overall', 'N/A') if price_data.get('trend_analysis') else 'N/A'}
-    - 短期趋势: {price_data.get('trend_analysis', {}).get('short_term', 'N/A') if price_data.get('trend_analysis') else 'N/A'} 
-    - RSI状态: {(price_data.get('technical_data', {}).get('rsi', 0) if price_data.get('technical_data') else 0):.1f} ({'超买' if (price_data.get('technical_data', {}).get('rsi', 0) if price_data.get('technical_data') else 0) > 70 else '超卖' if (price_data.get('technical_data', {}).get('rsi', 0) if price_data.get('technical_data') else 0) < 30 else '中性'})
-    - MACD方向: {price_data.get('trend_analysis', {}).get('macd', 'N/A') if price_data.get('trend_analysis') else 'N/A'}
+"""
 
-    【输出格式要求】
+DEEPSEEK_OUTPUT_FORMAT = """    【输出格式要求】
     请严格按照以下JSON格式回复，reason字段必须包含完整的思维链分析过程：
 
-    {{
+    {
         "signal": "BUY|SELL|HOLD",
         "reason": "【思维链分析】第一步：多空力量对比...第二步：关键指标状态...第三步：市场结构分析...第四步：风险收益评估...第五步：综合决策...",
         "stop_loss": 具体价格,
         "take_profit": 具体价格, 
         "confidence": "HIGH|MEDIUM|LOW"
-    }}
+    }
+"""
+
+# 流式模式的输出格式：决策字段在前、reason在最后，决策字段齐全即可提前执行
+DEEPSEEK_STREAMING_OUTPUT_FORMAT = """    【输出格式要求】
+    请严格按照以下JSON格式回复，字段顺序必须与示例一致（先给出决策字段，reason放在最后），reason字段必须包含完整的思维链分析过程：
+
+    {
+        "signal": "BUY|SELL|HOLD",
+        "confidence": "HIGH|MEDIUM|LOW",
+        "stop_loss": 具体价格,
+        "take_profit": 具体价格,
+        "reason": "【思维链分析】第一步：多空力量对比...第二步：关键指标状态...第三步：市场结构分析...第四步：风险收益评估...第五步：综合决策..."
+    }
+"""
+
+
+def build_deepseek_messages(price_data, current_pos):
+    """构建DeepSeek对话消息（系统提示词 + 行情分析提示词）"""
+    # 生成技术分析文本
+    technical_analysis = generate_technical_analysis_text(price_data)
+
+    # 构建K线数据文本
+    kline_text = f"【最近5根{TRADE_CONFIG['timeframe']}K线数据】\n"
+    
+    # 🔴 修复：检查 kline_data 是否存在且不为空
+    if 'kline_data' in price_data and price_data['kline_data'] is not None:
+        kline_data = price_data['kline_data']
+        if isinstance(kline_data, list) and len(kline_data) > 0:
+            for i, kline in enumerate(kline_data[-5:]):
+                if isinstance(kline, dict) and 'close' in kline and 'open' in kline:
+                    trend = "阳线" if kline['close'] > kline['open'] else "阴线"
+                    change = ((kline['close'] - kline['open']) / kline['open']) * 100
+                    kline_text += f"K线{i + 1}: {trend} 开盘:{kline['open']:.2f} 收盘:{kline['close']:.2f} 涨跌:{change:+.2f}%\n"
+                else:
+                    kline_text += f"K线{i + 1}: 数据格式错误\n"
+        else:
+            kline_text += "K线数据为空\n"
+    else:
+        kline_text += "K线数据不可用\n"
+
+    # 添加上次交易信号
+    signal_text = ""
+    if signal_history and len(signal_history) > 0:
+        last_signal = signal_history[-1]
+        if isinstance(last_signal, dict):
+            signal_text = f"\n【上次交易信号】\n信号: {last_signal.get('signal', 'N/A')}\n信心: {last_signal.get('confidence', 'N/A')}"
+        else:
+            signal_text = "\n【上次交易信号】\n数据格式错误"
+
+    # 添加当前持仓信息
+    position_text = "无持仓" if not current_pos else f"{current_pos['side']}仓, 数量: {current_pos['size']}, 盈亏: {current_pos['unrealized_pnl']:.2f}USDT"
+
+    output_format = DEEPSEEK_STREAMING_OUTPUT_FORMAT if llm_streaming_enabled() else DEEPSEEK_OUTPUT_FORMAT
+
+    # 易变的行情数据放在固定指令之后，使请求前缀保持字节级一致以命中DeepSeek上下文缓存
+    market_text = f"""
+    【数据概览】
+    基于以下BTC/USDT {TRADE_CONFIG['timeframe']}周期数据进行分析：
+
+    {kline_text}
+
+    {technical_analysis}
+
+    {signal_text}
+
+    【当前行情】
+    - 当前价格: ${price_data['price']:,.2f}
+    - 时间: {price_data['timestamp']}
+    - 本K线最高: ${price_data['high']:,.2f}
+    - 本K线最低: ${price_data['low']:,.2f}
+    - 本K线成交量: {price_data['volume']:.2f} BTC
+    - 价格变化: {price_data['price_change']:+.2f}%
+    - 当前持仓: {position_text}
+    - 持仓盈亏: {(current_pos['unrealized_pnl'] if current_pos else 0):.2f} USDT
+
+    【当前技术状况快速参考】
+    - 整体趋势: {price_data.get('trend_analysis', {}).get('overall', 'N/A') if price_data.get('trend_analysis') else 'N/A'}
+    - 短期趋势: {price_data.get('trend_analysis', {}).get('short_term', 'N/A') if price_data.get('trend_analysis') else 'N/A'} 
+    - RSI状态: {(price_data.get('technical_data', {}).get('rsi', 0) if price_data.get('technical_data') else 0):.1f} ({'超买' if (price_data.get('technical_data', {}).get('rsi', 0) if price_data.get('technical_data') else 0) > 70 else '超卖' if (price_data.get('technical_data', {}).get('rsi', 0) if price_data.get('technical_data') else 0) < 30 else '中性'})
+    - MACD方向: {price_data.get('trend_analysis', {}).get('macd', 'N/A') if price_data.get('trend_analysis') else 'N/A'}
+
     """
 
+    return [
+        {"role": "system", "content": DEEPSEEK_SYSTEM_PROMPT},
+        {"role": "user", "content": DEEPSEEK_ANALYSIS_INSTRUCTIONS + output_format + market_text}
+    ]
+
+
+# 紧凑模式的系统提示词：人设只出现一次，规则压缩为要点，不含缩进与表情
+COMPACT_SYSTEM_PROMPT = (
+    "你是15年经验的加密货币量化交易员（INTJ），做BTC/USDT永续合约趋势交易，风险可控前提下追求收益最大化。\n"
+    "规则：\n"
+    "1.趋势优先：短期与中期趋势同向（强势上涨/下跌）时必须给BUY/SELL，不因RSI、MACD轻微偏差选HOLD；"
+    "HOLD仅用于趋势矛盾或价格在20周期高低点间窄幅震荡（<2%）且多空平衡。\n"
+    "2.强势上涨且RSI 30-75→BUY(HIGH/MEDIUM)；RSI>75→BUY(MEDIUM)；强势下跌且RSI 25-70→SELL(HIGH/MEDIUM)；RSI<25→SELL(MEDIUM)。\n"
+    "3.权重：均线趋势>支撑阻力突破>RSI>MACD>布林带；突破关键支撑/阻力为强信号；BTC上涨趋势中可更积极做多。\n"
+    "4.防频繁交易：不因单根K线改变趋势判断；除非2-3个指标同时确认反转，否则保持现有持仓方向。\n"
+    "5.信心：HIGH=趋势明确+多指标共振+量价配合；MEDIUM=趋势明确+部分指标支持；LOW=趋势不明或指标矛盾。\n"
+    "按多空力量→指标状态→市场结构→风险收益→综合决策五步简要分析，写入reason。\n"
+    "输入为JSON：bars列为o,h,l,c,v（旧→新）；ind为指标；trend/levels为趋势与支撑阻力；pos为持仓；last为上次信号。\n"
+)
+COMPACT_OUTPUT_FORMAT = '只输出JSON：{"signal":"BUY|SELL|HOLD","reason":"...","stop_loss":价格,"take_profit":价格,"confidence":"HIGH|MEDIUM|LOW"}'
+COMPACT_STREAMING_OUTPUT_FORMAT = ('只输出JSON，字段按此顺序（reason放最后）：'
+                                   '{"signal":"BUY|SELL|HOLD","confidence":"HIGH|MEDIUM|LOW","stop_loss":价格,"take_profit":价格,"reason":"..."}')
+
+
+def estimate_tokens(text):
+    """按DeepSeek官方换算估算token数：1个中文字符约0.6 token，1个英文字符约0.3 token"""
+    cjk = sum(1 for ch in text if ord(ch) > 0x2E80)
+    return int(cjk * 0.6 + (len(text) - cjk) * 0.3) + 1
+
+
+def estimate_message_tokens(messages):
+    return sum(estimate_tokens(message['content']) for message in messages)
+
+
+def build_compact_deepseek_messages(price_data, current_pos):
+    """构建紧凑提示词：去重人设、去掉空白，行情以紧凑JSON发送（最近K根K线 + 指标取值）"""
+    config = TRADE_CONFIG.get('llm_prompt', {})
+    tech = price_data.get('technical_data') or {}
+    trend = price_data.get('trend_analysis') or {}
+    levels = price_data.get('levels_analysis') or {}
+
+    def number(value, digits=2):
+        try:
+            value = float(value)
+        except (TypeError, ValueError):
+            return None
+        return round(value, digits) if math.isfinite(value) else None
+
+    bars = [
+        [number(k.get('open')), number(k.get('high')), number(k.get('low')), number(k.get('close')), number(k.get('volume'))]
+        for k in (price_data.get('kline_data') or [])[-config.get('compact_bars', 10):]
+        if isinstance(k, dict)
+    ]
+    last_signal = signal_history[-1] if signal_history and isinstance(signal_history[-1], dict) else None
+    state = {
+        'symbol': TRADE_CONFIG['symbol'],
+        'tf': TRADE_CONFIG['timeframe'],
+        'time': price_data.get('timestamp'),
+        'price': number(price_data.get('price')),
+        'chg_pct': number(price_data.get('price_change'), 3),
+        'bars': bars,
+        'ind': {
+            'sma5': number(tech.get('sma_5')), 'sma20': number(tech.get('sma_20')), 'sma50': number(tech.get('sma_50')),
+            'rsi': number(tech.get('rsi'), 1), 'macd': number(tech.get('macd'), 4),
+            'macd_sig': number(tech.get('macd_signal'), 4), 'macd_hist': number(tech.get('macd_histogram'), 4),
+            'bb_up': number(tech.get('bb_upper')), 'bb_low': number(tech.get('bb_lower')),
+            'bb_pos': number(tech.get('bb_position'), 3), 'atr': number(tech.get('atr_20')),
+            'vol_ratio': number(tech.get('volume_ratio'), 2),
+        },
+        'trend': {'short': trend.get('short_term'), 'medium': trend.get('medium_term'),
+                  'overall': trend.get('overall'), 'macd': trend.get('macd')},
+        'levels': {'res': number(levels.get('static_resistance')), 'sup': number(levels.get('static_support'))},
+        'pos': ({'side': current_pos['side'], 'size': current_pos['size'],
+                 'pnl': number(current_pos.get('unrealized_pnl'))} if current_pos else None),
+        'last': ({'signal': last_signal.get('signal'), 'confidence': last_signal.get('confidence')}
+                 if last_signal else None),
+    }
+    return [
+        {"role": "system", "content": COMPACT_SYSTEM_PROMPT + (
+            COMPACT_STREAMING_OUTPUT_FORMAT if llm_streaming_enabled() else COMPACT_OUTPUT_FORMAT)},
+        {"role": "user", "content": json.dumps(state, ensure_ascii=False, separators=(',', ':'))},
+    ]
+
+
+def build_prompt_messages(price_data, current_pos):
+    """按TRADE_CONFIG['llm_prompt']['mode']构建提示词消息"""
+    config = TRADE_CONFIG.get('llm_prompt', {})
+    if config.get('mode', 'full') != 'compact':
+        return build_deepseek_messages(price_data, current_pos)
+
+    messages = build_compact_deepseek_messages(price_data, current_pos)
+    if config.get('report_tokens', True):
+        full_tokens = estimate_message_tokens(build_deepseek_messages(price_data, current_pos))
+        compact_tokens = estimate_message_tokens(messages)
+        print(f"📝 紧凑提示词: 约 {compact_tokens} tokens（完整提示词约 {full_tokens} tokens，"
+              f"减少 {(1 - compact_tokens / max(full_tokens, 1)) * 100:.0f}%）")
+    return messages
+
+
+# DeepSeek token用量累计（含上下文缓存命中/未命中的输入token）
+llm_usage_stats = {
+    'calls': 0,
+    'prompt_tokens': 0,
+    'completion_tokens': 0,
+    'cache_hit_tokens': 0,
+    'cache_miss_tokens': 0,
+}
+llm_usage_lock = threading.Lock()
+
+
+def record_llm_usage(usage):
+    """累计并打印一次调用的token用量与上下文缓存命中率（集成投票时由多个线程并发调用，加锁累计）"""
+    if usage is None or getattr(usage, 'prompt_tokens', None) is None:
+        return
+    hit = getattr(usage, 'prompt_cache_hit_tokens', None) or 0
+    miss = getattr(usage, 'prompt_cache_miss_tokens', None)
+    miss = usage.prompt_tokens - hit if miss is None else miss
+    with llm_usage_lock:
+        llm_usage_stats['calls'] += 1
+        llm_usage_stats['prompt_tokens'] += usage.prompt_tokens
+        llm_usage_stats['completion_tokens'] += getattr(usage, 'completion_tokens', 0) or 0
+        llm_usage_stats['cache_hit_tokens'] += hit
+        llm_usage_stats['cache_miss_tokens'] += miss
+        total_hit = llm_usage_stats['cache_hit_tokens']
+        total_cached = total_hit + llm_usage_stats['cache_miss_tokens']
+        calls = llm_usage_stats['calls']
+
+    print(f"📝 token用量: 输入 {usage.prompt_tokens}（缓存命中 {hit} / 未命中 {miss}，"
+          f"命中率 {hit / max(hit + miss, 1) * 100:.0f}%）, 输出 {getattr(usage, 'completion_tokens', 0)}; "
+          f"累计命中率 {total_hit / max(total_cached, 1) * 100:.0f}%"
+          f"（{calls} 次调用）")
+
+
+def request_deepseek_completion(messages, timeout=None, temperature=0.3):
+    """调用DeepSeek接口，返回回复文本（响应为空时返回None）；timeout为本次请求的超时秒数"""
+    options = {'timeout': timeout} if timeout is not None else {}
+    response = deepseek_client.chat.completions.create(
+        model="deepseek-chat",
+        messages=messages,
+        stream=False,
+        temperature=temperature,  # 默认0.3（从0.1提高），平衡保守和灵活性，让AI在趋势明确时更积极
+        **options
+    )
+
+    record_llm_usage(getattr(response, 'usage', None))
+
+    # 安全解析JSON
+    if not response or not hasattr(response, 'choices') or not response.choices or len(response.choices) == 0:
+        print("❌ DeepSeek API 响应为空或格式错误")
+        return None
+
+    if not hasattr(response.choices[0], 'message') or not response.choices[0].message:
+        print("❌ DeepSeek API 响应消息为空")
+        return None
+
+    result = response.choices[0].message.content
+    if not result:
+        print("❌ DeepSeek API 响应内容为空")
+        return None
+    return result
+
+
+class StreamingSignalParser:
+    """增量解析流式回复中的顶层JSON对象：逐字符推进状态机，已完成的字段立即可用，不重复扫描已处理的文本"""
+
+    DECISION_FIELDS = ('signal', 'confidence', 'stop_loss', 'take_profit')
+
+    def __init__(self):
+        self.text = ''
+        self.fields = {}
+        self.partial_key = None    # 正在接收的字符串字段名
+        self._pos = 0
+        self._state = 'seek_object'
+        self._token = []
+        self._key = None
+        self._escaped = False
+        self._nesting = 0
+        self._nested_string = False  # 嵌套值内部的字符串中（其中的括号不计层级）
+
+    def feed(self, chunk):
+        self.text += chunk
+        text = self.text
+        while self._pos < len(text):
+            ch = text[self._pos]
+            self._pos += 1
+            state = self._state
+            if state == 'seek_object':
+                if ch == '{':
+                    self._state = 'seek_key'
+            elif state == 'seek_key':
+                if ch == '"':
+                    self._state, self._token = 'in_key', []
+                elif ch == '}':
+                    self._state = 'done'
+            elif state == 'in_key':
+                if ch == '"' and not self._escaped:
+                    self._key = ''.join(self._token)
+                    self._state = 'seek_colon'
+                else:
+                    self._escaped = ch == '\\' and not self._escaped
+                    self._token.append(ch)
+            elif state == 'seek_colon':
+                if ch == ':':
+                    self._state = 'seek_value'
+            elif state == 'seek_value':
+                if ch == '"':
+                    self._state, self._token, self._escaped = 'in_string', [], False
+                    self.partial_key = self._key
+                elif ch in '{[':
+                    self._state, self._nesting, self._token = 'in_nested', 1, [ch]
+                    self._nested_string = self._escaped = False
+                elif not ch.isspace():
+                    self._state, self._token = 'in_bare', [ch]
+            elif state == 'in_string':
+                if ch == '"' and not self._escaped:
+                    raw = ''.join(self._token)
+                    try:
+                        self.fields[self._key] = json.loads(f'"{raw}"')
+                    except ValueError:
+                        self.fields[self._key] = raw
+                    self.partial_key = None
+                    self._state = 'seek_key'
+                else:
+                    self._escaped = ch == '\\' and not self._escaped
+                    self._token.append(ch)
+            elif state == 'in_bare':
+                if ch in ',}\n':
+                    raw = ''.join(self._token).strip()
+                    try:
+                        self.fields[self._key] = json.loads(raw)
+                    except ValueError:
+                        self.fields[self._key] = raw
+                    self._state = 'done' if ch == '}' else 'seek_key'
+                else:
+                    self._token.append(ch)
+            elif state == 'in_nested':
+                self._token.append(ch)
+                if self._nested_string:
+                    if ch == '"' and not self._escaped:
+                        self._nested_string = False
+                    self._escaped = ch == '\\' and not self._escaped
+                elif ch == '"':
+                    self._nested_string = True
+                elif ch in '{[':
+                    self._nesting += 1
+                elif ch in '}]':
+                    self._nesting -= 1
+                    if self._nesting == 0:
+                        try:
+                            self.fields[self._key] = json.loads(''.join(self._token))
+                        except ValueError:
+                            pass
+                        self._state = 'seek_key'
+            else:
+                break
+
+    def decision_ready(self):
+        return all(field in self.fields for field in self.DECISION_FIELDS)
+
+    def partial_reason(self):
+        if 'reason' in self.fields:
+            return self.fields['reason']
+        return ''.join(self._token) if self.partial_key == 'reason' else ''
+
+
+def stream_deepseek_signal(messages, price_data, on_complete=None, timeout=None):
+    """流式调用DeepSeek：signal/confidence/stop_loss/take_profit齐全即返回信号，不等待完整的reason；
+    剩余回复由后台线程接收，结束后以补全reason的新信号字典回调on_complete(完整回复, 信号)。回复为空时返回None"""
+    started = time.perf_counter()
+    options = {'timeout': timeout} if timeout is not None else {}
+    stream = deepseek_client.chat.completions.create(
+        model="deepseek-chat",
+        messages=messages,
+        stream=True,
+        stream_options={'include_usage': True},
+        temperature=0.3,
+        **options
+    )
+    chunks = iter(stream)
+    parser = StreamingSignalParser()
+
+    def consume(chunk):
+        if getattr(chunk, 'usage', None) is not None:
+            record_llm_usage(chunk.usage)
+        if chunk.choices and chunk.choices[0].delta and chunk.choices[0].delta.content:
+            parser.feed(chunk.choices[0].delta.content)
+
+    for chunk in chunks:
+        consume(chunk)
+        if parser.decision_ready():
+            break
+    else:
+        # 回复结束仍未提前拿到决策字段（如字段顺序不符），按完整回复解析
+        if not parser.text:
+            print("❌ DeepSeek API 流式响应内容为空")
+            return None
+        print(f"DeepSeek原始回复: {parser.text}")
+        signal_data = parse_deepseek_signal(parser.text, price_data)
+        if on_complete:
+            on_complete(parser.text, signal_data)
+        return signal_data
+
+    signal_data = {field: parser.fields[field] for field in StreamingSignalParser.DECISION_FIELDS}
+    signal_data['reason'] = parser.partial_reason() or '（流式接收中）'
+    print(f"⚡ 流式提前获得决策: {signal_data['signal']}/{signal_data['confidence']}，"
+          f"耗时 {time.perf_counter() - started:.2f}s（reason后台接收）")
+
+    def drain():
+        try:
+            for rest in chunks:
+                consume(rest)
+        except Exception as e:
+            print(f"⚠️ 流式回复后续接收失败: {e}")
+        # 已返回的信号可能已写入信号历史，补全reason时使用新的字典，不修改调用方持有的对象
+        reason = parser.fields.get('reason') or parser.partial_reason()
+        completed = dict(signal_data, reason=reason) if reason else dict(signal_data)
+        print(f"DeepSeek完整回复（{time.perf_counter() - started:.2f}s）: {parser.text}")
+        if on_complete:
+            on_complete(parser.text, completed)
+
+    threading.Thread(target=drain, name='deepseek-stream', daemon=True).start()
+    return signal_data
+
+
+def confidence_from_agreement(agreement):
+    """由集成投票一致率得到信心等级"""
+    config = TRADE_CONFIG.get('llm_ensemble', {})
+    if agreement >= config.get('high_agreement', 0.8):
+        return 'HIGH'
+    if agreement >= config.get('medium_agreement', 0.6):
+        return 'MEDIUM'
+    return 'LOW'
+
+
+def _median_price(samples, key):
+    values = []
+    for sample in samples:
+        try:
+            values.append(float(sample[key]))
+        except (TypeError, ValueError, KeyError):
+            continue
+    return float(np.median(values)) if values else None
+
+
+def request_deepseek_ensemble(messages, price_data, timeout=None):
+    """集成投票：并发发出samples个请求，某个信号获得quorum票后最多再等grade_wait_seconds收集其余回复，
+    不等待全部请求。止盈止损取同票样本的中位数，信心由一致率（同票数/已收到的有效回复数）决定；
+    所有请求结束仍未达到quorum时返回低信心HOLD，全部请求失败时返回None。返回 (信号, 已收到的原始回复列表)"""
+    config = TRADE_CONFIG.get('llm_ensemble', {})
+    samples = max(1, config.get('samples', 5))
+    quorum = min(samples, max(1, config.get('quorum', 3)))
+    temperature = config.get('temperature', 0.7)
+    grade_wait = config.get('grade_wait_seconds', 1.0)
+    started = time.perf_counter()
+    deadline = started + timeout if timeout is not None else None
+
+    votes = {}
+    replies = []
+    executor = ThreadPoolExecutor(max_workers=samples, thread_name_prefix='deepseek-vote')
+    pending = {executor.submit(request_deepseek_completion, messages, timeout, temperature) for _ in range(samples)}
+    grade_until = None  # 达到quorum后收集其余回复的截止时间
     try:
-        response = deepseek_client.chat.completions.create(
-            model="deepseek-chat",
-            messages=[
-                {"role": "system",
-                 "content": f"""您是一位拥有15年经验的顶级加密货币量化交易员，拥有INTJ人格特征，是天生的系统构建者和长期规划者。专注于{TRADE_CONFIG['timeframe']}周期趋势分析。
+        while pending:
+            wait_seconds = None if grade_until is None else max(grade_until - time.perf_counter(), 0)
+            done, pending = wait(pending, timeout=wait_seconds, return_when=FIRST_COMPLETED)
+            if not done:
+                break
+            for future in done:
+                try:
+                    result = future.result()
+                except Exception as e:
+                    print(f"⚠️ 集成投票请求失败: {e}")
+                    continue
+                if not result:
+                    continue
+                replies.append(result)
+                sample = parse_deepseek_signal(result, price_data)
+                if sample.get('is_fallback', False):
+                    continue
+                agreeing = votes.setdefault(sample['signal'], [])
+                agreeing.append(sample)
+                if grade_until is None and len(agreeing) >= quorum:
+                    grade_until = time.perf_counter() + grade_wait
+                    if deadline is not None:
+                        grade_until = min(grade_until, deadline)
+    finally:
+        # 达到quorum后不再等待其余请求（已发出的请求在后台自然结束）
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    tally = {signal: len(agreeing) for signal, agreeing in votes.items()}
+    valid = sum(tally.values())
+    print(f"🗳️ 集成投票: {tally}（{len(replies)}/{samples} 个回复，quorum={quorum}，"
+          f"耗时 {time.perf_counter() - started:.2f}s）")
+    if not votes:
+        return None, replies
+
+    winner, agreeing = max(votes.items(), key=lambda item: len(item[1]))
+    if len(agreeing) < quorum:
+        signal_data = create_fallback_signal(price_data)
+        signal_data.pop('is_fallback')
+        signal_data['reason'] = f"集成投票未达成一致（{tally}），保持观望"
+        signal_data['ensemble'] = {'votes': tally, 'samples': samples, 'agreement': len(agreeing) / valid}
+        return signal_data, replies
+
+    agreement = len(agreeing) / valid
+    current_price = price_data.get('price', 0)
+    stop_loss = _median_price(agreeing, 'stop_loss')
+    take_profit = _median_price(agreeing, 'take_profit')
+    signal_data = {
+        'signal': winner,
+        'reason': f"{agreeing[0].get('reason', '')}（集成投票 {len(agreeing)}/{valid} 一致，共 {samples} 路）",
+        'stop_loss': stop_loss if stop_loss is not None else current_price * 0.98,
+        'take_profit': take_profit if take_profit is not None else current_price * 1.02,
+        'confidence': confidence_from_agreement(agreement),
+        'ensemble': {'votes': tally, 'samples': samples, 'agreement': agreement},
+    }
+    return signal_data, replies
 
-【核心能力】
-- 深度技术分析：能够从多个维度分析市场
-- 结构化思维：按照思维链逐步分析问题
-- 风险控制：始终将风险控制放在首位，但不过度保守而错失机会
-- 逻辑推理：基于数据做出理性决策
-- 机会捕捉：在风险可控的前提下，积极捕捉明确的趋势机会
 
-【分析要求】
-请严格按照思维链分析要求，逐步完成五个步骤的分析：
-1. 多空力量对比分析
-2. 关键指标状态评估  
-3. 市场结构分析
-4. 风险收益评估
-5. 综合决策
+def parse_deepseek_signal(result, price_data):
+    """从DeepSeek回复中提取并校验交易信号，解析失败时返回备用信号"""
+    # 提取最外层JSON对象
+    signal_data = safe_json_parse(result)
+    if not isinstance(signal_data, dict):
+        signal_data = create_fallback_signal(price_data)
 
-【决策原则】
-- **趋势是王道**：明确的趋势信号优先于指标的细微偏差
-- **概率思维**：追求概率优势，而非绝对确定性
-- **风险可控**：每笔交易都有止损保护，不要因过度谨慎而错过明确的趋势机会
+    # 验证必需字段
+    required_fields = ['signal', 'reason', 'stop_loss', 'take_profit', 'confidence']
+    if not all(field in signal_data for field in required_fields):
+        signal_data = create_fallback_signal(price_data)
+    return signal_data
 
-【输出标准】
-- reason字段必须包含完整的五步思维链分析
-- 每个步骤都要有具体的分析内容
-- 最终决策要有明确的逻辑依据
-- 严格遵循JSON格式要求
-- **重要**：当趋势明确时，即使个别指标有轻微偏差，也要给出明确的BUY/SELL信号，而不是HOLD"""},
-                {"role": "user", "content": prompt}
-            ],
-            stream=False,
-            temperature=0.3  # 从0.1提高到0.3，平衡保守和灵活性，让AI在趋势明确时更积极
-        )
 
-        # 安全解析JSON
-        if not response or not hasattr(response, 'choices') or not response.choices or len(response.choices) == 0:
-            print("❌ DeepSeek API 响应为空或格式错误")
-            return create_fallback_signal(price_data)
-            
-        if not hasattr(response.choices[0], 'message') or not response.choices[0].message:
-            print("❌ DeepSeek API 响应消息为空")
-            return create_fallback_signal(price_data)
-            
-        result = response.choices[0].message.content
-        if not result:
-            print("❌ DeepSeek API 响应内容为空")
-            return create_fallback_signal(price_data)
-            
-        print(f"DeepSeek原始回复: {result}")
+def record_signal(signal_data, price_data):
+    """保存信号到历史记录并打印信号统计"""
+    signal_data['timestamp'] = price_data['timestamp']
+    signal_history.append(signal_data)
+    if len(signal_history) > 30:
+        signal_history.pop(0)
 
-        # 提取JSON部分
-        start_idx = result.find('{')
-        end_idx = result.rfind('}') + 1
+    # 信号统计
+    signal_count = len([s for s in signal_history if s.get('signal') == signal_data['signal']])
+    total_signals = len(signal_history)
+    print(f"信号统计: {signal_data['signal']} (最近{total_signals}次中出现{signal_count}次)")
 
-        if start_idx != -1 and end_idx != 0:
-            json_str = result[start_idx:end_idx]
-            signal_data = safe_json_parse(json_str)
+    # 信号连续性检查
+    if len(signal_history) >= 3:
+        last_three = []
+        for s in signal_history[-3:]:
+            if isinstance(s, dict) and 'signal' in s:
+                last_three.append(s['signal'])
+        if len(last_three) == 3 and len(set(last_three)) == 1:
+            print(f"⚠️ 注意：连续3次{signal_data['signal']}信号")
 
-            if signal_data is None:
-                signal_data = create_fallback_signal(price_data)
+    return signal_data
+
+
+def analyze_with_deepseek(price_data, deadline=None, deferred=None, record=True):
+    """使用DeepSeek分析市场并生成交易信号（增强版）；deadline为决策截止时间（time.time()），
+    超时到达的回复仍写入缓存/录制，但不计入信号历史；record=False时信号一律不计入历史，由调用方记录。
+    给出deferred（DeferredResponseStore，推测分析用）时不直接写缓存/录制，由调用方确认信号后按指定K线写入"""
+
+    # 🔴 修复：添加空值检查
+    if not price_data or not isinstance(price_data, dict):
+        print("❌ price_data 为空或无效，使用备用信号")
+        return create_fallback_signal({'price': 0})
+
+    print("🤖 开始调用DeepSeek API分析市场...")
+
+    current_pos = get_current_position()
+    messages = build_prompt_messages(price_data, current_pos)
+
+    # 回放模式：只按提示词哈希读取录制的决策，缺失时抛出LLMReplayMiss（不转为备用信号）
+    replay_store = get_llm_replay_store()
+    replay_key = replay_prompt_hash(price_data, current_pos) if replay_store is not None else None
+    if replay_store is not None and replay_store.mode == 'replay':
+        print("📼 回放模式：读取录制的DeepSeek决策")
+        signal_data = replay_store.replay(messages, replay_key)
+        return record_signal(signal_data, price_data) if record else signal_data
+
+    def finish(signal_data):
+        if not record:
+            return signal_data
+        if deadline is not None and time.time() > deadline:
+            print("⌛ DeepSeek回复晚于决策截止时间，不计入本周期信号")
+            return signal_data
+        return record_signal(signal_data, price_data)
+
+    timeout = max(deadline - time.time(), 0.1) if deadline is not None else None
+    cache = get_llm_cache()
+    cache_key = market_state_fingerprint(price_data, current_pos) if cache is not None else None
+
+    def store_response(result, signal_data, cached=False):
+        def store(bar=None):
+            if cache is not None and not cached and not signal_data.get('is_fallback', False):
+                cache.put(cache_key, signal_data)
+            if replay_store is not None:
+                replay_store.record(messages, result, signal_data, price_data, replay_key, bar)
+
+        if deferred is not None:
+            deferred.add(store)
         else:
-            signal_data = create_fallback_signal(price_data)
-
-        # 验证必需字段
-        required_fields = ['signal', 'reason', 'stop_loss', 'take_profit', 'confidence']
-        if not all(field in signal_data for field in required_fields):
-            signal_data = create_fallback_signal(price_data)
-
-        # 保存信号到历史记录
-        signal_data['timestamp'] = price_data['timestamp']
-        signal_history.append(signal_data)
-        if len(signal_history) > 30:
-            signal_history.pop(0)
-
-        # 信号统计
-        signal_count = len([s for s in signal_history if s.get('signal') == signal_data['signal']])
-        total_signals = len(signal_history)
-        print(f"信号统计: {signal_data['signal']} (最近{total_signals}次中出现{signal_count}次)")
-
-        # 信号连续性检查
-        if len(signal_history) >= 3:
-            last_three = []
-            for s in signal_history[-3:]:
-                if isinstance(s, dict) and 'signal' in s:
-                    last_three.append(s['signal'])
-            if len(last_three) == 3 and len(set(last_three)) == 1:
-                print(f"⚠️ 注意：连续3次{signal_data['signal']}信号")
+            store()
 
-        return signal_data
+    # 行情状态指纹未变化时直接复用缓存的信号
+    if cache is not None:
+        cached_signal = cache.get(cache_key)
+        if cached_signal is not None:
+            print(f"♻️ 行情状态未变化，复用缓存信号（指纹 {cache_key[:12]}）")
+            store_response(None, cached_signal, cached=True)
+            return finish(cached_signal)
+
+    try:
+        if TRADE_CONFIG.get('llm_ensemble', {}).get('enable_ensemble', False):
+            signal_data, replies = request_deepseek_ensemble(messages, price_data, timeout)
+            if signal_data is None:
+                return create_fallback_signal(price_data)
+            store_response(replies, signal_data)
+            return finish(signal_data)
+
+        if llm_streaming_enabled():
+            signal_data = stream_deepseek_signal(messages, price_data, store_response, timeout)
+            if signal_data is None:
+                return create_fallback_signal(price_data)
+            return finish(signal_data)
+
+        result = request_deepseek_completion(messages, timeout)
+        if not result:
+            return create_fallback_signal(price_data)
+
+        print(f"DeepSeek原始回复: {result}")
+        signal_data = parse_deepseek_signal(result, price_data)
+        store_response(result, signal_data)
+        return finish(signal_data)
 
     except Exception as e:
         print(f"DeepSeek分析失败: {e}")
@@ -1450,21 +4429,13 @@ def execute_trade(signal_data, price_data):
                         }
                     )
                 position_management['pyramid_count'] += 1
+                account_snapshot.invalidate()
                 print(f"✅ 加仓成功: {add_contracts:.2f} 张 (第{position_management['pyramid_count']}次加仓)")
             except Exception as e:
                 print(f"❌ 加仓失败: {e}")
         
         # 🆕 检查并更新移动止损
-        new_sl = update_trailing_stop(current_position, price_data)
-        if new_sl:
-            # 更新交易所止损订单
-            try:
-                # 取消旧止损
-                cleanup_stop_loss_orders()
-                # 设置新止损（需要根据实际持仓数量）
-                print(f"🔄 更新止损到: {new_sl:.2f}")
-            except Exception as e:
-                print(f"⚠️ 更新止损失败: {e}")
+        apply_trailing_stop(current_position, price_data)
         
         # 🆕 检查并执行分批止盈
         initial_sl = position_management.get('initial_stop_loss')
@@ -1559,6 +4530,7 @@ def execute_trade(signal_data, price_data):
         print("测试模式 - 仅模拟交易")
         return
 
+    order = None
     try:
         # 🔧 修复：先判断信号，再执行相关逻辑
         if signal_data['signal'] == 'BUY':
@@ -1585,7 +4557,7 @@ def execute_trade(signal_data, price_data):
                 dynamic_leverage = 5  # 使用默认杠杆
             
             # 获取账户余额进行最终检查
-            balance = exchange.fetch_balance()
+            balance = account_snapshot.get_balance()
             usdt_balance = balance['USDT']['free']
             required_margin = price_data['price'] * order_amount * TRADE_CONFIG['contract_size'] / dynamic_leverage
             
@@ -1610,7 +4582,7 @@ def execute_trade(signal_data, price_data):
             
             if current_position and current_position['side'] == 'short':
                 print("平空仓...")
-                exchange.create_market_order(
+                close_order = exchange.create_market_order(
                     TRADE_CONFIG['symbol'], 'buy', current_position['size'], 
                     None, {
                         'reduceOnly': True,
@@ -1618,7 +4590,8 @@ def execute_trade(signal_data, price_data):
                         'posSide': 'short'
                     }
                 )
-                time.sleep(2)  # 等待平仓完成
+                order_events.wait_filled(close_order.get('id'))  # 等待平仓成交确认
+                cleanup_stop_loss_orders()  # 撤销原持仓残留的止盈止损
                 # 🆕 重置持仓管理状态
                 position_management['pyramid_count'] = 0
                 position_management['partial_tp_executed'] = {'tp1': False, 'tp2': False, 'tp3': False}
@@ -1714,7 +4687,7 @@ def execute_trade(signal_data, price_data):
                 dynamic_leverage = 5  # 使用默认杠杆
             
             # 获取账户余额进行最终检查
-            balance = exchange.fetch_balance()
+            balance = account_snapshot.get_balance()
             usdt_balance = balance['USDT']['free']
             required_margin = price_data['price'] * order_amount * TRADE_CONFIG['contract_size'] / dynamic_leverage
             
@@ -1747,7 +4720,7 @@ def execute_trade(signal_data, price_data):
             
             if current_position and current_position['side'] == 'long':
                 print("平多仓...")
-                exchange.create_market_order(
+                close_order = exchange.create_market_order(
                     TRADE_CONFIG['symbol'], 'sell', current_position['size'],
                     None, {
                         'reduceOnly': True,
@@ -1755,7 +4728,8 @@ def execute_trade(signal_data, price_data):
                         'posSide': 'long'
                     }
                 )
-                time.sleep(2)  # 等待平仓完成
+                order_events.wait_filled(close_order.get('id'))  # 等待平仓成交确认
+                cleanup_stop_loss_orders()  # 撤销原持仓残留的止盈止损
                 # 🆕 重置持仓管理状态
                 position_management['pyramid_count'] = 0
                 position_management['partial_tp_executed'] = {'tp1': False, 'tp2': False, 'tp3': False}
@@ -1832,7 +4806,10 @@ def execute_trade(signal_data, price_data):
             return  # 🔧 修复：直接返回，不执行任何杠杆相关操作
 
         print("✅ 订单执行完成!")
-        time.sleep(3)
+        if order:
+            order_events.wait_filled(order.get('id'))  # 成交确认后再读取持仓
+            stop_orders.forget()  # 新订单附带的止损委托在下次移动止损时重新查询
+        account_snapshot.invalidate()
         position = get_current_position()
         print(f"更新后持仓: {position}")
         
@@ -1862,11 +4839,14 @@ def execute_trade(signal_data, price_data):
         traceback.print_exc()
 
 
-def check_stop_loss_take_profit_orders():
-    """检查止盈止损订单状态"""
+def check_stop_loss_take_profit_orders(orders_future=None):
+    """检查止盈止损订单状态（orders_future为周期开始时并发发出的挂单请求）"""
     try:
         # 获取所有开放订单
-        orders = exchange.fetch_open_orders(TRADE_CONFIG['symbol'])
+        if orders_future is not None:
+            orders = orders_future.result()
+        else:
+            orders = exchange.fetch_open_orders(TRADE_CONFIG['symbol'])
         
         stop_orders = []
         for order in orders:
@@ -1894,23 +4874,29 @@ def check_stop_loss_take_profit_orders():
         return []
 
 
-def analyze_with_deepseek_with_retry(price_data, max_retries=2):
-    """带重试的DeepSeek分析"""
+def analyze_with_deepseek_with_retry(price_data, max_retries=2, deadline=None, deferred=None, record=True):
+    """带重试的DeepSeek分析（给定deadline时，剩余时间不足以再次请求就停止重试；deferred、record见analyze_with_deepseek）"""
     
     # 🔴 修复：添加空值检查
     if not price_data or not isinstance(price_data, dict):
         print("❌ price_data 为空或无效，使用备用信号")
         return create_fallback_signal({'price': 0})
     
+    min_seconds = TRADE_CONFIG.get('decision_budget', {}).get('min_llm_seconds', 1.0)
     for attempt in range(max_retries):
+        if attempt > 0 and deadline is not None and deadline - time.time() < min_seconds:
+            print("⏱️ 决策预算不足，停止重试DeepSeek")
+            break
         try:
-            signal_data = analyze_with_deepseek(price_data)
+            signal_data = analyze_with_deepseek(price_data, deadline, deferred, record)
             if signal_data and not signal_data.get('is_fallback', False):
                 return signal_data
 
             print(f"第{attempt + 1}次尝试失败，进行重试...")
             time.sleep(1)
 
+        except LLMReplayMiss:
+            raise
         except Exception as e:
             print(f"第{attempt + 1}次尝试异常: {e}")
             import traceback
@@ -1922,6 +4908,193 @@ def analyze_with_deepseek_with_retry(price_data, max_retries=2):
     return create_fallback_signal(price_data)
 
 
+def decision_budget_anchor(price_data):
+    """决策预算的计时起点：最新K线的开盘时间即上一根K线的收盘时间；
+    K线时间不可用或与当前时间相差超过一个周期（数据滞后/时钟偏差）时以当前时间为起点"""
+    now = time.time()
+    try:
+        bar_open = pd.Timestamp(price_data['kline_data'][-1]['timestamp']).timestamp()
+        period = exchange.parse_timeframe(price_data.get('timeframe', TRADE_CONFIG['timeframe']))
+    except Exception:
+        return now
+    return bar_open if 0 <= now - bar_open <= period else now
+
+
+def decide_signal_within_budget(price_data):
+    """在决策延迟预算内得到交易信号：DeepSeek在后台线程中请求，预算用尽或只得到备用信号时，
+    改用基于同一份technical_data/trend_analysis的规则信号；每周期打印预算、耗时和采用的路径。
+    后台线程只返回信号不写信号历史，胜出的路径在锁内确定后由本函数记录一次"""
+    config = TRADE_CONFIG.get('decision_budget', {})
+    replay_store = get_llm_replay_store()
+    if not config.get('enable_budget', False) or (replay_store is not None and replay_store.mode == 'replay'):
+        # 回放模式需要逐K线确定的结果，不受墙钟时间影响
+        return analyze_with_deepseek_with_retry(price_data)
+
+    budget = config.get('budget_seconds', 8.0)
+    anchor = decision_budget_anchor(price_data)
+    deadline = anchor + budget
+    remaining = deadline - time.time()
+
+    result = {'decided': False}
+    result_lock = threading.Lock()
+    if remaining >= config.get('min_llm_seconds', 1.0):
+        def worker():
+            signal_data = analyze_with_deepseek_with_retry(price_data, deadline=deadline, record=False)
+            with result_lock:
+                # 预算已用尽、本周期已改用规则信号时，迟到的DeepSeek信号直接丢弃
+                if not result['decided']:
+                    result['signal'] = signal_data
+
+        thread = threading.Thread(target=worker, name='deepseek-decision', daemon=True)
+        thread.start()
+        thread.join(remaining)
+
+    with result_lock:
+        result['decided'] = True
+        signal_data = result.get('signal')
+    if signal_data is not None and not signal_data.get('is_fallback', False):
+        path = 'DeepSeek'
+    else:
+        path = '规则信号（DeepSeek超时）' if signal_data is None else '规则信号（DeepSeek不可用）'
+        signal_data = create_rule_based_signal(price_data)
+    record_signal(signal_data, price_data)
+
+    print(f"⏱️ 决策预算 {budget:.1f}s，自K线收盘起耗时 {time.time() - anchor:.2f}s，采用: {path}")
+    return signal_data
+
+
+class DeferredResponseStore:
+    """推测分析的缓存/录制写入：核对前暂存，commit(bar)时按指定K线写入（之后才收完的流式回复立即写入），
+    discard后全部丢弃"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.stores = []
+        self.state = 'pending'
+        self.bar = None
+
+    def add(self, store):
+        with self.lock:
+            if self.state == 'pending':
+                self.stores.append(store)
+                return
+            if self.state == 'discarded':
+                return
+        store(self.bar)
+
+    def commit(self, bar):
+        with self.lock:
+            self.state, self.bar = 'committed', bar
+            stores, self.stores = self.stores, []
+        for store in stores:
+            store(bar)
+
+    def discard(self):
+        with self.lock:
+            self.state = 'discarded'
+            self.stores = []
+
+
+def run_speculative_analysis(boundary):
+    """K线收盘前的推测分析：用未收盘K线完成数据获取、指标计算和DeepSeek决策，返回推测结果（失败时返回None）"""
+    print("🔮 推测分析：使用即将收盘的K线提前计算信号...")
+    account_snapshot.begin_cycle()
+    try:
+        price_data = get_btc_ohlcv_enhanced()
+        if not price_data:
+            return None
+        current_pos = get_current_position()
+        budget = TRADE_CONFIG.get('decision_budget', {}).get('budget_seconds', 8.0)
+        # 推测期间不写缓存/录制：未收盘时的"最后一根已收盘K线"是上一周期的K线，核对通过后再按推测K线写入
+        pending_store = DeferredResponseStore()
+        signal_data = analyze_with_deepseek_with_retry(price_data, deadline=boundary + budget,
+                                                       deferred=pending_store)
+        if not signal_data or signal_data.get('is_fallback', False):
+            print("⚠️ 推测分析未得到DeepSeek信号，收盘后按常规流程分析")
+            pending_store.discard()
+            return None
+        bar = price_data['kline_data'][-1]
+        print(f"🔮 推测信号: {signal_data['signal']}/{signal_data['confidence']}，"
+              f"距收盘 {boundary - time.time():.1f}s")
+        return {
+            'price_data': price_data,
+            'signal': signal_data,
+            'bar_time': int(pd.Timestamp(bar['timestamp']).timestamp() * 1000),
+            'bar': bar,
+            'position': (current_pos['side'], current_pos['size']) if current_pos else None,
+            'pending_store': pending_store,
+        }
+    except Exception as e:
+        print(f"❌ 推测分析失败: {e}")
+        return None
+
+
+def confirm_speculative_signal(speculation, current_position):
+    """收盘后的轻量核对：只拉取最近2根K线，推测所用K线的最终收盘价/最高价/最低价/成交量及持仓
+    均在容差内时返回可复用的(price_data, signal_data)，否则撤回推测信号并返回None"""
+    config = TRADE_CONFIG.get('speculative', {})
+    price_tol = config.get('price_tolerance_pct', 0.1) / 100
+    volume_tol = config.get('volume_tolerance_pct', 20) / 100
+    spec_bar = speculation['bar']
+
+    try:
+        bars = exchange.fetch_ohlcv(TRADE_CONFIG['symbol'], TRADE_CONFIG['timeframe'], limit=2)
+        final = next((bar for bar in bars or [] if bar[0] == speculation['bar_time']), None)
+    except Exception as e:
+        print(f"⚠️ 获取收盘K线失败: {e}")
+        final = None
+
+    reason = None
+    if final is None:
+        reason = "未取到推测K线的收盘数据"
+    elif abs(final[4] - spec_bar['close']) > spec_bar['close'] * price_tol:
+        reason = f"收盘价偏离 {spec_bar['close']:.2f} → {final[4]:.2f}"
+    elif final[2] > spec_bar['high'] * (1 + price_tol) or final[3] < spec_bar['low'] * (1 - price_tol):
+        reason = "收盘前创出新的高/低点"
+    elif spec_bar['volume'] > 0 and abs(final[5] - spec_bar['volume']) > spec_bar['volume'] * volume_tol:
+        reason = f"成交量偏离 {spec_bar['volume']:.2f} → {final[5]:.2f}"
+    elif speculation['position'] != ((current_position['side'], current_position['size'])
+                                     if current_position else None):
+        reason = "持仓已变化"
+
+    signal_data = speculation['signal']
+    if reason:
+        print(f"🔄 推测信号作废（{reason}），按收盘数据重新分析")
+        # 撤回推测时写入的信号历史，避免本周期重复计数
+        if signal_history and signal_history[-1] is signal_data:
+            signal_history.pop()
+        speculation['pending_store'].discard()
+        return None
+
+    # 核对通过才写入缓存/录制，录制K线为推测所用（现已收盘）的K线
+    speculation['pending_store'].commit(speculation['bar_time'])
+
+    price_data = speculation['price_data']
+    price_data['price'] = final[4]
+    print(f"⚡ 推测信号核对通过，复用 {signal_data['signal']}/{signal_data['confidence']}")
+    return price_data, signal_data
+
+
+def warm_up_deepseek_connection():
+    """预热DeepSeek连接：请求轻量的模型列表接口，使DNS解析和TLS握手在K线收盘前完成，连接留在池中供决策请求复用"""
+    started = time.perf_counter()
+    try:
+        deepseek_client.models.list()
+        print(f"🔥 DeepSeek连接已预热，耗时 {(time.perf_counter() - started) * 1000:.0f}ms")
+        return True
+    except Exception as e:
+        print(f"⚠️ DeepSeek连接预热失败: {e}")
+        return False
+
+
+def sleep_until(target):
+    """等待到指定时刻（time.time()）：先按wait_with_progress的10秒步进粗等，再精确睡到目标时刻"""
+    coarse_wait = target - time.time() - 10
+    if coarse_wait > 0:
+        wait_with_progress(coarse_wait)
+    time.sleep(max(0, target - time.time()))
+
+
 def wait_for_next_period():
     """等待到下一个15分钟整点"""
     now = datetime.now()
@@ -1974,22 +5147,54 @@ def wait_with_progress(seconds):
 
 
 def trading_bot():
-    # 等待到整点再执行
+    # 等待到整点再执行（启用推测执行时提前lead_seconds秒先完成分析）
+    # 首次调用DeepSeek前warmup_seconds秒预热连接，避免冷连接握手落在决策路径上
     wait_seconds = wait_for_next_period()
+    speculation = None
     if wait_seconds > 0:
-        wait_with_progress(wait_seconds)
+        spec_config = TRADE_CONFIG.get('speculative', {})
+        speculative = spec_config.get('enable_speculative', False)
+        lead_seconds = spec_config.get('lead_seconds', 8) if speculative else 0
+        period = exchange.parse_timeframe(TRADE_CONFIG['timeframe'])
+        boundary = (time.time() // period + 1) * period
+
+        warmup_seconds = TRADE_CONFIG.get('llm_http', {}).get('warmup_seconds', 15)
+        warmup_at = boundary - lead_seconds - warmup_seconds
+        if warmup_seconds > 0 and warmup_at > time.time():
+            sleep_until(warmup_at)
+            warm_up_deepseek_connection()
+
+        if speculative and boundary - lead_seconds > time.time():
+            sleep_until(boundary - lead_seconds)
+            speculation = run_speculative_analysis(boundary)
+
+        if market_feed is not None:
+            # WebSocket行情：K线确认收盘推送到达即开始，超时则按REST流程继续
+            sleep_until(boundary - 1)
+            confirm_timeout = TRADE_CONFIG.get('market_feed', {}).get('confirm_timeout', 10)
+            if market_feed.wait_for_closed_bar(int((boundary - period) * 1000), boundary - time.time() + confirm_timeout):
+                print(f"📡 K线收盘确认推送，延迟 {(market_feed.last_confirm_latency or 0) * 1000:.0f}ms")
+            else:
+                print("⚠️ 未收到K线收盘推送，改用REST获取")
+        else:
+            sleep_until(boundary)
+    cycle_started = time.time()
+    # 挂单、余额、持仓经异步适配器并发拉取，与下面的K线获取同时进行；决策前的耗时取决于最慢的请求而非总和
+    orders_future = async_exchange.submit('fetch_open_orders', TRADE_CONFIG['symbol'])
+    account_snapshot.begin_cycle()
 
     """主交易机器人函数"""
     print("\n" + "=" * 60)
     print(f"执行时间: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
     print("=" * 60)
 
-    # 1. 检查当前止盈止损订单状态
-    print("🔍 检查当前止盈止损订单...")
-    check_stop_loss_take_profit_orders()
+    # 1. 获取增强版K线数据（推测信号待核对时复用推测时的数据，核对失败再重新获取）
+    price_data = speculation['price_data'] if speculation else get_btc_ohlcv_enhanced()
 
-    # 2. 获取增强版K线数据
-    price_data = get_btc_ohlcv_enhanced()
+    # 2. 检查当前止盈止损订单状态（挂单已与K线并发拉取）
+    print("🔍 检查当前止盈止损订单...")
+    check_stop_loss_take_profit_orders(orders_future)
+    print(f"⏱️ 决策前数据就绪，耗时 {time.time() - cycle_started:.2f}s")
     if not price_data:
         return
 
@@ -2007,28 +5212,28 @@ def trading_bot():
         if position_management.get('entry_price') is None:
             position_management['entry_price'] = current_position.get('entry_price', price_data['price'])
         
-        # 检查移动止损
-        new_sl = update_trailing_stop(current_position, price_data)
-        if new_sl:
-            try:
-                cleanup_stop_loss_orders()
-                print(f"🔄 移动止损更新到: {new_sl:.2f}")
-            except Exception as e:
-                print(f"⚠️ 更新止损失败: {e}")
-        
-        # 检查分批止盈
-        initial_sl = position_management.get('initial_stop_loss')
-        if initial_sl:
-            execute_partial_take_profit(current_position, price_data, initial_sl)
-
-    # 3. 使用DeepSeek分析（带重试）
-    signal_data = analyze_with_deepseek_with_retry(price_data)
+        # 检查移动止损、分批止盈
+        manage_position_risk(current_position, price_data)
+
+    # 3. 使用DeepSeek分析（带重试，受决策延迟预算约束）；推测信号核对通过时直接复用
+    confirmed = confirm_speculative_signal(speculation, current_position) if speculation else None
+    if confirmed:
+        price_data, signal_data = confirmed
+        print(f"⏱️ 收盘后 {time.time() - cycle_started:.2f}s 得到信号（推测执行）")
+    else:
+        if speculation:
+            price_data = get_btc_ohlcv_enhanced()
+            if not price_data:
+                return
+        signal_data = decide_signal_within_budget(price_data)
 
     if signal_data.get('is_fallback', False):
         print("⚠️ 使用备用交易信号")
 
-    # 4. 执行交易（集成止盈止损、加仓等）
-    execute_trade(signal_data, price_data)
+    # 4. 执行交易（集成止盈止损、加仓等）；持有持仓锁，盘中风控线程期间暂停
+    with position_lock:
+        execute_trade(signal_data, price_data)
+    risk_monitor.refresh_position()
     
     # 5. 交易后再次检查止盈止损订单
     print("🔍 交易后检查止盈止损订单...")
@@ -2069,6 +5274,9 @@ def main():
     if not setup_exchange():
         print("交易所初始化失败，程序退出")
         return
+    start_market_feed()
+    start_order_events()
+    start_risk_monitor()
 
     print("执行频率: 每15分钟整点执行")
     print("=" * 60)
@@ -2098,7 +5306,157 @@ def main():
         print(f"\n❌ 程序异常退出: {e}")
         import traceback
         traceback.print_exc()
+    finally:
+        if market_feed is not None:
+            market_feed.stop()
+        risk_monitor.stop()
+        order_events.stop()
+        async_exchange.close()
+
+
+def run_verify_indicators_command(argv):
+    """命令行：python main.py verify-indicators [--bars N]，用本地归档（或交易所）K线校验指标引擎一致性"""
+    parser = argparse.ArgumentParser(prog='main.py verify-indicators', description='校验指标引擎与pandas实现一致')
+    parser.add_argument('--symbol', default=TRADE_CONFIG['symbol'])
+    parser.add_argument('--timeframe', default=TRADE_CONFIG['timeframe'])
+    parser.add_argument('--bars', type=int, default=2000)
+    args = parser.parse_args(argv)
+
+    bars = get_candle_archive(args.symbol, args.timeframe).read_bars(args.bars)
+    if len(bars) < args.bars:
+        print(f"本地归档仅 {len(bars)} 根K线，改为从交易所拉取")
+        since = exchange.milliseconds() - args.bars * exchange.parse_timeframe(args.timeframe) * 1000
+        bars = fetch_ohlcv_paged(args.symbol, args.timeframe, since, args.bars)
+
+    streaming_passed, _ = check_streaming_indicator_parity(bars)
+    numpy_passed, _ = check_numpy_indicator_parity(bars)
+    sys.exit(0 if streaming_passed and numpy_passed else 1)
+
+
+def run_scan_command(argv):
+    """命令行：python main.py scan [--symbols A,B] [--bars N]，批量扫描多个品种的趋势与支撑阻力"""
+    parser = argparse.ArgumentParser(prog='main.py scan', description='多品种批量指标扫描')
+    parser.add_argument('--symbols', default=','.join(TRADE_CONFIG.get('scan_symbols') or [TRADE_CONFIG['symbol']]))
+    parser.add_argument('--timeframe', default=TRADE_CONFIG['timeframe'])
+    parser.add_argument('--bars', type=int, default=TRADE_CONFIG['data_points'])
+    args = parser.parse_args(argv)
+
+    symbols = [symbol.strip() for symbol in args.symbols.split(',') if symbol.strip()]
+    symbols, ohlcv = fetch_ohlcv_batch(symbols, args.timeframe, args.bars)
+    if not symbols:
+        print("❌ 没有可扫描的品种")
+        sys.exit(1)
+
+    start = time.perf_counter()
+    frame = analyze_indicator_batch(symbols, ohlcv)
+    elapsed = time.perf_counter() - start
+    print(f"📊 批量扫描 {len(symbols)} 个品种 × {args.bars} 根{args.timeframe}K线，指标计算耗时 {elapsed * 1000:.1f}ms")
+    columns = ['close', 'rsi', 'bb_position', 'atr_ratio', 'trend_overall', 'trend_macd',
+               'price_vs_resistance', 'price_vs_support']
+    print(frame[columns].to_string(float_format=lambda value: f"{value:.4f}"))
+
+
+# 没有录制语料时使用的典型回复样例
+SAMPLE_DEEPSEEK_RESPONSES = [
+    '```json\n{"signal": "BUY", "reason": "价格站上SMA20与SMA50，MACD金叉且柱状图放大，RSI 58处于健康区间，'
+    '14:45成交量放大1.6倍确认突破", "stop_loss": 64850.5, "take_profit": 67200.0, "confidence": "HIGH"}\n```',
+    '{"signal": "HOLD", "reason": "震荡整理：价格在布林中轨附近（位置0.48），MACD与信号线缠绕，量能萎缩，等待方向选择",'
+    ' "stop_loss": 63900, "take_profit": 65600, "confidence": "LOW"}',
+    '分析完成，结果如下：\n{"signal": "SELL", "reason": "跌破支撑位64000: 中期趋势转空，RSI 41下行，'
+    'MACD死叉，反弹至20:00高点受阻", "stop_loss": 64600.0, "take_profit": 62100.0, "confidence": "MEDIUM"}',
+]
+
+
+def _json_variants(obj):
+    """由一个解析后的回复对象生成各类不规范写法：标准、单引号、无引号键、尾随逗号、超长reason"""
+    def quote_single(value):
+        if isinstance(value, str):
+            return "'" + value.replace('\\', '\\\\').replace("'", "\\'") + "'"
+        return json.dumps(value)
+
+    standard = json.dumps(obj, ensure_ascii=False)
+    long_obj = dict(obj, reason=' '.join([str(obj.get('reason', ''))] * 30) + ' 复核时间 09:15:00')
+    return {
+        '标准JSON': f'```json\n{standard}\n```',
+        '单引号': '{' + ', '.join(f"'{key}': {quote_single(value)}" for key, value in obj.items()) + '}',
+        '无引号键': '{' + ', '.join(f"{key}: {json.dumps(value, ensure_ascii=False)}" for key, value in obj.items()) + '}',
+        '尾随逗号': standard[:-1] + ',}',
+        '超长reason': json.dumps(long_obj, ensure_ascii=False)[:-1] + ',}',
+    }, long_obj
+
+
+def run_bench_json_command(argv):
+    """命令行：python main.py bench-json [--replay PATH] [--repeat N]，
+    用录制的DeepSeek回复语料（及其不规范变体）对比容错扫描与旧版正则修复的正确率和耗时"""
+    parser = argparse.ArgumentParser(prog='main.py bench-json', description='JSON容错解析基准测试')
+    parser.add_argument('--replay', default=TRADE_CONFIG.get('llm_replay', {}).get('path', 'data/llm_replay.jsonl.gz'))
+    parser.add_argument('--repeat', type=int, default=200)
+    args = parser.parse_args(argv)
+
+    def legacy_parse(json_str):
+        # 旧版safe_json_parse：json.loads失败后全局替换再解析
+        try:
+            return json.loads(json_str)
+        except json.JSONDecodeError:
+            try:
+                json_str = json_str.replace("'", '"')
+                json_str = re.sub(r'(\w+):', r'"\1":', json_str)
+                json_str = re.sub(r',\s*}', '}', json_str)
+                json_str = re.sub(r',\s*]', ']', json_str)
+                return json.loads(json_str)
+            except json.JSONDecodeError:
+                return None
+
+    def legacy_extract(text):
+        start, end = text.find('{'), text.rfind('}') + 1
+        return legacy_parse(text[start:end]) if start != -1 and end > start else None
+
+    responses = []
+    if os.path.exists(args.replay):
+        for record in LLMReplayStore(args.replay, mode='replay').records():
+            response = record.get('response')
+            responses.extend(response if isinstance(response, list) else [response])
+    responses = [response for response in responses if isinstance(response, str) and response]
+    if responses:
+        print(f"📚 语料: {args.replay} 中的 {len(responses)} 条录制回复")
+    else:
+        responses = SAMPLE_DEEPSEEK_RESPONSES
+        print(f"📚 未找到录制语料（{args.replay}），使用内置的 {len(responses)} 条样例回复")
+
+    corpus = {}
+    for response in responses:
+        expected = extract_json_object(response)
+        if not isinstance(expected, dict):
+            continue
+        variants, long_obj = _json_variants(expected)
+        for name, text in variants.items():
+            corpus.setdefault(name, []).append((text, long_obj if name == '超长reason' else expected))
+
+    print(f"{'变体':<10}{'条数':>6}{'容错扫描正确率':>16}{'耗时(µs/条)':>14}{'旧版正确率':>12}{'耗时(µs/条)':>14}")
+    for name, cases in corpus.items():
+        row = [f"{name:<10}", f"{len(cases):>6}"]
+        for parse in (safe_json_parse, legacy_extract):
+            correct = sum(parse(text) == expected for text, expected in cases)
+            started = time.perf_counter()
+            for _ in range(args.repeat):
+                for text, _expected in cases:
+                    parse(text)
+            per_case = (time.perf_counter() - started) / (args.repeat * len(cases)) * 1e6
+            row += [f"{correct / len(cases):>15.0%}", f"{per_case:>14.1f}"]
+        print(''.join(row))
+
+
+# 命令行子命令：python main.py <command> [参数]
+CLI_COMMANDS = {
+    'backfill': run_backfill_command,
+    'verify-indicators': run_verify_indicators_command,
+    'scan': run_scan_command,
+    'bench-json': run_bench_json_command,
+}
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    if len(sys.argv) > 1 and sys.argv[1] in CLI_COMMANDS:
+        CLI_COMMANDS[sys.argv[1]](sys.argv[2:])
+    else:
+        main()
\ No newline at end of file
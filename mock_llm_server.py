@@ -0,0 +1,311 @@
+"""
+本地模拟LLM服务器：兼容OpenAI chat-completions接口（流式/非流式），用于离线测试与延迟/压力测试
+
+- 延迟：首字节延迟按 fixed / uniform / lognormal 分布采样，流式按 tokens_per_sec 逐块输出
+- 信号：按脚本循环输出（--signals BUY,SELL,HOLD 或 --script 脚本JSON），止盈止损按提示词中的当前价格计算
+- 故障注入：按比例返回不规范JSON（单引号、无引号键、尾随逗号、截断、前后说明文字）或HTTP 500
+- 用量：按字符数估算token，并按与上一次提示词的公共前缀模拟上下文缓存命中
+
+机器人通过环境变量指向本服务器：DEEPSEEK_BASE_URL=http://127.0.0.1:8765 python main.py
+用法：python mock_llm_server.py [--port 8765] [--latency-ms 800] [--latency-dist lognormal] [--malformed-rate 0.1]
+"""
+
+import argparse
+import json
+import math
+import random
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+MALFORMED_KINDS = ('single_quotes', 'bare_keys', 'trailing_comma', 'truncated', 'prose')
+PRICE_PATTERNS = (
+    re.compile(r'当前价格: \$([\d,]+(?:\.\d+)?)'),   # 完整提示词
+    re.compile(r'"price":\s*([\d.]+)'),              # 紧凑提示词
+)
+
+
+def estimate_tokens(text):
+    """粗略估算token数（中文约0.6/字，其他约0.3/字符，与main.estimate_tokens口径一致）"""
+    cjk = sum(1 for ch in text if ord(ch) > 0x2E80)
+    return int(cjk * 0.6 + (len(text) - cjk) * 0.3) + 1
+
+
+class MockLLMBehavior:
+    """模拟服务器的行为配置与运行统计（各请求线程共享，内部加锁）"""
+
+    def __init__(self, latency_ms=800.0, jitter_ms=200.0, latency_dist='lognormal', tokens_per_sec=60.0,
+                 malformed_rate=0.0, error_rate=0.0, script=None, seed=None):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.latency_dist = latency_dist
+        self.tokens_per_sec = tokens_per_sec
+        self.malformed_rate = malformed_rate
+        self.error_rate = error_rate
+        self.script = script or [{'signal': 'HOLD', 'confidence': 'MEDIUM'}]
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.step = 0
+        self.last_prompt = ''
+        self.stats = {'requests': 0, 'streamed': 0, 'malformed': 0, 'errors': 0, 'latency_ms': []}
+
+    def sample_latency(self):
+        """按配置的分布采样首字节延迟（秒）"""
+        with self.lock:
+            if self.latency_dist == 'fixed':
+                value = self.latency_ms
+            elif self.latency_dist == 'uniform':
+                value = self.rng.uniform(self.latency_ms - self.jitter_ms, self.latency_ms + self.jitter_ms)
+            else:
+                # 对数正态：中位数为latency_ms，长尾由jitter_ms/latency_ms控制
+                sigma = self.jitter_ms / self.latency_ms if self.latency_ms > 0 else 0.0
+                value = self.latency_ms * math.exp(self.rng.gauss(0.0, sigma))
+        return max(0.0, value) / 1000
+
+    def roll(self, rate):
+        with self.lock:
+            return self.rng.random() < rate
+
+    def next_script_entry(self):
+        with self.lock:
+            entry = self.script[self.step % len(self.script)]
+            self.step += 1
+            return entry
+
+    def cache_hit_tokens(self, prompt):
+        """按与上一次提示词的公共前缀估算上下文缓存命中token数"""
+        with self.lock:
+            previous, self.last_prompt = self.last_prompt, prompt
+        common = 0
+        for a, b in zip(previous, prompt):
+            if a != b:
+                break
+            common += 1
+        return estimate_tokens(prompt[:common])
+
+    def record(self, latency, streamed=False, malformed=False, error=False):
+        with self.lock:
+            self.stats['requests'] += 1
+            self.stats['streamed'] += streamed
+            self.stats['malformed'] += malformed
+            self.stats['errors'] += error
+            self.stats['latency_ms'].append(latency * 1000)
+
+    def summary(self):
+        with self.lock:
+            latencies = np.asarray(self.stats['latency_ms'] or [0.0])
+            return (f"请求 {self.stats['requests']}（流式 {self.stats['streamed']}），"
+                    f"不规范JSON {self.stats['malformed']}，HTTP错误 {self.stats['errors']}，"
+                    f"首字节延迟 p50={np.percentile(latencies, 50):.0f}ms p95={np.percentile(latencies, 95):.0f}ms "
+                    f"max={latencies.max():.0f}ms")
+
+
+def prompt_price(prompt):
+    for pattern in PRICE_PATTERNS:
+        match = pattern.search(prompt)
+        if match:
+            return float(match.group(1).replace(',', ''))
+    return 100000.0
+
+
+def build_signal(entry, price):
+    """由脚本条目生成信号：止损/止盈按百分比偏离当前价格（SELL方向相反）"""
+    signal = entry.get('signal', 'HOLD')
+    sl_pct = entry.get('sl_pct', 1.5) / 100
+    tp_pct = entry.get('tp_pct', 3.0) / 100
+    direction = -1 if signal == 'SELL' else 1
+    return {
+        'signal': signal,
+        'confidence': entry.get('confidence', 'MEDIUM'),
+        'stop_loss': round(price * (1 - direction * sl_pct), 2),
+        'take_profit': round(price * (1 + direction * tp_pct), 2),
+        'reason': entry.get('reason', f"模拟服务器脚本信号：{signal}，参考价格 {price:.2f}，时间 12:00"),
+    }
+
+
+def render_signal(signal, reason_last, malformed_kind=None):
+    """按提示词要求的字段顺序输出JSON；malformed_kind不为空时生成对应的不规范写法"""
+    order = (['signal', 'confidence', 'stop_loss', 'take_profit', 'reason'] if reason_last
+             else ['signal', 'reason', 'stop_loss', 'take_profit', 'confidence'])
+    items = [(key, signal[key]) for key in order]
+    if malformed_kind == 'single_quotes':
+        def quote(value):
+            return "'" + value.replace("'", "\\'") + "'" if isinstance(value, str) else json.dumps(value)
+        return '{' + ', '.join(f"'{key}': {quote(value)}" for key, value in items) + '}'
+    if malformed_kind == 'bare_keys':
+        return '{' + ', '.join(f"{key}: {json.dumps(value, ensure_ascii=False)}" for key, value in items) + '}'
+
+    text = json.dumps(dict(items), ensure_ascii=False, indent=2)
+    if malformed_kind == 'trailing_comma':
+        return text[:text.rfind('\n')] + ',\n}'
+    if malformed_kind == 'truncated':
+        return text[:len(text) * 2 // 3]
+    if malformed_kind == 'prose':
+        return f"根据以上分析，我的交易建议如下：\n{text}\n以上建议仅供参考。"
+    return f"```json\n{text}\n```"
+
+
+class MockLLMHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'   # 支持keep-alive，便于测试连接池复用
+    behavior = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, payload):
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path.rstrip('/').endswith('/models'):
+            self._send_json(200, {'object': 'list', 'data': [
+                {'id': 'deepseek-chat', 'object': 'model', 'created': 0, 'owned_by': 'mock'}]})
+        else:
+            self._send_json(404, {'error': {'message': f'未知路径 {self.path}'}})
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        request = json.loads(self.rfile.read(length) or b'{}')
+        if not self.path.rstrip('/').endswith('/chat/completions'):
+            self._send_json(404, {'error': {'message': f'未知路径 {self.path}'}})
+            return
+
+        behavior = self.behavior
+        latency = behavior.sample_latency()
+        time.sleep(latency)
+        stream = bool(request.get('stream'))
+
+        if behavior.roll(behavior.error_rate):
+            behavior.record(latency, streamed=stream, error=True)
+            self._send_json(500, {'error': {'message': '模拟服务器注入的错误', 'type': 'server_error'}})
+            return
+
+        prompt = ''.join(str(message.get('content', '')) for message in request.get('messages', []))
+        malformed_kind = behavior.rng.choice(MALFORMED_KINDS) if behavior.roll(behavior.malformed_rate) else None
+        signal = build_signal(behavior.next_script_entry(), prompt_price(prompt))
+        content = render_signal(signal, reason_last='reason放' in prompt, malformed_kind=malformed_kind)
+
+        prompt_tokens = estimate_tokens(prompt)
+        hit_tokens = min(behavior.cache_hit_tokens(prompt), prompt_tokens)
+        usage = {
+            'prompt_tokens': prompt_tokens,
+            'completion_tokens': estimate_tokens(content),
+            'total_tokens': prompt_tokens + estimate_tokens(content),
+            'prompt_cache_hit_tokens': hit_tokens,
+            'prompt_cache_miss_tokens': prompt_tokens - hit_tokens,
+        }
+        behavior.record(latency, streamed=stream, malformed=malformed_kind is not None)
+
+        completion_id = f"chatcmpl-{uuid.uuid4().hex[:12]}"
+        model = request.get('model', 'deepseek-chat')
+        if stream:
+            include_usage = (request.get('stream_options') or {}).get('include_usage', False)
+            self._stream(completion_id, model, content, usage if include_usage else None)
+            return
+
+        # 非流式：整段生成时间按token速率计入延迟
+        if behavior.tokens_per_sec > 0:
+            time.sleep(usage['completion_tokens'] / behavior.tokens_per_sec)
+        self._send_json(200, {
+            'id': completion_id, 'object': 'chat.completion', 'created': int(time.time()), 'model': model,
+            'choices': [{'index': 0, 'finish_reason': 'stop',
+                         'message': {'role': 'assistant', 'content': content}}],
+            'usage': usage,
+        })
+
+    def _stream(self, completion_id, model, content, usage):
+        """以SSE逐块输出，每块约4个token，块间隔按tokens_per_sec计算"""
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        self.close_connection = True
+
+        def send(choices, extra=None):
+            chunk = {'id': completion_id, 'object': 'chat.completion.chunk', 'created': int(time.time()),
+                     'model': model, 'choices': choices}
+            if extra:
+                chunk.update(extra)
+            self.wfile.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode('utf-8'))
+            self.wfile.flush()
+
+        chunk_chars = 8
+        interval = 4 / self.behavior.tokens_per_sec if self.behavior.tokens_per_sec > 0 else 0.0
+        try:
+            send([{'index': 0, 'delta': {'role': 'assistant', 'content': ''}, 'finish_reason': None}])
+            for start in range(0, len(content), chunk_chars):
+                send([{'index': 0, 'delta': {'content': content[start:start + chunk_chars]}, 'finish_reason': None}])
+                time.sleep(interval)
+            send([{'index': 0, 'delta': {}, 'finish_reason': 'stop'}])
+            if usage is not None:
+                send([], {'usage': usage})
+            self.wfile.write(b"data: [DONE]\n\n")
+            self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            # 客户端提前拿到决策字段后可能直接断开
+            pass
+
+
+def load_script(path=None, signals=None):
+    """读取信号脚本：JSON列表 [{"signal": "BUY", "confidence": "HIGH", "sl_pct": 1.5, "tp_pct": 3}, ...]，
+    或逗号分隔的信号序列（如 BUY,HOLD,SELL）"""
+    if path:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    if signals:
+        return [{'signal': signal.strip().upper(), 'confidence': 'MEDIUM'}
+                for signal in signals.split(',') if signal.strip()]
+    return None
+
+
+def create_server(host='127.0.0.1', port=8765, behavior=None):
+    """创建模拟服务器（port=0时自动分配端口）；调用方负责serve_forever/shutdown"""
+    handler = type('BoundMockLLMHandler', (MockLLMHandler,), {'behavior': behavior or MockLLMBehavior()})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+
+def main_cli(argv=None):
+    parser = argparse.ArgumentParser(prog='mock_llm_server.py', description='本地OpenAI兼容模拟LLM服务器')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--latency-ms', type=float, default=800.0, help='首字节延迟（中位数/均值）')
+    parser.add_argument('--jitter-ms', type=float, default=200.0, help='延迟抖动（uniform为半宽，lognormal决定长尾）')
+    parser.add_argument('--latency-dist', choices=['fixed', 'uniform', 'lognormal'], default='lognormal')
+    parser.add_argument('--tokens-per-sec', type=float, default=60.0, help='输出速率，0为瞬间输出')
+    parser.add_argument('--malformed-rate', type=float, default=0.0, help='返回不规范JSON的比例')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='返回HTTP 500的比例')
+    parser.add_argument('--signals', help='循环输出的信号序列，如 BUY,HOLD,SELL')
+    parser.add_argument('--script', help='信号脚本JSON文件')
+    parser.add_argument('--seed', type=int)
+    args = parser.parse_args(argv)
+
+    behavior = MockLLMBehavior(
+        latency_ms=args.latency_ms, jitter_ms=args.jitter_ms, latency_dist=args.latency_dist,
+        tokens_per_sec=args.tokens_per_sec, malformed_rate=args.malformed_rate, error_rate=args.error_rate,
+        script=load_script(args.script, args.signals), seed=args.seed)
+    server = create_server(args.host, args.port, behavior)
+    print(f"🧪 模拟LLM服务器已启动: http://{args.host}:{server.server_address[1]}")
+    print(f"   延迟 {args.latency_dist} {args.latency_ms:.0f}±{args.jitter_ms:.0f}ms，"
+          f"{args.tokens_per_sec:.0f} token/s，不规范JSON {args.malformed_rate:.0%}，错误 {args.error_rate:.0%}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(f"📊 {behavior.summary()}")
+
+
+if __name__ == "__main__":
+    main_cli()
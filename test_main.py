@@ -0,0 +1,503 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+main.py 回归测试 - 不访问网络（DeepSeek与交易所均替换为本地桩）
+运行：python -m pytest -q test_main.py 或 python test_main.py
+"""
+
+import os
+import time
+from types import SimpleNamespace
+
+import numpy as np
+import pandas as pd
+
+os.environ.setdefault('DEEPSEEK_API_KEY', 'test')
+import main  # noqa: E402
+
+
+def make_price_data(price=100.0):
+    """构造最小可用的price_data（最新K线为当前15分钟周期）"""
+    bar_time = pd.Timestamp.now('UTC').tz_localize(None).floor('15min')
+    bar = {'timestamp': bar_time, 'open': price, 'high': price, 'low': price, 'close': price, 'volume': 1.0}
+    return {
+        'price': price, 'high': price + 1, 'low': price - 1, 'volume': 5.0,
+        'timestamp': str(bar_time), 'timeframe': '15m', 'price_change': 0.1,
+        'kline_data': [dict(bar) for _ in range(10)],
+        'technical_data': {
+            'sma_5': price, 'sma_20': price, 'sma_50': price, 'rsi': 55, 'macd': 1, 'macd_signal': 0,
+            'macd_histogram': 1, 'bb_upper': price + 1, 'bb_lower': price - 1, 'bb_position': 0.5,
+            'volume_ratio': 1, 'atr_20': 0.5, 'atr_ratio': 0.005,
+        },
+        'trend_analysis': {'short_term': '上涨', 'medium_term': '上涨', 'macd': 'bullish',
+                           'overall': '强势上涨', 'rsi_level': 55},
+        'levels_analysis': {},
+    }
+
+
+class FailingCompletions:
+    """缓存命中时不应访问DeepSeek"""
+
+    def __init__(self):
+        self.calls = 0
+
+    def create(self, **kwargs):
+        self.calls += 1
+        raise AssertionError('缓存命中时不应请求DeepSeek')
+
+
+def test_analyze_with_deepseek_cache_hit():
+    completions = FailingCompletions()
+    saved = (main.deepseek_client, main.get_current_position, main.llm_cache,
+             dict(main.TRADE_CONFIG['llm_cache']), list(main.signal_history))
+    try:
+        main.deepseek_client = SimpleNamespace(chat=SimpleNamespace(completions=completions))
+        main.get_current_position = lambda: None
+        main.TRADE_CONFIG['llm_cache'].update(enable_cache=True, path=None)
+        main.llm_cache = None
+        price_data = make_price_data()
+
+        cache = main.get_llm_cache()
+        cached = {'signal': 'BUY', 'reason': '缓存', 'stop_loss': 95.0, 'take_profit': 110.0, 'confidence': 'HIGH'}
+        cache.put(main.market_state_fingerprint(price_data, None), cached)
+
+        for deadline in (None, time.time() + 5):
+            main.signal_history[:] = []  # 上次信号是指纹的一部分
+            signal_data = main.analyze_with_deepseek(price_data, deadline)
+            assert signal_data['signal'] == 'BUY'
+            assert signal_data.get('cached') is True
+            assert not signal_data.get('is_fallback', False)
+        assert completions.calls == 0
+        assert cache.hits == 2
+    finally:
+        (main.deepseek_client, main.get_current_position, main.llm_cache, cache_config, history) = saved
+        main.TRADE_CONFIG['llm_cache'].clear()
+        main.TRADE_CONFIG['llm_cache'].update(cache_config)
+        main.signal_history[:] = history
+
+
+def test_llm_cache_disabled_by_default():
+    saved = main.llm_cache
+    try:
+        main.llm_cache = None
+        assert main.TRADE_CONFIG['llm_cache']['enable_cache'] is False
+        assert main.get_llm_cache() is None
+    finally:
+        main.llm_cache = saved
+
+
+def test_market_feed_merge_requires_confirmed_bar():
+    """收盘推送超时时，缓存末尾只是上个周期的未收盘快照，不能当作收盘K线返回"""
+    symbol, timeframe = main.TRADE_CONFIG['symbol'], main.TRADE_CONFIG['timeframe']
+    saved = (dict(main.candle_cache), dict(main.TRADE_CONFIG['candle_archive']))
+    try:
+        main.TRADE_CONFIG['candle_archive']['enable_archive'] = False
+        feed = main.MarketDataFeed(symbol, timeframe)
+        tf = feed.timeframe_ms
+        just_closed = main.exchange.milliseconds() // tf * tf - tf
+        stale = [just_closed, 100.0, 101.0, 99.0, 100.5, 1.0]
+        main.candle_cache.update(symbol=symbol, timeframe=timeframe,
+                                 bars=[[just_closed - tf, 99.0, 100.0, 98.0, 100.0, 2.0], list(stale)])
+        assert feed.merge_into_cache() is False
+
+        confirmed = [just_closed, 100.0, 103.0, 97.0, 102.0, 9.0]
+        feed._closed.put((time.time(), confirmed))
+        assert feed.merge_into_cache() is True
+        assert main.candle_cache['bars'][-1] == confirmed
+        assert feed.merge_into_cache() is False  # 同一根K线不重复当作新推送
+    finally:
+        main.candle_cache.clear()
+        main.candle_cache.update(saved[0])
+        main.TRADE_CONFIG['candle_archive'].clear()
+        main.TRADE_CONFIG['candle_archive'].update(saved[1])
+
+
+def make_bars(n=600, seed=0):
+    rng = np.random.default_rng(seed)
+    close = 60000 * np.exp(np.cumsum(rng.normal(0, 0.003, n)))
+    open_ = np.r_[close[0], close[:-1]]
+    high = np.maximum(open_, close) * (1 + rng.uniform(0, 0.002, n))
+    low = np.minimum(open_, close) * (1 - rng.uniform(0, 0.002, n))
+    volume = rng.uniform(10, 1000, n)
+    start = 1_700_000_000_000
+    return [[start + i * 900_000, open_[i], high[i], low[i], close[i], volume[i]] for i in range(n)]
+
+
+def test_indicator_block_partial_columns():
+    """部分列请求（含中间量）写入输出块的结果与单独求值、pandas实现一致"""
+    passed, _ = main.check_numpy_indicator_parity(make_bars())
+    assert passed
+
+    bars = np.array(make_bars(300, seed=1))
+    series = {'high': bars[:, 2], 'low': bars[:, 3], 'close': bars[:, 4], 'volume': bars[:, 5]}
+    columns = ['true_range', 'bb_std', 'price_delta', 'sma_20']
+    block = main.compute_indicator_block(series['high'], series['low'], series['close'], series['volume'],
+                                         columns=columns)
+    separate = main.evaluate_indicators(columns, series)
+    for i, column in enumerate(columns):
+        assert np.allclose(block[i], separate[column], equal_nan=True), column
+
+    try:
+        main.compute_indicator_block(series['high'], series['low'], series['close'], series['volume'],
+                                     columns=['close_cumsum'])
+    except ValueError:
+        pass
+    else:
+        raise AssertionError('中间量不应作为输出列')
+
+
+def test_indicator_block_fills_mid_series_nan():
+    """横盘、零成交量造成的0/0只出现在may_nan行，输出块只扫描这些行也要全部填充，与逐列完整填充一致"""
+    bars = np.array(make_bars(400, seed=2))
+    bars[150:200, 1:5] = bars[149, 4]
+    bars[150:200, 5] = 0.0
+    series = {'high': bars[:, 2], 'low': bars[:, 3], 'close': bars[:, 4], 'volume': bars[:, 5]}
+    block = main.compute_indicator_block(series['high'], series['low'], series['close'], series['volume'])
+    separate = main.evaluate_indicators(main.INDICATOR_COLUMNS, series)
+    assert not np.isnan(block).any()
+    for i, column in enumerate(main.INDICATOR_COLUMNS):
+        assert np.array_equal(block[i], separate[column]), column
+
+
+def test_llm_replay_hash_ignores_wall_clock_and_pnl(tmp_path=None):
+    """录制后重新运行（时间、浮动盈亏不同）按提示词哈希仍能命中；记录的K线为最后一根已收盘K线"""
+    import tempfile
+    path = os.path.join(tmp_path or tempfile.mkdtemp(), 'replay.jsonl.gz')
+    store = main.LLMReplayStore(path, mode='record')
+    price_data = make_price_data()
+    position = {'side': 'long', 'size': 1.0, 'entry_price': 95.0, 'unrealized_pnl': 3.2, 'leverage': 5}
+    signal = {'signal': 'BUY', 'reason': '录制', 'stop_loss': 95.0, 'take_profit': 110.0, 'confidence': 'HIGH'}
+    messages = main.build_deepseek_messages(price_data, position)
+    store.record(messages, '{}', signal, price_data, main.replay_prompt_hash(price_data, position))
+
+    rerun = dict(price_data, timestamp='2030-01-01 00:00:00')
+    rerun_position = dict(position, unrealized_pnl=-7.5)
+    replay = main.LLMReplayStore(path, mode='replay')
+    replayed = replay.replay(main.build_deepseek_messages(rerun, rerun_position),
+                             main.replay_prompt_hash(rerun, rerun_position))
+    assert replayed['signal'] == 'BUY'
+
+    forming_open = int(pd.Timestamp(price_data['kline_data'][-1]['timestamp']).value // 10 ** 6)
+    record = next(replay.records())
+    assert record['bar'] is None or record['bar'] < forming_open
+    bars = [dict(price_data['kline_data'][-1], timestamp=pd.Timestamp(forming_open - k * 900_000, unit='ms'))
+            for k in (2, 1, 0)]
+    assert main.last_closed_bar_ms(dict(price_data, kline_data=bars), forming_open + 60_000) == forming_open - 900_000
+
+
+class ScriptedCompletions:
+    """按调用顺序返回 (延迟秒数, 信号) 的DeepSeek桩"""
+
+    def __init__(self, script):
+        self.script = list(script)
+        self.lock = __import__('threading').Lock()
+
+    def create(self, **kwargs):
+        with self.lock:
+            delay, signal = self.script.pop(0)
+        time.sleep(delay)
+        content = ('{"signal": "%s", "reason": "r", "stop_loss": 95, "take_profit": 110, "confidence": "LOW"}'
+                   % signal)
+        usage = SimpleNamespace(prompt_tokens=100, completion_tokens=20, prompt_cache_hit_tokens=60,
+                                prompt_cache_miss_tokens=40)
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))], usage=usage)
+
+
+def test_ensemble_confidence_from_received_votes():
+    saved = (main.deepseek_client, dict(main.TRADE_CONFIG['llm_ensemble']))
+    try:
+        main.TRADE_CONFIG['llm_ensemble'].update(samples=5, quorum=3, grade_wait_seconds=0.3)
+        price_data = make_price_data()
+
+        main.deepseek_client = SimpleNamespace(chat=SimpleNamespace(completions=ScriptedCompletions(
+            [(0.01 * i, 'BUY') for i in range(5)])))
+        signal_data, _ = main.request_deepseek_ensemble([], price_data)
+        assert signal_data['signal'] == 'BUY' and signal_data['confidence'] == 'HIGH'
+        assert signal_data['ensemble']['agreement'] == 1.0
+
+        main.deepseek_client = SimpleNamespace(chat=SimpleNamespace(completions=ScriptedCompletions(
+            [(0.01, 'BUY'), (0.02, 'SELL'), (0.03, 'BUY'), (0.04, 'BUY'), (2.0, 'SELL')])))
+        started = time.time()
+        signal_data, _ = main.request_deepseek_ensemble([], price_data)
+        assert time.time() - started < 1.5  # 达到quorum后只多等grade_wait_seconds
+        assert signal_data['signal'] == 'BUY' and signal_data['confidence'] == 'MEDIUM'
+        assert signal_data['ensemble']['agreement'] == 0.75
+    finally:
+        main.deepseek_client = saved[0]
+        main.TRADE_CONFIG['llm_ensemble'].clear()
+        main.TRADE_CONFIG['llm_ensemble'].update(saved[1])
+
+
+def test_speculative_signal_recorded_only_after_confirmation():
+    """推测分析不写录制；核对通过后按推测K线写入，作废的推测不留下录制"""
+    import tempfile
+    path = os.path.join(tempfile.mkdtemp(), 'replay.jsonl.gz')
+    saved = (main.deepseek_client, main.get_current_position, main.exchange, main.llm_replay_store,
+             dict(main.TRADE_CONFIG['llm_replay']), list(main.signal_history))
+    try:
+        main.deepseek_client = SimpleNamespace(chat=SimpleNamespace(completions=ScriptedCompletions(
+            [(0, 'BUY'), (0, 'SELL')])))
+        main.get_current_position = lambda: None
+        main.TRADE_CONFIG['llm_replay'].update(mode='record', path=path)
+        main.llm_replay_store = None
+        store = main.get_llm_replay_store()
+
+        for final_close, accepted in ((120.0, False), (100.0, True)):
+            price_data = make_price_data()
+            bar = price_data['kline_data'][-1]
+            bar_time = int(pd.Timestamp(bar['timestamp']).value // 10 ** 6)
+            records_before = len(list(store.records()))
+            pending = main.DeferredResponseStore()
+            signal_data = main.analyze_with_deepseek_with_retry(price_data, deferred=pending)
+            assert len(list(store.records())) == records_before
+
+            main.exchange = SimpleNamespace(
+                fetch_ohlcv=lambda *args, **kwargs: [[bar_time, 100.0, 100.0, 100.0, final_close, 1.0]])
+            speculation = {'price_data': price_data, 'signal': signal_data, 'bar_time': bar_time, 'bar': bar,
+                           'position': None, 'pending_store': pending}
+            confirmed = main.confirm_speculative_signal(speculation, None)
+            records = list(store.records())
+            assert (confirmed is not None) == accepted
+            assert len(records) == records_before + (1 if accepted else 0)
+        assert records[-1]['bar'] == bar_time
+        assert records[-1]['signal']['signal'] == 'SELL'
+    finally:
+        (main.deepseek_client, main.get_current_position, main.exchange, main.llm_replay_store,
+         replay_config, history) = saved
+        main.TRADE_CONFIG['llm_replay'].clear()
+        main.TRADE_CONFIG['llm_replay'].update(replay_config)
+        main.signal_history[:] = history
+
+
+def test_decision_budget_records_one_signal_per_cycle():
+    """预算内与超时两种情况下，每周期都只写入一条信号历史（超时后到达的DeepSeek信号不计入）"""
+    saved = (main.deepseek_client, main.get_current_position, dict(main.TRADE_CONFIG['decision_budget']),
+             list(main.signal_history))
+    try:
+        assert main.TRADE_CONFIG['decision_budget']['enable_budget'] is False
+        main.get_current_position = lambda: None
+        for delay, expected in ((0.05, 'DeepSeek'), (0.8, 'rule')):
+            price_data = make_price_data()
+            main.signal_history[:] = []
+            main.deepseek_client = SimpleNamespace(chat=SimpleNamespace(completions=ScriptedCompletions(
+                [(delay, 'SELL')])))
+            elapsed = time.time() - main.decision_budget_anchor(price_data)
+            main.TRADE_CONFIG['decision_budget'].update(enable_budget=True, budget_seconds=elapsed + 0.4,
+                                                       min_llm_seconds=0.1)
+            signal_data = main.decide_signal_within_budget(price_data)
+            time.sleep(delay + 0.2)  # 等后台线程结束
+            assert len(main.signal_history) == 1 and main.signal_history[0] is signal_data
+            assert (signal_data['signal'] == 'SELL') == (expected == 'DeepSeek')
+    finally:
+        main.deepseek_client, main.get_current_position = saved[0], saved[1]
+        main.TRADE_CONFIG['decision_budget'].clear()
+        main.TRADE_CONFIG['decision_budget'].update(saved[2])
+        main.signal_history[:] = saved[3]
+
+
+class FakeAsyncExchange:
+    """异步交易所适配器桩：记录请求并立即返回结果"""
+
+    def __init__(self, positions):
+        self.positions = positions
+        self.calls = []
+
+    def submit(self, method, *args, **kwargs):
+        from concurrent.futures import Future
+        self.calls.append(method)
+        future = Future()
+        future.set_result(self.positions if method == 'fetch_positions' else {'last': 100.0})
+        return future
+
+
+def test_risk_monitor_reads_through_async_exchange():
+    """盘中风控经异步适配器读取价格与持仓；无私有推送时每次检查都读持仓，止盈止损委托触发后立即重读"""
+    symbol = main.TRADE_CONFIG['symbol']
+    positions = [{'symbol': symbol, 'contracts': 1, 'side': 'long', 'entryPrice': 100.0,
+                  'unrealizedPnl': 0, 'leverage': 5}]
+    saved = (main.async_exchange, main.exchange, main.manage_position_risk, main.market_feed,
+             main.order_events.stream, dict(main.position_management))
+    try:
+        main.async_exchange = FakeAsyncExchange(positions)
+        main.exchange = None  # 风控线程不得使用同步exchange
+        main.manage_position_risk = lambda position, price_data: False
+        main.market_feed = None
+        monitor = main.RiskMonitor({'position_refresh': 30.0})
+        main.order_events.add_listener(monitor._on_order_event)
+
+        main.order_events.stream = None
+        assert monitor.check_once() and monitor.check_once()
+        assert main.async_exchange.calls.count('fetch_positions') == 2
+        assert 'fetch_ticker' in main.async_exchange.calls
+
+        main.order_events.stream = SimpleNamespace(connected=True)
+        monitor.check_once()
+        assert main.async_exchange.calls.count('fetch_positions') == 2  # 推送在线时使用缓存
+
+        main.async_exchange.positions = []
+        main.order_events._on_message({'arg': {'channel': 'orders-algo'},
+                                       'data': [{'algoId': 'A1', 'state': 'effective'}]})
+        monitor.check_once()
+        assert main.async_exchange.calls.count('fetch_positions') == 3
+        assert monitor._position is None
+    finally:
+        (main.async_exchange, main.exchange, main.manage_position_risk, main.market_feed,
+         main.order_events.stream, management) = saved
+        main.order_events._listeners[:] = []
+        main.position_management.clear()
+        main.position_management.update(management)
+
+
+def feed_in_chunks(text, cuts):
+    """按cuts中的位置把text切成多块依次喂给解析器"""
+    parser = main.StreamingSignalParser()
+    bounds = [0] + sorted(cuts) + [len(text)]
+    for start, end in zip(bounds, bounds[1:]):
+        parser.feed(text[start:end])
+    return parser
+
+
+def test_streaming_parser_chunk_boundaries():
+    """任意位置切块（含转义引号中间、裸数字结尾、嵌套值内部）解析结果都与一次性解析相同"""
+    text = ('{"signal": "BUY", "confidence": "HIGH",\n"stop_loss": 95.5\n, "take_profit": 110,\n'
+            '"levels": {"support": [94, 95], "note": "a}b\\"]"},\n'
+            '"reason": "突破\\"前高\\"，量能放大"}')
+    expected = {'signal': 'BUY', 'confidence': 'HIGH', 'stop_loss': 95.5, 'take_profit': 110,
+                'levels': {'support': [94, 95], 'note': 'a}b"]'}, 'reason': '突破"前高"，量能放大'}
+    escaped_quote = text.index('\\"前高')
+    for cut in range(len(text) + 1):
+        assert feed_in_chunks(text, [cut]).fields == expected, cut
+    assert feed_in_chunks(text, [escaped_quote + 1]).fields['reason'] == expected['reason']  # 切在 \ 与 " 之间
+    assert feed_in_chunks(text, list(range(len(text)))).fields == expected  # 逐字符
+
+    # 裸数字以换行或 } 结尾
+    parser = feed_in_chunks('{"stop_loss": 95\n,"take_profit": 1.5e2}', [15, 16])
+    assert parser.fields == {'stop_loss': 95, 'take_profit': 150.0}
+    assert parser._state == 'done'
+
+
+def test_streaming_parser_decision_before_reason():
+    """决策字段先于reason到达时即可决策，reason可取到已接收的部分"""
+    parser = main.StreamingSignalParser()
+    parser.feed('```json\n{"signal": "SELL", "confidence": "MEDIUM", "stop_loss": 105, ')
+    assert not parser.decision_ready()
+    parser.feed('"take_profit": 90, "reason": "跌破支')
+    assert parser.decision_ready()
+    assert parser.fields['take_profit'] == 90 and parser.partial_reason() == '跌破支'
+    parser.feed('撑"}\n```')
+    assert parser.fields['reason'] == '跌破支撑'
+
+
+class StreamingCompletions:
+    """流式回复桩：按给定文本块逐块返回"""
+
+    def __init__(self, pieces):
+        self.pieces = pieces
+
+    def create(self, **kwargs):
+        return iter(SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=piece))], usage=None)
+                    for piece in self.pieces)
+
+
+def test_stream_signal_completion_does_not_mutate_returned_signal():
+    """后台补全reason时回调新字典，已返回（可能已写入信号历史）的信号不被修改"""
+    import threading
+    saved = main.deepseek_client
+    completed = {}
+    done = threading.Event()
+
+    def on_complete(text, signal_data):
+        completed['signal'] = signal_data
+        done.set()
+
+    try:
+        main.deepseek_client = SimpleNamespace(chat=SimpleNamespace(completions=StreamingCompletions(
+            ['{"signal": "BUY", "confidence": "HIGH", "stop_loss": 95, "take_profit": 110, ',
+             '"reason": "放量', '突破"}'])))
+        signal_data = main.stream_deepseek_signal([], make_price_data(), on_complete)
+        snapshot = dict(signal_data)
+        assert done.wait(2)
+        assert completed['signal'] is not signal_data
+        assert completed['signal']['reason'] == '放量突破'
+        assert signal_data == snapshot
+    finally:
+        main.deepseek_client = saved
+
+
+def test_safe_json_parse_tolerates_llm_quirks():
+    """容错解析：单引号、无引号键与取值、尾随逗号、reason中的原始换行与冒号、说明文字或代码块包裹"""
+    expected = {'signal': 'BUY', 'reason': '突破前高', 'stop_loss': 95, 'take_profit': 110.5, 'confidence': 'HIGH'}
+    cases = [
+        "{'signal': 'BUY', 'reason': '突破前高', 'stop_loss': 95, 'take_profit': 110.5, 'confidence': 'HIGH'}",
+        '{signal: BUY, reason: 突破前高, stop_loss: 95, take_profit: 110.5, confidence: HIGH}',
+        '{"signal": "BUY", "reason": "突破前高", "stop_loss": 95, "take_profit": 110.5, "confidence": "HIGH",}',
+        '{"signal": "BUY",\n "reason": "突破前高",\n "stop_loss": 95,\n "take_profit": 110.5,\n "confidence": "HIGH"\n,}',
+        '根据分析，建议如下：\n{"signal": "BUY", "reason": "突破前高", "stop_loss": 95, '
+        '"take_profit": 110.5, "confidence": "HIGH"}\n以上仅供参考。',
+        '```json\n{"signal": "BUY", "reason": "突破前高", "stop_loss": 95, "take_profit": 110.5, '
+        '"confidence": "HIGH"}\n```',
+    ]
+    for text in cases:
+        assert main.safe_json_parse(text) == expected, text
+
+    # reason中含原始换行、冒号与引号（原实现全局替换冒号会破坏这类字符串）
+    text = ('{"signal": "SELL", "reason": "关键位: 65000\n时间: 12:30，RSI: 78 \'超买\'", '
+            '"stop_loss": 66000, "take_profit": 63000, confidence: MEDIUM}')
+    parsed = main.safe_json_parse(text)
+    assert parsed['reason'] == "关键位: 65000\n时间: 12:30，RSI: 78 '超买'"
+    assert parsed['signal'] == 'SELL' and parsed['confidence'] == 'MEDIUM'
+    assert parsed['stop_loss'] == 66000 and parsed['take_profit'] == 63000
+
+    parsed = main.safe_json_parse("{'reason': '时间: 09:15, 价格: 1.5', 'levels': [1, 2,], 'ok': true}")
+    assert parsed == {'reason': '时间: 09:15, 价格: 1.5', 'levels': [1, 2], 'ok': True}
+    assert main.safe_json_parse('没有JSON') is None
+
+
+class StopOrderExchange:
+    """止损委托接口桩：fail=True时修改与挂单都被交易所拒绝"""
+
+    def __init__(self, fail):
+        self.fail = fail
+        self.amended = []
+
+    def market(self, symbol):
+        return {'id': 'BTC-USDT-SWAP'}
+
+    def price_to_precision(self, symbol, price):
+        return f"{price:.1f}"
+
+    def privateGetTradeOrdersAlgoPending(self, request):
+        return {'data': [{'algoId': 'A1', 'ordType': 'oco', 'slTriggerPx': '95', 'tpTriggerPx': '130',
+                          'posSide': 'long'}]}
+
+    def privatePostTradeAmendAlgos(self, request):
+        self.amended.append(request['newSlTriggerPx'])
+        return {'data': [{'sCode': '51000' if self.fail else '0', 'sMsg': 'rejected'}]}
+
+    def privatePostTradeOrderAlgo(self, request):
+        return {'data': [{'sCode': '51000', 'sMsg': 'rejected'}]}
+
+
+def test_trailing_stop_restored_when_exchange_rejects():
+    saved = (main.exchange, main.stop_orders, dict(main.position_management))
+    position = {'side': 'long', 'size': 1.0, 'entry_price': 100.0, 'unrealized_pnl': 0.0}
+    try:
+        for fail, expected in ((True, 95.0), (False, 100.0)):
+            main.exchange = StopOrderExchange(fail)
+            main.stop_orders = main.StopOrderManager()
+            main.position_management.update(current_stop_loss=95.0, initial_stop_loss=95.0)
+            result = main.apply_trailing_stop(position, {'price': 106.0})  # 浮盈6%，止损应移到成本价
+            assert main.position_management['current_stop_loss'] == expected
+            assert result == (None if fail else 100.0)
+            assert main.exchange.amended == ['100.0']
+    finally:
+        main.exchange, main.stop_orders = saved[0], saved[1]
+        main.position_management.clear()
+        main.position_management.update(saved[2])
+
+
+if __name__ == '__main__':
+    for name, func in list(globals().items()):
+        if name.startswith('test_') and callable(func):
+            func()
+            print(f"✅ {name}")